@@ -1,8 +1,41 @@
 from datetime import datetime
 import logging
-from typing import Dict, Optional
-import json
+import os
+import threading
+from functools import wraps
+from typing import Dict, List, Optional
 from enum import Enum
+from .timing_wheel import TimingWheel
+from .validation import TAB_INFO, TAB_UPDATE
+from ..utils.logs import setup_logging
+from ..utils.profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+
+def recorded_event(kind: int):
+    """
+    Marks a tracker handler whose raw input goes into the event log (when
+    one is configured). Only the outermost handler call is recorded, so a
+    visibility change that turns into a tab activation is logged once.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(self, tab_info, *args):
+            # Per thread: another window's handler may be running alongside
+            depth = getattr(self._local, 'event_depth', 0)
+            if depth == 0 and self.event_log_path:
+                try:
+                    self._record_event(kind, tab_info, args[0] if args else False)
+                except Exception as e:
+                    logger.error("Couldn't write to event log: %s", e)
+            self._local.event_depth = depth + 1
+            try:
+                return handler(self, tab_info, *args)
+            finally:
+                self._local.event_depth = depth
+        return wrapper
+    return decorator
 
 class BrowserType(Enum):
     CHROMIUM_DESKTOP = "chromium_desktop"
@@ -24,29 +57,126 @@ class ActivityTracker:
     
     Think of it like a smart stopwatch - it knows when to start/stop based on
     what the user is actually doing, not just if a tab is open.
+
+    Construction is cheap on purpose: the saved state is only read the first
+    time something actually needs it, so short-lived workers that never see
+    an event never pay for it.
+
+    Open sessions live in the same SQLite database as the finished
+    activities, and each tab switch updates both in one transaction.
+
+    Tabs that vanish without a deactivation event (closed tab, browser
+    crash) would otherwise stay open forever. Every open session has an
+    idle timer on a timing wheel; once it runs out the session is closed
+    with an estimated end time, and at most max_active_tabs stay open.
+
+    With event_log_path set, the raw input of every handler is appended to
+    an event log too, so activities can be re-derived later with improved
+    logic (see backend.core.replay).
+
+    Pass storage to use something other than the SQLite file at db_path
+    (e.g. a MemoryBackend). The tracker leaves closing it to the caller.
+
+    Windows are tracked independently: each has its own front tab, and
+    activating a tab only closes the previous front tab of the same window
+    (a window losing focus closes its own through handle_window_focus).
+    Handlers are safe to call from several threads. A window's state is
+    guarded by one of lock_stripes locks picked by its window_id, so events
+    for different windows rarely wait on each other. The storage takes one
+    writer at a time, but a handler only needs it for the write itself -
+    the records are built (and hashed/encrypted) before, and memory is
+    updated after. last_active is the most recently activated tab in any
+    window.
     """
 
-    def __init__(self, db_path: str = "activity.db"):
+    def __init__(self, db_path: str = "activity.db", idle_timeout: float = 1800,
+                 max_active_tabs: int = 1000, event_log_path: Optional[str] = None,
+                 storage=None, lock_stripes: int = 16):
         # Where we'll store everything
         self.db_path = db_path
+        self.storage = storage
+        self._owns_storage = storage is None
+
+        # Raw events, for replaying later (opened on first event)
+        self.event_log_path = event_log_path
+        self.event_log = None
+        self._event_log_lock = threading.Lock()
+        self._local = threading.local()
         
-        # Keep track of what's happening
-        self.active_tabs = {}
-        self.last_active = None
+        # Keep track of what's happening (loaded lazily, see _ensure_state)
+        self._active_tabs = {}
+        self._last_active = None
+        self._front_tabs = {}  # window_id -> that window's front tab_info
+        self._state_loaded = False
+        self._state_loading = False
+        self._state_lock = threading.RLock()
+
+        # Lock striping: a window only ever holds its own stripe, one at a time
+        self._stripes = [threading.RLock() for _ in range(max(lock_stripes, 1))]
+
+        # Idle expiry for sessions nobody closed
+        self.idle_timeout = idle_timeout
+        self.max_active_tabs = max_active_tabs
+        self._idle_timers = TimingWheel(tick_seconds=max(idle_timeout / 256, 0.001), slots=512,
+                                        now=self._now())
+        self._timer_lock = threading.Lock()
         
         # Set up our safety nets
         self._setup_logging()
-        self._setup_storage()
+
+    @property
+    def active_tabs(self) -> Dict:
+        self._ensure_state()
+        return self._active_tabs
+
+    @active_tabs.setter
+    def active_tabs(self, value: Dict):
+        # Assigning replaces whatever was saved, so there's nothing left to load
+        self._state_loaded = True
+        self._active_tabs = value
+        self._front_tabs = {}
+
+    @property
+    def last_active(self) -> Optional[Dict]:
+        self._ensure_state()
+        return self._last_active
+
+    @last_active.setter
+    def last_active(self, value: Optional[Dict]):
+        self._last_active = value
+
+    def front_tab(self, window_id) -> Optional[Dict]:
+        """The tab in front in a window, if we've seen one"""
+        self._ensure_state()
+        return self._front_tabs.get(window_id)
+
+    def _ensure_state(self):
+        """Loads the saved state the first time anyone looks at it"""
+        if self._state_loaded:
+            return
+        # Other threads wait for the load; the loading thread itself gets through
+        with self._state_lock:
+            if self._state_loaded or self._state_loading:
+                return
+            self._state_loading = True
+            try:
+                self._setup_storage()
+            finally:
+                self._state_loaded = True
+                self._state_loading = False
+
+    def _window_lock(self, window_id) -> threading.RLock:
+        """The stripe guarding a window's state"""
+        return self._stripes[hash(window_id) % len(self._stripes)]
         
     def _setup_logging(self):
         """
         Sets up our error catching and debugging - because things will go wrong!
+        Records go to tracker.log from a background thread, so a handler
+        never waits on the disk, and a repeating error is only written once
+        a minute.
         """
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(message)s',
-            filename='tracker.log'
-        )
+        setup_logging('tracker.log')
         
     def _setup_storage(self):
         """
@@ -56,10 +186,47 @@ class ActivityTracker:
             # Load any previous state if we crashed
             self._load_state()
         except Exception as e:
-            logging.error(f"Had trouble loading previous state: {str(e)}")
+            logger.error("Had trouble loading previous state: %s", e)
             # Start fresh if we have to
             self.active_tabs = {}
 
+    def _get_storage(self):
+        """Opens the database the first time we need it"""
+        if self.storage is None:
+            # Imported here so constructing a tracker doesn't load sqlite
+            from ..database.storage_manager import StorageManager
+            self.storage = StorageManager(
+                platform_type=getattr(self, 'platform_type', PlatformType.DESKTOP.value),
+                engine_type=getattr(self, 'browser_type', BrowserType.CHROMIUM_DESKTOP.value),
+                db_path=self.db_path
+            )
+        return self.storage
+
+    def close(self):
+        """Closes the database (and event log) if we opened them"""
+        if self.event_log is not None:
+            self.event_log.close()
+            self.event_log = None
+        if self.storage is not None and self._owns_storage:
+            self.storage.close()
+            self.storage = None
+
+    def _now(self) -> float:
+        """Current time. Replays swap this for the recorded event time."""
+        return datetime.now().timestamp()
+
+    def _record_event(self, kind: int, tab_info: Dict, flag: bool = False):
+        """Appends one raw event to the event log"""
+        with self._event_log_lock:
+            if self.event_log is None:
+                from .event_log import EventLogWriter
+                self.event_log = EventLogWriter(
+                    self.event_log_path, type(self).__name__,
+                    getattr(self, 'platform_type', PlatformType.DESKTOP.value)
+                )
+            self.event_log.append(kind, self._now(), tab_info, flag)
+
+    @profiled
     def track_tab_change(self, tab_info: Dict) -> bool:
         """
         Keeps track when someone switches tabs.
@@ -73,84 +240,245 @@ class ActivityTracker:
                 return False
                 
             # Record the change
-            timestamp = datetime.now().timestamp()
-            
-            # If we had a previous tab active, mark it as inactive
-            if self.last_active:
-                self._handle_tab_deactivation(self.last_active, timestamp)
-            
-            # Mark this new tab as active
-            self.last_active = tab_info
-            self.active_tabs[tab_info['tab_id']] = {
-                'start_time': timestamp,
-                'url': tab_info['url'],
-                'browser_type': tab_info['browser_type']
-            }
-            
-            # Save our current state in case of crashes
-            self._save_state()
-            
+            timestamp = self._now()
+            self._ensure_state()
+            tab_id = tab_info['tab_id']
+            window_id = tab_info['window_id']
+
+            # Close anything that's been sitting idle too long. Those sessions
+            # may be in any window, so this happens before taking our own lock
+            self.expire_idle_sessions(timestamp)
+
+            # A tab dragged in from another window closes over there first
+            session = self.active_tabs.get(tab_id)
+            if session and session.get('window_id', window_id) != window_id:
+                self._close_dangling_session(tab_id, timestamp)
+            # State saved before windows were tracked apart has one front tab
+            # for all of them; whichever window comes first takes over
+            if window_id is not None and None in self._front_tabs:
+                with self._window_lock(None):
+                    legacy = self._front_tabs.pop(None, None)
+                    if legacy:
+                        self._handle_tab_deactivation(legacy, timestamp)
+
+            with self._window_lock(window_id):
+                # If the window had a front tab, it becomes inactive
+                front = self._front_tabs.get(window_id)
+                finished = self._finished_activity(front, timestamp) if front else None
+                session = {
+                    'start_time': timestamp,
+                    'url': tab_info['url'],
+                    'browser_type': tab_info['browser_type'],
+                    'window_id': window_id
+                }
+
+                # Save our current state in case of crashes. Only this takes
+                # the storage (other windows' writes wait on it, nothing else)
+                self._save_state(tab_info, session, front, finished)
+
+                # Saved, so mark this new tab as active
+                if finished is not None:
+                    self._forget_session(front['tab_id'])
+                self._front_tabs[window_id] = tab_info
+                self.last_active = tab_info
+                self.active_tabs[tab_id] = session
+                with self._timer_lock:
+                    self._idle_timers.schedule(tab_id, timestamp + self.idle_timeout)
+
+            self._enforce_tab_limit()
             return True
             
         except Exception as e:
-            logging.error(f"Problem tracking tab change: {str(e)}")
+            logger.error("Problem tracking tab change: %s", e)
             return False
             
     def _validate_tab_info(self, tab_info: Dict) -> bool:
         """
-        Makes sure we got all the info we need about a tab.
+        Makes sure we got all the info we need about a tab, of the right types.
         """
-        required = ['url', 'browser_type', 'tab_id', 'window_id']
-        return all(key in tab_info for key in required)
+        return TAB_INFO.is_valid(tab_info)
+
+    def _is_valid_update(self, tab_info: Dict) -> bool:
+        """
+        Validates tab update information.
+        Ensures we're not tracking unnecessary updates.
+        """
+        # handle_tab_updates has checked its whole batch already
+        if not getattr(self._local, 'updates_checked', False) and not TAB_UPDATE.is_valid(tab_info):
+            return False
+
+        # Check if this is a real URL change
+        front = self.front_tab(tab_info['window_id'])
+        return not (front and front.get('url') == tab_info['url'])
+
+    def handle_tab_updates(self, batch: List) -> Dict[int, List[str]]:
+        """
+        Handles a batch of tab updates (e.g. from a sync upload), in order.
+        The whole batch is checked up front; returns why each rejected
+        update was rejected, by its position in the batch.
+        """
+        valid, rejected = TAB_UPDATE.validate_batch(batch)
+        positions = [index for index in range(len(batch)) if index not in rejected]
+        self._local.updates_checked = True
+        try:
+            for index, tab_info in zip(positions, valid):
+                if not self.handle_tab_updated(tab_info):
+                    rejected[index] = ["not tracked (same URL, private or failed to save)"]
+        finally:
+            self._local.updates_checked = False
+        return dict(sorted(rejected.items()))
 
     def _handle_tab_deactivation(self, tab_info: Dict, end_time: float):
         """
         Handles when a tab becomes inactive - saves how long it was open.
         """
         tab_id = tab_info['tab_id']
-        if tab_id in self.active_tabs:
-            start_time = self.active_tabs[tab_id]['start_time']
-            duration = end_time - start_time
-            
-            # Save this activity period
-            self._save_activity(tab_info, start_time, end_time, duration)
-            
-            # Clean up
-            del self.active_tabs[tab_id]
+        session = self.active_tabs.get(tab_id)
+        if session is None:
+            return
+        # The session knows its window even when the caller's tab_info doesn't
+        with self._window_lock(session.get('window_id')):
+            finished = self._finished_activity(tab_info, end_time)
+            if finished is not None:
+                # Save this activity period, dropping the open session with it
+                self._get_storage().close_session(tab_id, finished)
+                self._forget_session(tab_id)
 
-    def _save_activity(self, tab_info: Dict, start: float, end: float, duration: float):
+    def _forget_session(self, tab_id):
+        """Drops a closed session from memory"""
+        del self.active_tabs[tab_id]
+        with self._timer_lock:
+            self._idle_timers.cancel(tab_id)
+
+    def expire_idle_sessions(self, now: Optional[float] = None) -> int:
+        """
+        Closes sessions whose idle timer ran out. The end time is estimated
+        as start + idle_timeout: we know the tab was in front at least until
+        then, and can't know anything after. Long-running hosts can call this
+        from a periodic timer; it's also run on every tab change.
+        Returns how many sessions were closed.
+        """
+        now = self._now() if now is None else now
+        with self._timer_lock:
+            expired = self._idle_timers.advance(now)
+        for tab_id, deadline in expired:
+            self._close_dangling_session(tab_id, min(now, deadline))
+        return len(expired)
+
+    def _enforce_tab_limit(self):
+        """Closes the sessions closest to timing out once we're over max_active_tabs"""
+        while len(self.active_tabs) > self.max_active_tabs:
+            with self._timer_lock:
+                earliest = self._idle_timers.earliest()
+                if earliest is None:
+                    break
+                tab_id, deadline = earliest
+                self._idle_timers.cancel(tab_id)
+            self._close_dangling_session(tab_id, min(deadline, self._now()))
+
+    def _close_dangling_session(self, tab_id, end_time: float):
+        """Closes a session we never got a deactivation event for"""
+        session = self.active_tabs.get(tab_id)
+        if session is None:
+            return
+        window_id = session.get('window_id')
+        with self._window_lock(window_id):
+            # It may have been closed while we waited for the lock
+            session = self.active_tabs.get(tab_id)
+            if session is None:
+                return
+            front = self._front_tabs.get(window_id)
+            if front and front.get('tab_id') == tab_id:
+                tab_info = front
+                del self._front_tabs[window_id]
+            else:
+                tab_info = {'tab_id': tab_id, 'url': session.get('url'),
+                            'browser_type': session.get('browser_type'), 'window_id': window_id}
+            last_active = self.last_active
+            if last_active and last_active.get('tab_id') == tab_id:
+                tab_info = last_active
+                self.last_active = None
+            logger.info("Closing idle session for tab %s", tab_id)
+            self._handle_tab_deactivation(tab_info, max(end_time, session['start_time']))
+
+    def _finished_activity(self, tab_info: Dict, end_time: float) -> Optional[Dict]:
         """
-        Saves the record of tab activity to our database.
+        The activity record for a tab's session ending at end_time (None if
+        it has no open session). Nothing is saved yet.
         """
-        # Implementation will connect to our database
-        pass
+        session = self.active_tabs.get(tab_info['tab_id'])
+        if session is None:
+            return None
+        start_time = session['start_time']
+        return {
+            'url': session.get('url', tab_info.get('url')),
+            'title': tab_info.get('title'),
+            'start_time': start_time,
+            'end_time': end_time,
+            'duration': end_time - start_time,
+            'is_active': False,
+            'tab_id': tab_info['tab_id'],
+            'platform_type': tab_info.get('platform_type'),
+            'engine_type': session.get('browser_type') or tab_info.get('browser_type')
+        }
 
-    def _save_state(self):
+    @profiled
+    def _save_state(self, tab_info: Dict, session: Dict, closed: Optional[Dict] = None,
+                    finished: Optional[Dict] = None):
         """
         Saves our current state in case we crash.
+        Only what changed is written: the new front tab's session, and the
+        one it replaces closed as finished, in one transaction.
+        Errors propagate so nothing in memory changes.
         """
-        try:
-            state = {
-                'active_tabs': self.active_tabs,
-                'last_active': self.last_active
-            }
-            with open(f"{self.db_path}.state", 'w') as f:
-                json.dump(state, f)
-        except Exception as e:
-            logging.error(f"Couldn't save state: {str(e)}")
+        self._get_storage().switch_session(closed and closed['tab_id'], finished,
+                                           tab_info['tab_id'], session, tab_info)
 
     def _load_state(self):
         """
         Loads our previous state after a crash.
         """
+        self._import_legacy_state()
+        self.active_tabs, front_tabs = self._get_storage().load_open_sessions()
+        # Keyed by the session's window, which older sessions don't have
+        self._front_tabs = {self.active_tabs[tab_info['tab_id']].get('window_id'): tab_info
+                            for tab_info in front_tabs if tab_info.get('tab_id') in self.active_tabs}
+        self.last_active = front_tabs[-1] if front_tabs else None
+        with self._timer_lock:
+            for tab_id, session in self.active_tabs.items():
+                self._idle_timers.schedule(tab_id, session['start_time'] + self.idle_timeout)
+
+    def _import_legacy_state(self):
+        """
+        Moves state from the old <db_path>.state JSON file into the database,
+        then removes the file. A corrupt file is logged and dropped; if the
+        database write fails the file stays, to be tried again next start.
+        """
+        legacy_path = f"{self.db_path}.state"
+        if not os.path.exists(legacy_path):
+            # Nothing to import - no problem!
+            return
+
+        import json
         try:
-            with open(f"{self.db_path}.state", 'r') as f:
+            with open(legacy_path, 'r') as f:
                 state = json.load(f)
-                self.active_tabs = state.get('active_tabs', {})
-                self.last_active = state.get('last_active')
-        except FileNotFoundError:
-            # First time running - no problem!
-            pass
+            last_active = state.get('last_active') or {}
+            active_tabs = state.get('active_tabs', {})
+        except Exception as e:
+            logger.error("Couldn't read old state file, dropping it: %s", e)
+            os.remove(legacy_path)
+            return
+
+        try:
+            storage = self._get_storage()
+            with storage.transaction():
+                for tab_id, session in active_tabs.items():
+                    is_last = last_active.get('tab_id') == tab_id
+                    storage.open_session(tab_id, session,
+                                         last_active if is_last else {'tab_id': tab_id}, is_last)
         except Exception as e:
-            logging.error(f"Couldn't load state: {str(e)}")
-            raise
\ No newline at end of file
+            logger.error("Couldn't import old state file, keeping it for next time: %s", e)
+            return
+        # Only once the sessions are committed - it's the only copy of them
+        os.remove(legacy_path)
\ No newline at end of file
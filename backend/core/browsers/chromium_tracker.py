@@ -1,7 +1,10 @@
-from ...core.activity_tracker import ActivityTracker, BrowserType, PlatformType
+from ...core.activity_tracker import ActivityTracker, BrowserType, PlatformType, recorded_event
+from ...core.event_log import (EVENT_TAB_ACTIVATED, EVENT_TAB_UPDATED, EVENT_VISIBILITY,
+                              EVENT_WINDOW_FOCUS)
 from typing import Dict, Optional
 import logging
-from datetime import datetime
+
+logger = logging.getLogger(__name__)
 
 class ChromiumTracker(ActivityTracker):
     """
@@ -9,8 +12,8 @@ class ChromiumTracker(ActivityTracker):
     Handles Chromium-specific APIs and behaviors
     """
     
-    def __init__(self, platform_type: str, db_path: str = "activity.db"):
-        super().__init__(db_path)
+    def __init__(self, platform_type: str, db_path: str = "activity.db", **tracker_options):
+        super().__init__(db_path, **tracker_options)
         self.platform_type = platform_type
         self.browser_type = (BrowserType.CHROMIUM_MOBILE.value if platform_type == PlatformType.MOBILE.value 
                            else BrowserType.CHROMIUM_DESKTOP.value)
@@ -25,7 +28,7 @@ class ChromiumTracker(ActivityTracker):
             self._setup_window_listeners()
             self._setup_visibility_listeners()
         except Exception as e:
-            logging.error(f"Failed to setup Chromium listeners: {str(e)}")
+            logger.error("Failed to setup Chromium listeners: %s", e)
             raise
 
     def _setup_tab_listeners(self):
@@ -49,6 +52,7 @@ class ChromiumTracker(ActivityTracker):
         """
         pass
 
+    @recorded_event(EVENT_TAB_ACTIVATED)
     def handle_tab_activated(self, tab_info: Dict) -> bool:
         """
         Handles when a tab becomes active.
@@ -59,9 +63,10 @@ class ChromiumTracker(ActivityTracker):
             tab_info['platform_type'] = self.platform_type
             return self.track_tab_change(tab_info)
         except Exception as e:
-            logging.error(f"Failed to handle tab activation: {str(e)}")
+            logger.error("Failed to handle tab activation: %s", e)
             return False
 
+    @recorded_event(EVENT_TAB_UPDATED)
     def handle_tab_updated(self, tab_info: Dict) -> bool:
         """
         Handles when a tab's URL changes.
@@ -75,9 +80,10 @@ class ChromiumTracker(ActivityTracker):
             tab_info['platform_type'] = self.platform_type
             return self.track_tab_change(tab_info)
         except Exception as e:
-            logging.error(f"Failed to handle tab update: {str(e)}")
+            logger.error("Failed to handle tab update: %s", e)
             return False
 
+    @recorded_event(EVENT_VISIBILITY)
     def handle_visibility_change(self, tab_info: Dict, is_visible: bool) -> bool:
         """
         Handles document visibility changes.
@@ -85,13 +91,14 @@ class ChromiumTracker(ActivityTracker):
         """
         try:
             if not is_visible:
-                self._handle_tab_deactivation(tab_info, datetime.now().timestamp())
+                self._handle_tab_deactivation(tab_info, self._now())
                 return True
             return self.handle_tab_activated(tab_info)
         except Exception as e:
-            logging.error(f"Failed to handle visibility change: {str(e)}")
+            logger.error("Failed to handle visibility change: %s", e)
             return False
 
+    @recorded_event(EVENT_WINDOW_FOCUS)
     def handle_window_focus(self, tab_info: Dict, has_focus: bool) -> bool:
         """
         Handles window focus changes.
@@ -99,27 +106,12 @@ class ChromiumTracker(ActivityTracker):
         """
         try:
             if not has_focus:
-                self._handle_tab_deactivation(tab_info, datetime.now().timestamp())
+                self._handle_tab_deactivation(tab_info, self._now())
                 return True
             return self.handle_tab_activated(tab_info)
         except Exception as e:
-            logging.error(f"Failed to handle window focus: {str(e)}")
-            return False
-
-    def _is_valid_update(self, tab_info: Dict) -> bool:
-        """
-        Validates tab update information.
-        Ensures we're not tracking unnecessary updates.
-        """
-        required_fields = ['url', 'tab_id', 'window_id']
-        if not all(field in tab_info for field in required_fields):
-            return False
-            
-        # Check if this is a real URL change
-        if self.last_active and self.last_active.get('url') == tab_info['url']:
+            logger.error("Failed to handle window focus: %s", e)
             return False
-            
-        return True
 
     def _handle_private_mode(self, tab_info: Dict) -> bool:
         """
@@ -1,7 +1,10 @@
-from ...core.activity_tracker import ActivityTracker, BrowserType, PlatformType
+from ...core.activity_tracker import ActivityTracker, BrowserType, PlatformType, recorded_event
+from ...core.event_log import (EVENT_TAB_ACTIVATED, EVENT_TAB_UPDATED, EVENT_VISIBILITY,
+                              EVENT_WINDOW_FOCUS)
 from typing import Dict, Optional
 import logging
-from datetime import datetime
+
+logger = logging.getLogger(__name__)
 
 class WebKitTracker(ActivityTracker):
     """
@@ -9,8 +12,8 @@ class WebKitTracker(ActivityTracker):
     Handles Safari's strict privacy and platform-specific restrictions
     """
     
-    def __init__(self, platform_type: str, db_path: str = "activity.db"):
-        super().__init__(db_path)
+    def __init__(self, platform_type: str, db_path: str = "activity.db", **tracker_options):
+        super().__init__(db_path, **tracker_options)
         self.platform_type = platform_type
         self.browser_type = (BrowserType.WEBKIT_MOBILE.value if platform_type == PlatformType.MOBILE.value 
                            else BrowserType.WEBKIT_DESKTOP.value)
@@ -26,7 +29,7 @@ class WebKitTracker(ActivityTracker):
             self._setup_visibility_listeners()
             self._check_permissions()
         except Exception as e:
-            logging.error(f"Failed to setup WebKit listeners: {str(e)}")
+            logger.error("Failed to setup WebKit listeners: %s", e)
             raise
 
     def _check_permissions(self):
@@ -38,9 +41,9 @@ class WebKitTracker(ActivityTracker):
             # Real implementation will check Safari's permission API
             # For now, assume restricted mode
             self.restricted_mode = True
-            logging.info("Operating in restricted mode due to Safari privacy settings")
+            logger.info("Operating in restricted mode due to Safari privacy settings")
         except Exception as e:
-            logging.error(f"Permission check failed: {str(e)}")
+            logger.error("Permission check failed: %s", e)
             self.restricted_mode = True
 
     def _setup_tab_listeners(self):
@@ -64,6 +67,7 @@ class WebKitTracker(ActivityTracker):
         """
         pass
 
+    @recorded_event(EVENT_TAB_ACTIVATED)
     def handle_tab_activated(self, tab_info: Dict) -> bool:
         """
         Handles when a tab becomes active.
@@ -82,9 +86,10 @@ class WebKitTracker(ActivityTracker):
             
             return self.track_tab_change(tab_info)
         except Exception as e:
-            logging.error(f"Failed to handle tab activation: {str(e)}")
+            logger.error("Failed to handle tab activation: %s", e)
             return False
 
+    @recorded_event(EVENT_TAB_UPDATED)
     def handle_tab_updated(self, tab_info: Dict) -> bool:
         """
         Handles when a tab's URL changes.
@@ -105,9 +110,10 @@ class WebKitTracker(ActivityTracker):
                 
             return self.track_tab_change(tab_info)
         except Exception as e:
-            logging.error(f"Failed to handle tab update: {str(e)}")
+            logger.error("Failed to handle tab update: %s", e)
             return False
 
+    @recorded_event(EVENT_VISIBILITY)
     def handle_visibility_change(self, tab_info: Dict, is_visible: bool) -> bool:
         """
         Handles document visibility changes.
@@ -118,13 +124,14 @@ class WebKitTracker(ActivityTracker):
                 return False
                 
             if not is_visible:
-                self._handle_tab_deactivation(tab_info, datetime.now().timestamp())
+                self._handle_tab_deactivation(tab_info, self._now())
                 return True
             return self.handle_tab_activated(tab_info)
         except Exception as e:
-            logging.error(f"Failed to handle visibility change: {str(e)}")
+            logger.error("Failed to handle visibility change: %s", e)
             return False
 
+    @recorded_event(EVENT_WINDOW_FOCUS)
     def handle_window_focus(self, tab_info: Dict, has_focus: bool) -> bool:
         """
         Handles window focus changes.
@@ -135,11 +142,11 @@ class WebKitTracker(ActivityTracker):
                 return False
                 
             if not has_focus:
-                self._handle_tab_deactivation(tab_info, datetime.now().timestamp())
+                self._handle_tab_deactivation(tab_info, self._now())
                 return True
             return self.handle_tab_activated(tab_info)
         except Exception as e:
-            logging.error(f"Failed to handle window focus: {str(e)}")
+            logger.error("Failed to handle window focus: %s", e)
             return False
 
     def _is_tracking_allowed(self, tab_info: Dict) -> bool:
@@ -171,20 +178,6 @@ class WebKitTracker(ActivityTracker):
         """
         return tab_info.get('private', False)
 
-    def _is_valid_update(self, tab_info: Dict) -> bool:
-        """
-        Validates tab update information.
-        Safari provides limited tab information.
-        """
-        required_fields = ['url', 'tab_id', 'window_id']
-        if not all(field in tab_info for field in required_fields):
-            return False
-            
-        if self.last_active and self.last_active.get('url') == tab_info['url']:
-            return False
-            
-        return True
-
     def _adapt_for_ios(self, tab_info: Dict) -> Dict:
         """
         Adapts tab information for iOS-specific behaviors.
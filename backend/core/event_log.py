@@ -0,0 +1,180 @@
+import os
+import struct
+from typing import Dict, Iterator, NamedTuple
+
+# File layout:
+#   MAGIC | state (u8) | header length (u16) | header JSON | record | record | ...
+# Record:
+#   kind (u8) | flag (u8) | timestamp (f64) | url length (u32) | url (utf-8)
+#   | rest length (u32) | rest of tab_info as compact JSON
+# Everything is little-endian. The header names the tracker class and
+# platform so the log can be replayed through the same derivation logic.
+# state is OPEN while a writer has the log and CLEAN once it's closed, so
+# only a log a crash left OPEN needs scanning for a torn last record.
+MAGIC = b'PWTEVT01'
+STATE_CLEAN = 0
+STATE_OPEN = 1
+_STATE = struct.Struct('<B')
+_HEADER_LEN = struct.Struct('<H')
+_RECORD_HEAD = struct.Struct('<BBdI')
+_REST_LEN = struct.Struct('<I')
+
+EVENT_TAB_ACTIVATED = 1
+EVENT_TAB_UPDATED = 2
+EVENT_VISIBILITY = 3
+EVENT_WINDOW_FOCUS = 4
+
+
+class Event(NamedTuple):
+    kind: int
+    flag: bool
+    timestamp: float
+    tab_info: Dict
+
+
+class EventLogWriter:
+    """
+    Appends raw tracker events to a compact binary log. Records are buffered
+    and flushed every flush_every events (and on close), so logging costs a
+    memcpy per event rather than a syscall.
+    """
+
+    def __init__(self, path: str, tracker_name: str, platform_type: str, flush_every: int = 64):
+        import json
+        self._json = json
+        self.path = path
+        self.flush_every = flush_every
+        self._pending = 0
+        end = _writable_length(path)
+        self._file = open(path, 'r+b' if end else 'wb')
+        if end:
+            self._file.truncate(end)
+            self._set_state(STATE_OPEN)
+            self._file.seek(end)
+        else:
+            header = json.dumps({'tracker': tracker_name, 'platform_type': platform_type}).encode('utf-8')
+            self._file.write(MAGIC + _STATE.pack(STATE_OPEN) + _HEADER_LEN.pack(len(header)) + header)
+            self._file.flush()
+
+    def _set_state(self, state: int):
+        self._file.seek(len(MAGIC))
+        self._file.write(_STATE.pack(state))
+        self._file.flush()
+
+    def append(self, kind: int, timestamp: float, tab_info: Dict, flag: bool = False):
+        """Adds one event to the log. Raises ValueError if tab_info is too big for the format."""
+        url = str(tab_info.get('url', '')).encode('utf-8')
+        rest = {key: value for key, value in tab_info.items() if key != 'url'}
+        rest = self._json.dumps(rest, separators=(',', ':')).encode('utf-8') if rest else b''
+        if len(rest) >= 1 << (8 * _REST_LEN.size):
+            raise ValueError(f"Event too big for the log ({len(rest)} bytes of tab_info)")
+        self._file.write(
+            _RECORD_HEAD.pack(kind, int(flag), timestamp, len(url)) + url
+            + _REST_LEN.pack(len(rest)) + rest
+        )
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        self._pending = 0
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            self._set_state(STATE_CLEAN)
+            self._file.close()
+
+
+def read_header(path: str) -> Dict:
+    """Reads just the header (tracker class and platform) of a log"""
+    with open(path, 'rb') as f:
+        return _read_header(f)
+
+
+def _read_header(f) -> Dict:
+    import json
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a tracker event log")
+    f.read(_STATE.size)
+    (length,) = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))
+    return json.loads(f.read(length))
+
+
+def _writable_length(path: str) -> int:
+    """
+    How many bytes of the log a writer can keep and append after (0 when
+    there's no file, or not even a whole header). A cleanly closed log is
+    kept whole; one left open by a crash is scanned for its last complete
+    record.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if len(magic) < len(MAGIC):
+            return 0
+        if magic != MAGIC:
+            raise ValueError("Not a tracker event log")
+        state = f.read(_STATE.size)
+        length = f.read(_HEADER_LEN.size)
+        if len(state) < _STATE.size or len(length) < _HEADER_LEN.size:
+            return 0
+        (length,) = _HEADER_LEN.unpack(length)
+        if len(f.read(length)) < length:
+            return 0
+        if _STATE.unpack(state)[0] == STATE_CLEAN:
+            return os.fstat(f.fileno()).st_size
+        return _complete_length(f)
+
+
+def _complete_length(f) -> int:
+    """Where the last complete record ends, reading on from just after the header"""
+    head_size = _RECORD_HEAD.size
+    size = os.fstat(f.fileno()).st_size
+    end = f.tell()
+    while True:
+        head = f.read(head_size)
+        if len(head) < head_size:
+            return end
+        url_length = _RECORD_HEAD.unpack(head)[3]
+        f.seek(url_length, os.SEEK_CUR)
+        rest_head = f.read(_REST_LEN.size)
+        if len(rest_head) < _REST_LEN.size:
+            return end
+        (rest_length,) = _REST_LEN.unpack(rest_head)
+        record_end = f.tell() + rest_length
+        if record_end > size:
+            return end
+        f.seek(record_end)
+        end = record_end
+
+
+def read_events(path: str, buffer_size: int = 1 << 20) -> Iterator[Event]:
+    """
+    Streams events out of a log in the order they were written.
+    A record cut short by a crash at the very end is ignored.
+    """
+    import json
+    loads = json.loads
+    head_size = _RECORD_HEAD.size
+    with open(path, 'rb', buffering=buffer_size) as f:
+        _read_header(f)
+        rest_size = _REST_LEN.size
+        while True:
+            head = f.read(head_size)
+            if len(head) < head_size:
+                return
+            kind, flag, timestamp, url_length = _RECORD_HEAD.unpack(head)
+            url = f.read(url_length)
+            rest_head = f.read(rest_size)
+            if len(url) < url_length or len(rest_head) < rest_size:
+                return
+            (rest_length,) = _REST_LEN.unpack(rest_head)
+            rest = f.read(rest_length)
+            if len(rest) < rest_length:
+                return
+            tab_info = loads(rest) if rest_length else {}
+            tab_info['url'] = url.decode('utf-8')
+            yield Event(kind, bool(flag), timestamp, tab_info)
@@ -0,0 +1,127 @@
+import json
+import logging
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .event_log import (EVENT_TAB_ACTIVATED, EVENT_TAB_UPDATED, EVENT_VISIBILITY,
+                        EVENT_WINDOW_FOCUS, Event, read_events, read_header)
+from .replay import derive_and_save
+
+logger = logging.getLogger(__name__)
+
+# Archive layout, one JSON object per line:
+#   {"tracker": "ChromiumTracker", "platform_type": "desktop"}
+#   {"event": "tab_activated", "timestamp": 1700000000.5, "tab_info": {...}}
+#   {"event": "visibility", "timestamp": 1700000060.0, "flag": false, "tab_info": {...}}
+# Events must be in time order, same as the binary log they're exported from.
+EVENT_NAMES = {
+    EVENT_TAB_ACTIVATED: 'tab_activated',
+    EVENT_TAB_UPDATED: 'tab_updated',
+    EVENT_VISIBILITY: 'visibility',
+    EVENT_WINDOW_FOCUS: 'window_focus',
+}
+_KINDS = {name: kind for kind, name in EVENT_NAMES.items()}
+
+CHUNK_BYTES = 16 << 20
+
+
+def export_ndjson(log_path: str, dest_path: str) -> int:
+    """Writes a binary event log out as an NDJSON archive, returns the event count"""
+    count = 0
+    with open(dest_path, 'w', encoding='utf-8') as out:
+        out.write(json.dumps(read_header(log_path)) + '\n')
+        for event in read_events(log_path):
+            record = {'event': EVENT_NAMES[event.kind], 'timestamp': event.timestamp,
+                      'tab_info': event.tab_info}
+            if event.flag:
+                record['flag'] = True
+            out.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            count += 1
+    return count
+
+
+def chunk_ranges(data, start: int = 0, chunk_bytes: int = CHUNK_BYTES) -> Iterator[Tuple[int, int]]:
+    """
+    Splits data[start:] into (start, end) byte ranges of roughly chunk_bytes,
+    each ending just after a newline (or at the end of the data). Only
+    searches for newlines, so it's cheap on an mmap of any size.
+    """
+    size = len(data)
+    while start < size:
+        end = data.find(b'\n', min(start + chunk_bytes, size) - 1)
+        end = size if end == -1 else end + 1
+        yield start, end
+        start = end
+
+
+def parse_chunk(path: str, start: int, end: int) -> Tuple[List[Event], int]:
+    """
+    Parses the lines in bytes [start, end) of an archive, mapping the file
+    itself so only the offsets cross the process boundary. Returns the
+    events and how many lines were malformed and skipped.
+
+    Top-level so it can run in a worker process.
+    """
+    events = []
+    bad = 0
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for line in data[start:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                events.append(Event(_KINDS[record['event']], bool(record.get('flag', False)),
+                                    float(record['timestamp']), dict(record['tab_info'])))
+            except (ValueError, KeyError, TypeError):
+                bad += 1
+    return events, bad
+
+
+def replay_ndjson(path: str, storage, replace: bool = True, workers: Optional[int] = None,
+                  chunk_bytes: int = CHUNK_BYTES, idle_timeout: float = 1800,
+                  max_pending: Optional[int] = None) -> int:
+    """
+    Rebuilds activities from an NDJSON archive. The file is memory-mapped
+    and cut into line-aligned chunks that workers parse in parallel; parsed
+    chunks come back in order and go through the same day derivation and
+    batched saves as replay(). At most max_pending chunks (and days) are in
+    flight, so memory stays flat however big the archive is.
+    Returns the number of activities saved; malformed lines are skipped
+    and logged.
+    """
+    if os.path.getsize(path) == 0:
+        return 0
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    skipped = [0]
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        header_end = data.find(b'\n')
+        header_end = len(data) if header_end == -1 else header_end
+        header: Dict = json.loads(data[:header_end])
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            def parsed_events():
+                pending = deque()
+                for start, end in chunk_ranges(data, header_end + 1, chunk_bytes):
+                    pending.append(pool.submit(parse_chunk, path, start, end))
+                    if len(pending) >= max_pending:
+                        yield from take(pending.popleft())
+                while pending:
+                    yield from take(pending.popleft())
+
+            def take(future):
+                events, bad = future.result()
+                skipped[0] += bad
+                return events
+
+            saved = derive_and_save(pool, header, parsed_events(), storage, replace,
+                                    idle_timeout, max_pending)
+
+    if skipped[0]:
+        logger.warning("Skipped %s malformed lines in %s", skipped[0], path)
+    logger.info("Replayed %s activities from %s", saved, path)
+    return saved
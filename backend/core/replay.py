@@ -0,0 +1,188 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .event_log import (EVENT_TAB_ACTIVATED, EVENT_TAB_UPDATED, EVENT_VISIBILITY,
+                        EVENT_WINDOW_FOCUS, Event, read_events, read_header)
+from .timing_wheel import TimingWheel
+
+logger = logging.getLogger(__name__)
+
+DAY = 86400
+
+# Which handler each kind of event went through
+_HANDLERS = {
+    EVENT_TAB_ACTIVATED: 'handle_tab_activated',
+    EVENT_TAB_UPDATED: 'handle_tab_updated',
+    EVENT_VISIBILITY: 'handle_visibility_change',
+    EVENT_WINDOW_FOCUS: 'handle_window_focus',
+}
+# Events that take a flag (is_visible / has_focus) as well as tab_info
+_FLAGGED = {EVENT_VISIBILITY, EVENT_WINDOW_FOCUS}
+
+
+class _CollectingStorage:
+    """
+    Stands in for StorageManager during a replay: open sessions only live
+    in the tracker's memory and finished activities are just collected.
+    """
+
+    def __init__(self):
+        self.activities: List[Dict] = []
+
+    def transaction(self):
+        return nullcontext()
+
+    def open_session(self, tab_id, session, tab_info, last_active=True):
+        pass
+
+    def close_session(self, tab_id, activity):
+        self.activities.append(activity)
+
+    def switch_session(self, closed_tab_id, activity, tab_id, session, tab_info):
+        if activity is not None:
+            self.activities.append(activity)
+
+    def load_open_sessions(self):
+        return {}, []
+
+    def close(self):
+        pass
+
+
+def _tracker_class(name: str):
+    from .browsers.chromium_tracker import ChromiumTracker
+    from .browsers.gecko_tracker import GeckoTracker
+    from .browsers.webkit_tracker import WebKitTracker
+    classes = {cls.__name__: cls for cls in (ChromiumTracker, GeckoTracker, WebKitTracker)}
+    if name not in classes:
+        raise ValueError(f"Don't know how to replay events from {name}")
+    return classes[name]
+
+
+def derive_day(header: Dict, day_start: float, events: List[Event],
+               carried: Optional[List[Dict]] = None, idle_timeout: float = 1800) -> List[Dict]:
+    """
+    Runs one day's events through a fresh tracker of the kind that wrote
+    them and returns the activities it derives. The tracker's clock follows
+    the event timestamps, and anything still open at midnight is closed
+    there. carried holds the tabs that were in front (one per window) when
+    the day began; they're reopened at midnight so their time isn't lost.
+
+    Top-level so it can run in a worker process.
+    """
+    clock = [day_start]
+    storage = _CollectingStorage()
+    tracker = _tracker_class(header['tracker'])(platform_type=header['platform_type'],
+                                                idle_timeout=idle_timeout, storage=storage)
+    tracker.active_tabs = {}
+    tracker.last_active = None
+    tracker._now = lambda: clock[0]
+    tracker._idle_timers = TimingWheel(tick_seconds=tracker._idle_timers.tick_seconds,
+                                       slots=512, now=day_start)
+
+    for tab_info in carried or ():
+        getattr(tracker, _HANDLERS[EVENT_TAB_ACTIVATED])(dict(tab_info))
+    for event in events:
+        clock[0] = event.timestamp
+        handler = getattr(tracker, _HANDLERS[event.kind])
+        if event.kind in _FLAGGED:
+            handler(event.tab_info, event.flag)
+        else:
+            handler(event.tab_info)
+
+    # Close whatever is still open at the end of the day
+    clock[0] = day_start + DAY
+    tracker.expire_idle_sessions(clock[0])
+    for tab_id in list(tracker.active_tabs):
+        tracker._close_dangling_session(tab_id, clock[0])
+    return storage.activities
+
+
+def split_days(events: Iterator[Event], idle_timeout: float = 1800
+               ) -> Iterator[Tuple[float, List[Event], List[Dict]]]:
+    """
+    Groups a time-ordered event stream into (day_start, events, carried)
+    per UTC day, holding one day in memory at a time. carried lists the
+    tab each window was left with in front by the previous day, oldest
+    first, leaving out any that had gone idle by midnight.
+    """
+    day_start = None
+    day_events: List[Event] = []
+    carried: List[Dict] = []
+    fronts: Dict = {}  # window_id -> (tab_info, in front since)
+    for event in events:
+        start = event.timestamp - event.timestamp % DAY
+        if start != day_start:
+            if day_events:
+                yield day_start, day_events, carried
+                # Only carry tabs over into the very next day
+                midnight = day_start + DAY
+                carried = [tab_info for tab_info, since in fronts.values()
+                           if start == midnight and since + idle_timeout > midnight]
+            day_start, day_events = start, []
+        day_events.append(event)
+        window_id = event.tab_info.get('window_id')
+        if event.kind in _FLAGGED and not event.flag:
+            fronts.pop(window_id, None)
+        else:
+            # Re-inserted so the dict stays in order of activation
+            fronts.pop(window_id, None)
+            fronts[window_id] = (event.tab_info, event.timestamp)
+    if day_events:
+        yield day_start, day_events, carried
+
+
+def derive_and_save(pool, header: Dict, events: Iterator[Event], storage, replace: bool = True,
+                    idle_timeout: float = 1800, max_pending: int = 4) -> int:
+    """
+    Derives the days of a time-ordered event stream on pool and saves them
+    in order, with at most max_pending days in flight. With replace, each
+    day's stored activities are swapped for the derived ones and the
+    derived tables are rebuilt once at the end. Shared by every replay
+    source; returns the number of activities saved.
+    """
+    saved = 0
+    pending = []
+
+    def save(day_start, future):
+        activities = future.result()
+        if replace:
+            storage.replace_activities(day_start, day_start + DAY, activities)
+        elif activities:
+            storage.insert_activities(activities)
+        return len(activities)
+
+    for day_start, day_events, carried in split_days(events, idle_timeout):
+        pending.append((day_start, pool.submit(derive_day, header, day_start, day_events,
+                                               carried, idle_timeout)))
+        if len(pending) >= max_pending:
+            saved += save(*pending.pop(0))
+    for day_start, future in pending:
+        saved += save(day_start, future)
+    if replace:
+        storage.rebuild_derived()
+    return saved
+
+
+def replay(log_path: str, storage, replace: bool = True, workers: Optional[int] = None,
+           idle_timeout: float = 1800, max_pending: Optional[int] = None) -> int:
+    """
+    Rebuilds activities from an event log, deriving each day in parallel.
+    Days are read and saved in order with at most max_pending in flight, so
+    memory stays bounded however long the log is. With replace, the
+    activities already stored for each replayed day are swapped out for the
+    re-derived ones, and the tables derived from them (sessions, duration
+    and distinct count sketches) are rebuilt at the end.
+    Returns the number of activities saved.
+    """
+    header = read_header(log_path)
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        saved = derive_and_save(pool, header, read_events(log_path), storage, replace,
+                                idle_timeout, max_pending or workers * 2)
+
+    logger.info("Replayed %s activities from %s", saved, log_path)
+    return saved
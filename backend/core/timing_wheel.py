@@ -0,0 +1,77 @@
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel for lots of timers that mostly get cancelled or
+    pushed back before they fire (like idle timeouts on open tabs).
+
+    Scheduling, rescheduling and cancelling are O(1). Advancing the clock
+    only visits the slots for the ticks that passed (at most one full turn),
+    and timers further out than one turn just stay put until their turn
+    comes round.
+    """
+
+    def __init__(self, tick_seconds: float = 1.0, slots: int = 512, now: float = 0.0):
+        if tick_seconds <= 0 or slots <= 0:
+            raise ValueError("tick_seconds and slots must be positive")
+        self.tick_seconds = tick_seconds
+        self._slots: List[Dict[Hashable, float]] = [{} for _ in range(slots)]
+        self._slot_of: Dict[Hashable, int] = {}
+        self._current_tick = int(now // tick_seconds)
+
+    def _tick(self, when: float) -> int:
+        return int(when // self.tick_seconds)
+
+    def schedule(self, key: Hashable, deadline: float):
+        """Sets (or moves) the timer for key"""
+        self.cancel(key)
+        # Anything already due goes in the next slot we'll visit
+        slot = max(self._tick(deadline), self._current_tick) % len(self._slots)
+        self._slots[slot][key] = deadline
+        self._slot_of[key] = slot
+
+    def cancel(self, key: Hashable) -> bool:
+        """Removes the timer for key. Returns False if there wasn't one."""
+        slot = self._slot_of.pop(key, None)
+        if slot is None:
+            return False
+        del self._slots[slot][key]
+        return True
+
+    def advance(self, now: float) -> List[Tuple[Hashable, float]]:
+        """Moves the clock to now and returns every (key, deadline) that's due"""
+        target = self._tick(now)
+        if target < self._current_tick:
+            return []
+
+        expired = []
+        slot_count = len(self._slots)
+        # After a long pause one full turn is enough to see every slot
+        first = max(self._current_tick, target - slot_count + 1)
+        for tick in range(first, target + 1):
+            slot = self._slots[tick % slot_count]
+            if not slot:
+                continue
+            due = [(key, deadline) for key, deadline in slot.items() if deadline <= now]
+            for key, _ in due:
+                del slot[key]
+                del self._slot_of[key]
+            expired.extend(due)
+        self._current_tick = target
+        return sorted(expired, key=lambda item: item[1])
+
+    def earliest(self) -> Optional[Tuple[Hashable, float]]:
+        """Finds the timer that's due first (walks the slots, so keep it off hot paths)"""
+        best = None
+        for slot in self._slots:
+            for key, deadline in slot.items():
+                if best is None or deadline < best[1]:
+                    best = (key, deadline)
+        return best
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._slot_of
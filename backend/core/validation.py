@@ -0,0 +1,99 @@
+"""
+Checks for the tab events the trackers take in.
+
+A Schema builds its check once, as a closure over each field's allowed
+types in frozensets, so a well-formed event costs a handful of dict
+lookups and set hits. Only events that fail it go through the slow path
+that works out every reason, which is what a batch reports back per item.
+"""
+from itertools import compress
+from typing import Dict, List, Optional, Tuple
+
+NoneType = type(None)
+TAB_ID_TYPES = (str, int)
+WINDOW_ID_TYPES = (str, int, NoneType)
+
+# Never one of the allowed types, so a missing field fails the type check too
+_MISSING = object()
+
+
+def _type_names(types: tuple) -> str:
+    return ' or '.join('None' if t is NoneType else t.__name__ for t in types)
+
+
+class Schema:
+    """
+    Required and optional fields of an event with the types each may have.
+    Types are matched exactly - True isn't an acceptable tab id.
+    """
+
+    def __init__(self, name: str, required: Dict[str, tuple], optional: Optional[Dict[str, tuple]] = None):
+        self.name = name
+        self.required = dict(required)
+        self.optional = dict(optional or {})
+        self.is_valid = self._build_check()
+
+    def _build_check(self):
+        required = tuple((field, frozenset(types)) for field, types in self.required.items())
+        optional = tuple((field, frozenset(types)) for field, types in self.optional.items())
+
+        def is_valid(item) -> bool:
+            if type(item) is not dict:
+                return False
+            get = item.get
+            for field, types in required:
+                if type(get(field, _MISSING)) not in types:
+                    return False
+            for field, types in optional:
+                if field in item and type(item[field]) not in types:
+                    return False
+            return True
+        return is_valid
+
+    def errors(self, item) -> List[str]:
+        """Everything wrong with an event (empty if it's fine)"""
+        if not isinstance(item, dict):
+            return [f"expected an object, got {type(item).__name__}"]
+        found = []
+        for field, types in self.required.items():
+            if field not in item:
+                found.append(f"{field}: missing")
+            elif type(item[field]) not in types:
+                found.append(f"{field}: expected {_type_names(types)}, got {type(item[field]).__name__}")
+        for field, types in self.optional.items():
+            if field in item and type(item[field]) not in types:
+                found.append(f"{field}: expected {_type_names(types)}, got {type(item[field]).__name__}")
+        return found
+
+    def validate_batch(self, items: List) -> Tuple[List[Dict], Dict[int, List[str]]]:
+        """
+        Splits a batch into the valid events and, by position in the
+        batch, the reasons each invalid one was rejected.
+        """
+        # Checked and split in C; only the failures are visited in Python
+        flags = list(map(self.is_valid, items))
+        valid = list(compress(items, flags))
+        rejected = {}
+        index = -1
+        for _ in range(len(items) - len(valid)):
+            index = flags.index(False, index + 1)
+            rejected[index] = self.errors(items[index])
+        return valid, rejected
+
+
+_OPTIONAL = {'title': (str, NoneType), 'incognito': (bool,), 'private': (bool,)}
+
+# What track_tab_change needs (browser_type is filled in by the tracker)
+TAB_INFO = Schema('tab_info', {
+    'url': (str,),
+    'browser_type': (str,),
+    'tab_id': TAB_ID_TYPES,
+    'window_id': WINDOW_ID_TYPES,
+}, _OPTIONAL)
+
+# A tab update as the extension sends it
+TAB_UPDATE = Schema('tab_update', {
+    'url': (str,),
+    'tab_id': TAB_ID_TYPES,
+    'window_id': WINDOW_ID_TYPES,
+}, _OPTIONAL)
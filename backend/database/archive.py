@@ -0,0 +1,199 @@
+import base64
+import json
+import logging
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Segment file layout:
+#   MAGIC | chunk | chunk | ... | footer JSON | footer length (8 bytes) | MAGIC
+# Every chunk is one compressed JSON object of columns -> value lists.
+# Bytes are base64: a whole column when it's all bytes, otherwise each
+# bytes value as {"b64": ...} - the chunk's index entry says which.
+# The footer is the segment's time index: per-chunk offsets and time ranges,
+# so a range query only decompresses the chunks it actually needs.
+MAGIC = b'PWTSEG01'
+_FOOTER_LEN = struct.Struct('<Q')
+_FOOTER_KEYS = {'codec', 'columns', 'row_count', 'min_start', 'max_start', 'max_end', 'chunks'}
+_CHUNK_KEYS = {'offset', 'length', 'rows', 'min_start', 'max_start', 'max_end',
+               'blob_columns', 'tagged_columns'}
+
+
+def _b64(value: bytes) -> str:
+    return base64.b64encode(value).decode('ascii')
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == 'lzma':
+        import lzma
+        return lzma.compress(data, preset=6)
+    return zlib.compress(data, 6)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == 'lzma':
+        import lzma
+        return lzma.decompress(data)
+    return zlib.decompress(data)
+
+
+class ArchiveStore:
+    """
+    Keeps old activities in compressed, immutable segment files instead of
+    deleting them. Each cleanup run writes one new segment; segments are
+    never changed after they're written.
+    """
+
+    def __init__(self, directory: str, codec: str = 'zlib', chunk_rows: int = 4096):
+        if codec not in ('zlib', 'lzma'):
+            raise ValueError(f"Unknown archive codec: {codec}")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.codec = codec
+        self.chunk_rows = chunk_rows
+        # Segments are immutable, so their footers can be cached forever
+        self._footers: Dict[Path, Dict] = {}
+
+    def write_segment(self, rows: Iterable[Dict]) -> Optional[Path]:
+        """
+        Streams rows (in start_time order) into a new segment file.
+        The file only appears under its final name once it's fully written.
+        Returns the new segment's path, or None if there were no rows.
+        """
+        tmp_path = self.directory / f".segment-{os.urandom(8).hex()}.tmp"
+        chunks = []
+        columns = None
+        buffer = []
+
+        def flush(f):
+            nonlocal columns
+            if columns is None:
+                columns = list(buffer[0].keys())
+            # Decided per chunk: a column can start out all None and get
+            # encrypted bytes later, or mix plaintext from before encryption
+            data = {}
+            blob_columns = []
+            tagged_columns = []
+            for column in columns:
+                values = [row[column] for row in buffer]
+                kinds = {type(v) for v in values if v is not None}
+                if bytes in kinds:
+                    if kinds == {bytes}:
+                        blob_columns.append(column)
+                        values = [_b64(v) if v is not None else None for v in values]
+                    else:
+                        tagged_columns.append(column)
+                        values = [{'b64': _b64(v)} if isinstance(v, bytes) else v for v in values]
+                data[column] = values
+            payload = _compress(json.dumps(data, separators=(',', ':')).encode('utf-8'), self.codec)
+            chunks.append({
+                'offset': f.tell(),
+                'length': len(payload),
+                'rows': len(buffer),
+                'min_start': min(row['start_time'] for row in buffer),
+                'max_start': max(row['start_time'] for row in buffer),
+                'max_end': max(row['end_time'] for row in buffer),
+                'blob_columns': blob_columns,
+                'tagged_columns': tagged_columns,
+            })
+            f.write(payload)
+            buffer.clear()
+
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(MAGIC)
+                for row in rows:
+                    buffer.append(row)
+                    if len(buffer) >= self.chunk_rows:
+                        flush(f)
+                if buffer:
+                    flush(f)
+                if not chunks:
+                    f.close()
+                    tmp_path.unlink()
+                    return None
+
+                footer = json.dumps({
+                    'codec': self.codec,
+                    'columns': columns,
+                    'row_count': sum(chunk['rows'] for chunk in chunks),
+                    'min_start': min(chunk['min_start'] for chunk in chunks),
+                    'max_start': max(chunk['max_start'] for chunk in chunks),
+                    'max_end': max(chunk['max_end'] for chunk in chunks),
+                    'chunks': chunks,
+                }).encode('utf-8')
+                f.write(footer)
+                f.write(_FOOTER_LEN.pack(len(footer)))
+                f.write(MAGIC)
+                f.flush()
+                os.fsync(f.fileno())
+
+            first = chunks[0]['min_start']
+            final_path = self.directory / f"segment-{int(first)}-{os.urandom(4).hex()}.seg"
+            os.replace(tmp_path, final_path)
+            return final_path
+        except Exception:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+
+    def _read_footer(self, path: Path) -> Dict:
+        """Reads (and caches) a segment's time index"""
+        footer = self._footers.get(path)
+        if footer is None:
+            with open(path, 'rb') as f:
+                f.seek(-(len(MAGIC) + _FOOTER_LEN.size), os.SEEK_END)
+                (length,) = _FOOTER_LEN.unpack(f.read(_FOOTER_LEN.size))
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError(f"Not an archive segment: {path}")
+                f.seek(-(len(MAGIC) + _FOOTER_LEN.size + length), os.SEEK_END)
+                footer = json.loads(f.read(length))
+            if set(footer) != _FOOTER_KEYS or any(set(chunk) != _CHUNK_KEYS for chunk in footer['chunks']):
+                raise ValueError(f"Unknown archive segment layout: {path}")
+            self._footers[path] = footer
+        return footer
+
+    def segments(self) -> List[Path]:
+        """Lists finished segment files, oldest first"""
+        return sorted(self.directory.glob('segment-*.seg'),
+                      key=lambda p: int(p.name.split('-')[1]))
+
+    def read_range(self, start_time: float, end_time: float) -> List[Dict]:
+        """
+        Gets archived rows with start_time >= start and end_time <= end.
+        Only chunks whose time range overlaps the query get decompressed.
+        """
+        return list(self.iter_range(start_time, end_time))
+
+    def iter_range(self, start_time: float, end_time: float) -> Iterator[Dict]:
+        """Like read_range, but yields rows a chunk at a time instead of collecting them"""
+        for path in self.segments():
+            try:
+                footer = self._read_footer(path)
+            except Exception as e:
+                logger.error("Skipping unreadable archive segment %s: %s", path.name, e)
+                continue
+            if footer['max_end'] < start_time or footer['min_start'] > end_time:
+                continue
+
+            with open(path, 'rb') as f:
+                for chunk in footer['chunks']:
+                    if chunk['max_end'] < start_time or chunk['min_start'] > end_time:
+                        continue
+                    f.seek(chunk['offset'])
+                    data = json.loads(_decompress(f.read(chunk['length']), footer['codec']))
+                    for column in chunk['blob_columns']:
+                        data[column] = [base64.b64decode(v) if v is not None else None
+                                        for v in data[column]]
+                    for column in chunk['tagged_columns']:
+                        data[column] = [base64.b64decode(v['b64']) if isinstance(v, dict) else v
+                                        for v in data[column]]
+                    columns = footer['columns']
+                    for values in zip(*(data[column] for column in columns)):
+                        row = dict(zip(columns, values))
+                        if row['start_time'] >= start_time and row['end_time'] <= end_time:
+                            yield row
@@ -0,0 +1,148 @@
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from ..utils.sketches import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+DAY = 86400
+# What each kind of sketch counts, and the activity column it's fed from
+KINDS = {'url': 'url_hash', 'domain': 'domain_hash'}
+
+
+class DistinctCounters:
+    """
+    Approximate "how many different sites" counts without COUNT(DISTINCT).
+    Keeps a HyperLogLog of URLs and one of domains per (UTC day, platform,
+    browser, device) in distinct_sketches, fed from the url_hash and
+    domain_hash lookup columns - so nothing is decrypted, and with a cipher
+    the sketches only ever see keyed hashes.
+
+    A count over any run of days is the union of their sketches: at the
+    default p=12 that's a 1.6% standard error (about 3.3% at 95%), close to
+    exact below a few thousand, however long the range.
+
+    Updated as activities are inserted through a write listener. Re-adding
+    a value is a no-op, so unlike the other derived tables a replay doesn't
+    make these wrong - only a deletion does; rebuild() then.
+    """
+
+    def __init__(self, storage, p: int = 12, attach: bool = True):
+        self.storage = storage
+        self.p = p
+        if attach:
+            storage.add_write_listener(self.on_activities, self.rebuild)
+
+    def on_activities(self, activities: List[Dict]):
+        """Adds a batch of newly inserted activities to their day's sketches"""
+        sketches: Dict[Tuple, HyperLogLog] = {}
+        storage = self.storage
+        for activity in activities:
+            start = activity['start_time']
+            group = (start - start % DAY, activity.get('platform_type') or storage.platform_type,
+                     activity.get('engine_type') or storage.engine_type, activity['device_id'])
+            for kind, column in KINDS.items():
+                key = (group[0], kind) + group[1:]
+                sketch = sketches.get(key)
+                if sketch is None:
+                    sketch = sketches[key] = HyperLogLog(self.p)
+                sketch.add_digest(activity[column])
+        self._merge_into_table(sketches)
+
+    def _merge_into_table(self, sketches: Dict[Tuple, HyperLogLog]):
+        connection = self.storage.connection
+        for key, sketch in sketches.items():
+            row = connection.execute("""
+                SELECT sketch FROM distinct_sketches
+                WHERE day_start = ? AND kind = ? AND platform_type = ? AND engine_type = ?
+                  AND device_id = ?
+            """, key).fetchone()
+            if row:
+                stored = HyperLogLog.from_bytes(row[0])
+                before = stored.registers
+                if stored.merge(sketch).registers == before:
+                    # Nothing new - the usual case once a day has some history
+                    continue
+                sketch = stored
+            connection.execute("""
+                INSERT OR REPLACE INTO distinct_sketches (day_start, kind, platform_type,
+                                                          engine_type, device_id, sketch)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (*key, sketch.to_bytes()))
+
+    def rebuild(self, batch_size: int = 5000) -> int:
+        """
+        Recomputes every sketch from the activities table, a day at a time.
+        Returns the number of sketches.
+        """
+        storage = self.storage
+        written = 0
+        with storage.transaction():
+            storage.connection.execute("DELETE FROM distinct_sketches")
+            cursor = storage.connection.execute("""
+                SELECT url_hash, domain_hash, platform_type, engine_type, device_id, start_time
+                FROM activities WHERE domain_hash IS NOT NULL ORDER BY start_time
+            """)
+            day_start = None
+            sketches: Dict[Tuple, HyperLogLog] = {}
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                for url_hash, domain_hash, platform_type, engine_type, device_id, start in batch:
+                    day = start - start % DAY
+                    if day != day_start:
+                        self._merge_into_table(sketches)
+                        written += len(sketches)
+                        day_start, sketches = day, {}
+                    for kind, digest in (('url', url_hash), ('domain', domain_hash)):
+                        key = (day, kind, platform_type, engine_type, device_id)
+                        sketch = sketches.get(key)
+                        if sketch is None:
+                            sketch = sketches[key] = HyperLogLog(self.p)
+                        sketch.add_digest(digest)
+            self._merge_into_table(sketches)
+            written += len(sketches)
+        logger.info("Rebuilt %s distinct-count sketches", written)
+        return written
+
+    def union(self, start_time: float, end_time: float, kind: str = 'domain',
+              platform_type: Optional[str] = None, engine_type: Optional[str] = None,
+              device_ids: Optional[Sequence[str]] = None) -> HyperLogLog:
+        """The merged sketch for the UTC days overlapping [start_time, end_time)"""
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+        sql = """
+            SELECT sketch FROM distinct_sketches
+            WHERE day_start >= ? AND day_start < ? AND kind = ?
+        """
+        params: List = [start_time - start_time % DAY, end_time, kind]
+        if platform_type is not None:
+            sql += " AND platform_type = ?"
+            params.append(platform_type)
+        if engine_type is not None:
+            sql += " AND engine_type = ?"
+            params.append(engine_type)
+        if device_ids is not None:
+            sql += f" AND device_id IN ({', '.join('?' * len(device_ids))})"
+            params.extend(device_ids)
+
+        merged = HyperLogLog(self.p)
+        with self.storage._lock:
+            cursor = self.storage.connection.execute(sql, params)
+            for (blob,) in cursor:
+                merged.merge_bytes(blob)
+        return merged
+
+    def count_distinct(self, start_time: float, end_time: float, kind: str = 'domain',
+                       **filters) -> int:
+        """
+        About how many different domains (or URLs, with kind='url') were
+        visited on the UTC days overlapping [start_time, end_time).
+        Filters: platform_type, engine_type, device_ids. Returns 0 on error.
+        """
+        try:
+            return self.union(start_time, end_time, kind, **filters).count()
+        except Exception as e:
+            logger.error("Failed to count distinct %ss: %s", kind, e)
+            return 0
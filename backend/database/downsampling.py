@@ -0,0 +1,226 @@
+import logging
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from ..utils.urls import extract_domain
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+
+_UPSERT_ROLLUP = """
+    INSERT INTO activity_rollups (resolution, bucket_start, domain_hash, device_id,
+                                  domain, duration, activity_count)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(resolution, bucket_start, domain_hash, device_id) DO UPDATE SET
+        duration = duration + excluded.duration,
+        activity_count = activity_count + excluded.activity_count
+"""
+
+
+class Downsampler:
+    """
+    Keeps months of history on devices that can't afford to keep every
+    activity. Instead of deleting activities once they leave the retention
+    window, cleanup folds them into per-minute domain totals; minute buckets
+    older than minute_days are folded again into hourly ones. Once the
+    rollups themselves outgrow disk_budget_bytes, the oldest days are
+    folded once more into daily buckets. Daily buckets are never dropped,
+    so some history always survives.
+
+    An activity spanning several buckets has its duration shared out by
+    overlap; it counts once, in the bucket it started in. Activities the
+    lookup hash backfill hasn't reached yet wait for the next run. Domains
+    are encrypted like URLs when the storage has a cipher.
+    """
+
+    def __init__(self, storage, minute_days: int = 30, disk_budget_bytes: int = 32 * 1024 * 1024,
+                 batch_size: int = 5000):
+        self.storage = storage
+        self.minute_days = minute_days
+        self.disk_budget_bytes = disk_budget_bytes
+        self.batch_size = batch_size
+
+    def _minute_cutoff(self) -> float:
+        return datetime.now().timestamp() - self.minute_days * DAY
+
+    def run(self, cutoff: Optional[float] = None) -> Dict[str, int]:
+        """
+        Folds activities starting before cutoff (default: the retention
+        window) into rollups, merges old minute buckets into hours and folds
+        the oldest days into daily buckets while over the disk budget.
+        Raises on failure; the folding is one transaction. Returns counts of
+        what was done.
+        """
+        storage = self.storage
+        cutoff = storage._hot_window_start() if cutoff is None else cutoff
+        minute_cutoff = self._minute_cutoff()
+        with storage.transaction():
+            folded = self._fold_activities(cutoff, minute_cutoff)
+            merged = self._merge_minutes(minute_cutoff)
+            # The folded rows have left the activities table
+            if folded:
+                storage.mark_rollups_stale(0, cutoff)
+                if storage.cache is not None:
+                    storage.cache.invalidate_before(cutoff)
+        coarsened = self._enforce_budget()
+        logger.info("Downsampled %s activities, merged %s minute buckets, folded %s into days",
+                    folded, merged, coarsened)
+        return {'folded': folded, 'merged': merged, 'coarsened': coarsened}
+
+    def _fold_activities(self, cutoff: float, minute_cutoff: float) -> int:
+        storage = self.storage
+        connection = storage.connection
+        # Only rows that exist now - anything inserted meanwhile waits its turn
+        max_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM activities").fetchone()[0]
+        cursor = connection.execute("""
+            SELECT url, domain_hash, device_id, start_time, end_time, duration
+            FROM activities WHERE start_time < ? AND id <= ? AND domain_hash IS NOT NULL
+            ORDER BY start_time
+        """, (cutoff, max_id))
+
+        folded = 0
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
+            urls = storage._reveal([{'url': row[0], 'title': None} for row in rows])
+            buckets = defaultdict(lambda: [None, 0.0, 0])
+            for (_, domain_hash, device_id, start, end, duration), revealed in zip(rows, urls):
+                resolution = MINUTE if start >= minute_cutoff else HOUR
+                domain = extract_domain(revealed['url'])
+                for bucket_start, share in self._spread(start, end, duration, resolution):
+                    bucket = buckets[(resolution, bucket_start, domain_hash, device_id)]
+                    bucket[0] = domain
+                    bucket[1] += share
+                first = buckets[(resolution, start - start % resolution, domain_hash, device_id)]
+                first[0] = domain
+                first[2] += 1
+            self._write_buckets(buckets)
+            folded += len(rows)
+
+        connection.execute("""
+            DELETE FROM activities WHERE start_time < ? AND id <= ? AND domain_hash IS NOT NULL
+        """, (cutoff, max_id))
+        return folded
+
+    @staticmethod
+    def _spread(start: float, end: float, duration: float, resolution: int):
+        """Shares duration out over the buckets [start, end) overlaps"""
+        bucket = start - start % resolution
+        span = end - start
+        if span <= 0 or bucket + resolution >= end:
+            yield bucket, duration
+            return
+        while bucket < end:
+            overlap = min(end, bucket + resolution) - max(start, bucket)
+            yield bucket, duration * overlap / span
+            bucket += resolution
+
+    def _write_buckets(self, buckets: Dict):
+        storage = self.storage
+        keys = list(buckets)
+        domains = [buckets[key][0] for key in keys]
+        if storage.cipher:
+            domains = storage.cipher.encrypt_batch(domains, 'domain')
+        storage.connection.executemany(_UPSERT_ROLLUP, [
+            (resolution, bucket_start, domain_hash, device_id, domain,
+             buckets[key][1], buckets[key][2])
+            for key, domain, (resolution, bucket_start, domain_hash, device_id) in zip(keys, domains, keys)
+        ])
+
+    def _merge_into(self, resolution: int, finer_than: int, before: float) -> int:
+        """Folds buckets finer than finer_than starting before `before` into resolution-sized ones"""
+        connection = self.storage.connection
+        connection.execute(f"""
+            INSERT INTO activity_rollups (resolution, bucket_start, domain_hash, device_id,
+                                          domain, duration, activity_count)
+            SELECT {resolution}, bucket_start - (bucket_start % {resolution}), domain_hash, device_id,
+                   MIN(domain), SUM(duration), SUM(activity_count)
+            FROM activity_rollups
+            WHERE resolution < ? AND bucket_start < ?
+            GROUP BY bucket_start - (bucket_start % {resolution}), domain_hash, device_id
+            ON CONFLICT(resolution, bucket_start, domain_hash, device_id) DO UPDATE SET
+                duration = duration + excluded.duration,
+                activity_count = activity_count + excluded.activity_count
+        """, (finer_than, before))
+        return connection.execute("""
+            DELETE FROM activity_rollups WHERE resolution < ? AND bucket_start < ?
+        """, (finer_than, before)).rowcount
+
+    def _merge_minutes(self, minute_cutoff: float) -> int:
+        """Folds minute buckets older than minute_cutoff into hourly ones"""
+        return self._merge_into(HOUR, HOUR, minute_cutoff)
+
+    def used_bytes(self) -> int:
+        """
+        Space the rollups take up - what disk_budget_bytes is checked
+        against. Room left in their pages after a fold doesn't count: later
+        inserts fill it before the file grows.
+        """
+        connection = self.storage.connection
+        try:
+            return connection.execute("""
+                SELECT COALESCE(SUM(pgsize - unused), 0) FROM dbstat WHERE name = 'activity_rollups'
+            """).fetchone()[0]
+        except sqlite3.OperationalError:
+            # SQLite built without dbstat: go by what the rows hold, plus
+            # the numbers and b-tree overhead
+            return connection.execute("""
+                SELECT COALESCE(SUM(LENGTH(domain_hash) + LENGTH(device_id) + LENGTH(domain) + 40), 0)
+                FROM activity_rollups
+            """).fetchone()[0]
+
+    def _enforce_budget(self) -> int:
+        """Folds the oldest day of finer buckets into a daily one until under budget"""
+        connection = self.storage.connection
+        coarsened = 0
+        while self.used_bytes() > self.disk_budget_bytes:
+            (oldest,) = connection.execute(f"""
+                SELECT MIN(bucket_start) FROM activity_rollups WHERE resolution < {DAY}
+            """).fetchone()
+            if oldest is None:
+                logger.warning("Rollups are over the disk budget with only daily buckets left")
+                break
+            with self.storage.transaction():
+                coarsened += self._merge_into(DAY, DAY, oldest - oldest % DAY + DAY)
+        return coarsened
+
+    def get_domain_totals(self, start_time: float, end_time: float) -> Dict[str, float]:
+        """Seconds per domain from buckets starting within a time range"""
+        rows = self.storage.connection.execute("""
+            SELECT domain, SUM(duration) FROM activity_rollups
+            WHERE bucket_start >= ? AND bucket_start < ?
+            GROUP BY domain_hash
+        """, (start_time, end_time)).fetchall()
+        domains = [row[0] for row in rows]
+        if self.storage.cipher and domains:
+            domains = self.storage.cipher.decrypt_batch(domains, 'domain')
+        totals = {}
+        for domain, (_, duration) in zip(domains, rows):
+            totals[domain] = totals.get(domain, 0) + duration
+        return totals
+
+    def get_rollups(self, start_time: float, end_time: float,
+                    resolution: Optional[int] = None) -> List[Dict]:
+        """Raw buckets within a time range, oldest first"""
+        sql = """
+            SELECT resolution, bucket_start, domain, device_id, duration, activity_count
+            FROM activity_rollups WHERE bucket_start >= ? AND bucket_start < ?
+        """
+        params = [start_time, end_time]
+        if resolution is not None:
+            sql += " AND resolution = ?"
+            params.append(resolution)
+        cursor = self.storage.connection.execute(sql + " ORDER BY bucket_start", params)
+        columns = [desc[0] for desc in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        if self.storage.cipher and rows:
+            domains = self.storage.cipher.decrypt_batch([row['domain'] for row in rows], 'domain')
+            for row, domain in zip(rows, domains):
+                row['domain'] = domain
+        return rows
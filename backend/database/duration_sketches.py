@@ -0,0 +1,201 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from ..utils.sketches import LogHistogram
+from ..utils.urls import extract_domain
+
+logger = logging.getLogger(__name__)
+
+DAY = 86400
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def quantile_name(q: float) -> str:
+    """0.5 -> 'p50', 0.999 -> 'p99.9'"""
+    return f"p{q * 100:g}"
+
+
+class DurationSketches:
+    """
+    Keeps a LogHistogram of activity durations per (UTC day, domain,
+    browser, device) in the duration_sketches table, so percentiles over
+    any run of days, any devices, per domain or per browser, come from
+    merging a few hundred small sketches rather than sorting raw rows.
+
+    Updated as activities are inserted (through a write listener, in the
+    same transaction); an activity stretched by a resend has its old
+    duration swapped for the new one. Like the SessionStitcher it only
+    sees rows written through the storage, so rebuild() after a bulk
+    import (a replay rebuilds it itself).
+    """
+
+    def __init__(self, storage, relative_accuracy: float = 0.01, attach: bool = True):
+        self.storage = storage
+        self.relative_accuracy = relative_accuracy
+        if attach:
+            storage.add_write_listener(self.on_activities, self.rebuild)
+
+    def _new_sketch(self) -> LogHistogram:
+        return LogHistogram(self.relative_accuracy)
+
+    def _key(self, activity: Dict) -> Tuple:
+        start = activity['start_time']
+        return (start - start % DAY, activity['domain_hash'],
+                activity.get('engine_type') or self.storage.engine_type, activity['device_id'])
+
+    def on_activities(self, activities: List[Dict]):
+        """Adds a batch of newly inserted activities to their day's sketches"""
+        sketches: Dict[Tuple, LogHistogram] = {}
+        urls: Dict[Tuple, str] = {}
+        stretched = []
+        for activity in activities:
+            key = self._key(activity)
+            if 'previous_end_time' in activity:
+                stretched.append((key, activity))
+                continue
+            if key not in sketches:
+                sketches[key] = self._new_sketch()
+                urls[key] = activity['url']
+            sketches[key].add(max(activity['duration'], 0))
+        self._merge_into_table(sketches, {key: extract_domain(url) for key, url in urls.items()})
+        for key, activity in stretched:
+            self._replace_duration(key, activity['previous_duration'], activity['duration'])
+
+    def _replace_duration(self, key: Tuple, old: float, new: float):
+        """Swaps one recorded duration for another in a stored sketch"""
+        connection = self.storage.connection
+        row = connection.execute("""
+            SELECT sketch FROM duration_sketches
+            WHERE day_start = ? AND domain_hash = ? AND engine_type = ? AND device_id = ?
+        """, key).fetchone()
+        if row is None:
+            # Its activity was never sketched (e.g. written before this was attached)
+            return
+        sketch = LogHistogram.from_bytes(row[0])
+        sketch.remove(max(old, 0))
+        sketch.add(max(new, 0))
+        connection.execute("""
+            UPDATE duration_sketches SET sketch = ?
+            WHERE day_start = ? AND domain_hash = ? AND engine_type = ? AND device_id = ?
+        """, (sketch.to_bytes(), *key))
+
+    def _merge_into_table(self, sketches: Dict[Tuple, LogHistogram], domains: Dict[Tuple, str]):
+        connection = self.storage.connection
+        for key, sketch in sketches.items():
+            row = connection.execute("""
+                SELECT sketch FROM duration_sketches
+                WHERE day_start = ? AND domain_hash = ? AND engine_type = ? AND device_id = ?
+            """, key).fetchone()
+            if row:
+                sketch = LogHistogram.from_bytes(row[0]).merge(sketch)
+                connection.execute("""
+                    UPDATE duration_sketches SET sketch = ?
+                    WHERE day_start = ? AND domain_hash = ? AND engine_type = ? AND device_id = ?
+                """, (sketch.to_bytes(), *key))
+            else:
+                connection.execute("""
+                    INSERT INTO duration_sketches (day_start, domain_hash, engine_type, device_id,
+                                                   domain, sketch)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (*key, self.storage._stored_domain(domains[key]), sketch.to_bytes()))
+
+    def rebuild(self, batch_size: int = 5000) -> int:
+        """
+        Recomputes every sketch from the activities table, one day at a
+        time so memory stays bounded. Returns the number of sketches.
+        """
+        storage = self.storage
+        written = 0
+        with storage.transaction():
+            storage.connection.execute("DELETE FROM duration_sketches")
+            cursor = storage.connection.execute("""
+                SELECT url, domain_hash, engine_type, device_id, start_time, duration
+                FROM activities WHERE domain_hash IS NOT NULL ORDER BY start_time
+            """)
+            day_start = None
+            sketches: Dict[Tuple, LogHistogram] = {}
+            urls: Dict[Tuple, str] = {}
+
+            def flush():
+                plain = storage._reveal([{'url': url, 'title': None} for url in urls.values()])
+                self._merge_into_table(sketches, {key: extract_domain(row['url'])
+                                                  for key, row in zip(urls, plain)})
+                return len(sketches)
+
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                for url, domain_hash, engine_type, device_id, start, duration in batch:
+                    day = start - start % DAY
+                    if day != day_start:
+                        written += flush()
+                        day_start, sketches, urls = day, {}, {}
+                    key = (day, domain_hash, engine_type, device_id)
+                    if key not in sketches:
+                        sketches[key] = self._new_sketch()
+                        urls[key] = url
+                    sketches[key].add(max(duration, 0))
+            written += flush()
+        logger.info("Rebuilt %s duration sketches", written)
+        return written
+
+    def _merged(self, start_time: float, end_time: float, by: str,
+                device_ids: Optional[Sequence[str]], domain: Optional[str]) -> Dict:
+        """Merges the sketches of the days overlapping a range into one per domain hash or browser"""
+        if by not in ('domain', 'browser'):
+            raise ValueError("by must be 'domain' or 'browser'")
+        storage = self.storage
+        sql = """
+            SELECT domain_hash, engine_type, domain, sketch FROM duration_sketches
+            WHERE day_start >= ? AND day_start < ?
+        """
+        params: List = [start_time - start_time % DAY, end_time]
+        if device_ids is not None:
+            sql += f" AND device_id IN ({', '.join('?' * len(device_ids))})"
+            params.extend(device_ids)
+        if domain is not None:
+            sql += " AND domain_hash = ?"
+            params.append(storage._lookup_hash(extract_domain(domain)))
+
+        merged: Dict = {}
+        names: Dict = {}
+        with storage._lock:
+            rows = storage.connection.execute(sql, params).fetchall()
+        for domain_hash, engine_type, stored_domain, blob in rows:
+            key = domain_hash if by == 'domain' else engine_type
+            sketch = LogHistogram.from_bytes(blob)
+            if key in merged:
+                merged[key].merge(sketch)
+            else:
+                merged[key] = sketch
+                names[key] = stored_domain if by == 'domain' else engine_type
+
+        if by == 'domain' and storage.cipher and names:
+            keys = list(names)
+            for key, plain in zip(keys, storage.cipher.decrypt_batch([names[k] for k in keys], 'domain')):
+                names[key] = plain
+        return {names[key]: sketch for key, sketch in merged.items()}
+
+    def get_percentiles(self, start_time: float, end_time: float, by: str = 'domain',
+                        quantiles: Iterable[float] = QUANTILES,
+                        device_ids: Optional[Sequence[str]] = None,
+                        domain: Optional[str] = None) -> Dict[str, Dict]:
+        """
+        Duration percentiles per domain (or per browser, with by='browser')
+        over the UTC days overlapping [start_time, end_time), optionally
+        only for some devices or one domain. Each entry has the count, mean
+        and e.g. 'p50', 'p90', 'p99', busiest first.
+        """
+        try:
+            quantiles = list(quantiles)
+            results = {}
+            for name, sketch in self._merged(start_time, end_time, by, device_ids, domain).items():
+                entry = {'count': sketch.count, 'mean': sketch.mean()}
+                for q in quantiles:
+                    entry[quantile_name(q)] = sketch.quantile(q)
+                results[name] = entry
+            return dict(sorted(results.items(), key=lambda item: item[1]['count'], reverse=True))
+        except Exception as e:
+            logger.error("Failed to get duration percentiles: %s", e)
+            return {}
@@ -0,0 +1,100 @@
+import hashlib
+import os
+from functools import lru_cache
+from typing import List, Optional, Sequence, Union
+
+# Layout of every encrypted value: 12 byte nonce followed by ciphertext + GCM tag
+NONCE_SIZE = 12
+KEY_SIZE = 32
+HASH_SIZE = 16
+
+
+@lru_cache(maxsize=8)
+def _derive_key(passphrase: str, salt: bytes, iterations: int) -> bytes:
+    """
+    Stretches a passphrase into a key. This is deliberately slow, so we cache
+    the result - opening a second StorageManager shouldn't cost another 200ms.
+    """
+    return hashlib.pbkdf2_hmac('sha256', passphrase.encode('utf-8'), salt, iterations, KEY_SIZE)
+
+
+def lookup_hash(value: str, key: bytes = b'') -> bytes:
+    """
+    Deterministic hash used for equality lookups on columns we can't index
+    directly (because they're encrypted). Keyed when a key is given so the
+    hashes can't be brute-forced from a list of popular URLs.
+    """
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=HASH_SIZE, key=key).digest()
+
+
+class ActivityCipher:
+    """
+    Encrypts sensitive activity columns (URLs, titles) with AES-GCM.
+
+    Everything works on whole batches: one call encrypts or decrypts every
+    value of an insert/query batch, reusing one AESGCM instance and one
+    chunk of random bytes for the nonces.
+    """
+
+    def __init__(self, key: bytes):
+        if len(key) != KEY_SIZE:
+            raise ValueError(f"Encryption key must be {KEY_SIZE} bytes, got {len(key)}")
+
+        try:
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        except ImportError as e:
+            raise ImportError(
+                "Column encryption needs the 'cryptography' package (see requirements.txt)"
+            ) from e
+
+        # Separate subkeys so the lookup hashes never reuse the encryption key
+        self._aead = AESGCM(hashlib.blake2b(b'encrypt', key=key, digest_size=KEY_SIZE).digest())
+        self.hash_key = hashlib.blake2b(b'lookup', key=key, digest_size=KEY_SIZE).digest()
+
+    @classmethod
+    def from_passphrase(cls, passphrase: str, salt: bytes, iterations: int = 200_000) -> 'ActivityCipher':
+        """Builds a cipher from a passphrase (the derived key is cached)"""
+        return cls(_derive_key(passphrase, salt, iterations))
+
+    @staticmethod
+    def generate_key() -> bytes:
+        """Makes a fresh random key"""
+        return os.urandom(KEY_SIZE)
+
+    def encrypt_batch(self, values: Sequence[Optional[str]], column: str) -> List[Optional[bytes]]:
+        """
+        Encrypts a batch of values for one column. The column name is bound in
+        as associated data so a URL ciphertext can't be passed off as a title.
+        None stays None.
+        """
+        aad = column.encode('utf-8')
+        nonces = os.urandom(NONCE_SIZE * len(values))
+        encrypt = self._aead.encrypt
+        result = []
+        for i, value in enumerate(values):
+            if value is None:
+                result.append(None)
+                continue
+            nonce = nonces[i * NONCE_SIZE:(i + 1) * NONCE_SIZE]
+            result.append(nonce + encrypt(nonce, value.encode('utf-8'), aad))
+        return result
+
+    def decrypt_batch(self, values: Sequence[Optional[Union[bytes, str]]], column: str) -> List[Optional[str]]:
+        """
+        Decrypts a batch of values for one column.
+        Plain strings pass straight through, so rows written before encryption
+        was switched on still read fine.
+        """
+        aad = column.encode('utf-8')
+        decrypt = self._aead.decrypt
+        result = []
+        for value in values:
+            if value is None or isinstance(value, str):
+                result.append(value)
+                continue
+            result.append(decrypt(value[:NONCE_SIZE], value[NONCE_SIZE:], aad).decode('utf-8'))
+        return result
+
+    def lookup_hash(self, value: str) -> bytes:
+        """Keyed deterministic hash for equality lookups"""
+        return lookup_hash(value, self.hash_key)
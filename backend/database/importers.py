@@ -0,0 +1,237 @@
+import logging
+import sqlite3
+from typing import Optional
+
+from ..core.activity_tracker import BrowserType
+from ..utils.urls import extract_domain
+
+logger = logging.getLogger(__name__)
+
+# Chromium counts microseconds from 1601-01-01, Firefox from 1970-01-01
+CHROMIUM_EPOCH_OFFSET = 11644473600
+
+# The import runs as one INSERT ... SELECT inside SQLite. Visits are turned
+# into activities in SQL; only hashing (and encryption, when there's a
+# cipher) calls back into Python, through registered functions - once per
+# distinct page rather than once per visit. CROSS JOIN pins visits as the
+# outer loop, so rows go in in history order.
+#
+# ON CONFLICT leans on the natural-key index. Until the dedupe migration
+# has built it, visits already imported are filtered out in the SELECT
+# instead (by start time first, which idx_times covers).
+_NOT_IMPORTED = """
+      AND NOT EXISTS (
+        SELECT 1 FROM main.activities a
+        WHERE a.start_time = v.start_time AND a.device_id = :device_id
+          AND a.tab_id = :tab_prefix || v.visit_id AND a.url_hash = p.url_hash
+      )"""
+
+_INSERT = """
+    WITH pages AS MATERIALIZED (
+        SELECT id, {url} AS url, {title} AS title,
+               pwt_url_hash(url) AS url_hash, pwt_domain_hash(url) AS domain_hash
+        FROM {pages_table}
+        WHERE url LIKE 'http://%' OR url LIKE 'https://%'
+    )
+    INSERT INTO main.activities (
+        url, title, url_hash, domain_hash,
+        start_time, end_time, duration,
+        platform_type, engine_type, is_active,
+        device_id, tab_id
+    )
+    SELECT p.url, p.title, p.url_hash, p.domain_hash,
+           v.start_time, v.start_time + v.duration, v.duration,
+           :platform_type, :engine_type, 0,
+           :device_id, :tab_prefix || v.visit_id
+    FROM ({visits}) v CROSS JOIN pages p ON p.id = v.page_id
+    WHERE v.visit_time >= :since{dedupe}
+    ON CONFLICT DO NOTHING
+"""
+
+
+class HistoryImporter:
+    """
+    Seeds activities from a browser's own history database. Each visit
+    becomes one activity; its duration is what the browser recorded or,
+    failing that, the time until the next visit, capped at max_gap (idle
+    time shouldn't count as reading).
+
+    Point it at a copy of the file - browsers keep the live one locked.
+    Visits are keyed by their id in the source, so importing the same file
+    twice (or a newer copy of it) only adds what's new. Anything derived
+    through write listeners (e.g. SessionStitcher) needs
+    storage.rebuild_derived() after.
+    """
+    name = ""
+    # Tables that identify this browser's history file
+    tables = ()
+    # Table of pages, with id, url and title columns
+    pages_table = ""
+    # SELECT producing visit_id, page_id, visit_time (in source units, for
+    # the since filter), start_time and duration
+    visits_sql = ""
+
+    def __init__(self, storage, max_gap: float = 1800, cache_kib: int = 256 * 1024):
+        self.storage = storage
+        self.max_gap = max_gap
+        self.cache_kib = cache_kib
+
+    def engine_type(self) -> str:
+        raise NotImplementedError
+
+    def since_value(self, since: float) -> int:
+        """since (unix seconds) in the source's own time units"""
+        raise NotImplementedError
+
+    @classmethod
+    def matches(cls, path: str) -> bool:
+        """Checks whether a file looks like this browser's history"""
+        try:
+            connection = sqlite3.connect(path)
+            try:
+                names = {row[0] for row in connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'")}
+            finally:
+                connection.close()
+        except sqlite3.Error:
+            return False
+        return all(table in names for table in cls.tables)
+
+    def _register_functions(self):
+        storage = self.storage
+        connection = storage.connection
+        connection.create_function('pwt_url_hash', 1, storage._lookup_hash, deterministic=True)
+        connection.create_function('pwt_domain_hash', 1,
+                                   lambda url: storage._lookup_hash(extract_domain(url)),
+                                   deterministic=True)
+        if storage.cipher:
+            cipher = storage.cipher
+            connection.create_function('pwt_encrypt_url', 1,
+                                       lambda value: cipher.encrypt_batch([value], 'url')[0])
+            connection.create_function('pwt_encrypt_title', 1,
+                                       lambda value: cipher.encrypt_batch([value], 'title')[0])
+
+    def import_file(self, path: str, since: Optional[float] = None) -> int:
+        """
+        Imports every visit (or those from since onwards) in one set-based
+        statement. Returns how many activities were added.
+        """
+        storage = self.storage
+        connection = storage.connection
+        # The PRAGMA, ATTACH and the insert all go through the shared
+        # connection, so nothing else may use it until it's put back
+        with storage._lock:
+            self._register_functions()
+            encrypted = storage.cipher is not None
+            sql = _INSERT.format(
+                url='pwt_encrypt_url(url)' if encrypted else 'url',
+                title='pwt_encrypt_title(title)' if encrypted else 'title',
+                pages_table=self.pages_table,
+                visits=self.visits_sql,
+                dedupe='' if storage._has_natural_key() else _NOT_IMPORTED
+            )
+            params = {
+                'platform_type': storage.platform_type,
+                'engine_type': self.engine_type(),
+                'device_id': storage.device_id,
+                'tab_prefix': f'import:{self.name}:',
+                'since': self.since_value(since or 0),
+                'max_gap': self.max_gap,
+            }
+
+            # Rows land in history order but the hash indexes are random-order,
+            # so give the page cache room for them while the import runs
+            cache_size = connection.execute("PRAGMA cache_size").fetchone()[0]
+            connection.execute(f"PRAGMA cache_size = {-self.cache_kib}")
+            try:
+                # ATTACH can't run inside a transaction, so it wraps the insert's one
+                connection.execute("ATTACH DATABASE ? AS source", (path,))
+                try:
+                    with storage.transaction():
+                        # rowcount isn't set for statements starting with WITH
+                        before = connection.total_changes
+                        connection.execute(sql, params)
+                        added = connection.total_changes - before
+                        if storage.cache is not None:
+                            storage.cache.clear()
+                finally:
+                    connection.execute("DETACH DATABASE source")
+            finally:
+                connection.execute(f"PRAGMA cache_size = {cache_size}")
+
+        logger.info("Imported %s activities from %s history", added, self.name)
+        return added
+
+
+class ChromiumHistoryImporter(HistoryImporter):
+    """Reads Chromium's History file (Chrome, Edge, Brave, Opera...)"""
+    name = "chromium"
+    tables = ('urls', 'visits')
+    pages_table = "source.urls"
+    # Subframe navigations (core transition types 3 and 4) aren't page views.
+    # Internal pages (chrome://...) aren't imported, but still end the visit
+    # before them, so they only drop out when joined against pages.
+    visits_sql = f"""
+        SELECT id AS visit_id, url AS page_id, visit_time,
+               visit_time / 1000000.0 - {CHROMIUM_EPOCH_OFFSET} AS start_time,
+               CASE WHEN visit_duration > 0
+                    THEN MIN(visit_duration / 1000000.0, :max_gap)
+                    ELSE MIN(MAX(COALESCE(LEAD(visit_time) OVER (ORDER BY visit_time)
+                                          - visit_time, 0), 0) / 1000000.0, :max_gap)
+               END AS duration
+        FROM source.visits
+        WHERE (transition & 255) NOT IN (3, 4)
+    """
+
+    def engine_type(self) -> str:
+        if self.storage.platform_type == "mobile":
+            return BrowserType.CHROMIUM_MOBILE.value
+        return BrowserType.CHROMIUM_DESKTOP.value
+
+    def since_value(self, since: float) -> int:
+        return int((since + CHROMIUM_EPOCH_OFFSET) * 1000000) if since else 0
+
+
+class FirefoxHistoryImporter(HistoryImporter):
+    """Reads Firefox's places.sqlite"""
+    name = "firefox"
+    tables = ('moz_places', 'moz_historyvisits')
+    pages_table = "source.moz_places"
+    # Embeds, downloads, framed links and reloads (4, 7, 8, 9) aren't page
+    # views. Internal pages (about:...) end the visit before them, as above.
+    visits_sql = """
+        SELECT id AS visit_id, place_id AS page_id, visit_date AS visit_time,
+               visit_date / 1000000.0 AS start_time,
+               MIN(MAX(COALESCE(LEAD(visit_date) OVER (ORDER BY visit_date)
+                                - visit_date, 0), 0) / 1000000.0, :max_gap) AS duration
+        FROM source.moz_historyvisits
+        WHERE visit_type NOT IN (4, 7, 8, 9)
+    """
+
+    def engine_type(self) -> str:
+        if self.storage.platform_type == "mobile":
+            return BrowserType.GECKO_MOBILE.value
+        return BrowserType.GECKO_DESKTOP.value
+
+    def since_value(self, since: float) -> int:
+        return int(since * 1000000)
+
+
+IMPORTERS = (ChromiumHistoryImporter, FirefoxHistoryImporter)
+
+
+def import_history(storage, path: str, since: Optional[float] = None, max_gap: float = 1800) -> int:
+    """
+    Works out which browser a history file came from and imports it.
+    Returns how many activities were added (0 if the file wasn't recognised
+    or the import failed).
+    """
+    try:
+        for importer in IMPORTERS:
+            if importer.matches(path):
+                return importer(storage, max_gap=max_gap).import_file(path, since)
+        logger.error("Don't recognise %s as a browser history file", path)
+        return 0
+    except Exception as e:
+        logger.error("Failed to import history: %s", e)
+        return 0
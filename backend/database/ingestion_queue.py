@@ -0,0 +1,431 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from ..utils.urls import extract_domain
+from .storage_backend import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+BLOCK = 'block'
+COALESCE = 'coalesce'
+DROP_OLDEST = 'drop_oldest'
+POLICIES = (BLOCK, COALESCE, DROP_OLDEST)
+
+HOUR = 3600
+
+
+def _activities(ops: List[tuple]) -> List[Dict]:
+    """The activities a unit of queued writes would save"""
+    found = []
+    for op in ops:
+        if op[0] == 'close':
+            found.append(op[2])
+        elif op[0] == 'save':
+            found.extend(op[1])
+    return found
+
+
+def _size(ops: List[tuple]) -> int:
+    """Queue slots a unit takes: one per activity or session change"""
+    return sum(len(op[1]) if op[0] == 'save' else 1 for op in ops)
+
+
+class IngestionQueue(StorageBackend):
+    """
+    Sits between the trackers and a storage backend so a stalled database
+    (checkpoint, slow disk) doesn't stall event handling. Writes made in
+    one transaction() become one queued unit; a writer thread applies
+    units in batches of up to batch_size items, each batch in one storage
+    transaction, and retries a failing batch max_retries times.
+
+    The queue holds at most max_items items (activities and session
+    changes). When it's full the policy decides:
+
+    - block: the handler waits for room (up to block_timeout seconds,
+      then the oldest units are shed).
+    - coalesce: queued writes are compacted - only each tab's latest
+      session change is kept, and back-to-back activities on the same tab
+      and URL become one with the summed duration. Blocks if that isn't
+      enough.
+    - drop_oldest: the oldest units are shed to make room.
+
+    Shedding never loses a session change (the tab's latest one is still
+    written, so the stored state stays right - unless the storage refuses
+    that very change, see poisoned) and never loses time from the books:
+    shed activities are added up per hour and domain and written to
+    dropped_activity (see get_dropped_totals). stats() has the counters;
+    enqueued always equals written + coalesced + dropped + pending, and
+    likewise for seconds.
+
+    Reads go straight to the storage and only see what's been written;
+    call flush() first to wait for the queue to drain.
+    """
+
+    def __init__(self, storage, max_items: int = 10000, policy: str = BLOCK,
+                 batch_size: int = 500, block_timeout: Optional[float] = None,
+                 max_retries: int = 3, retry_delay: float = 0.5):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        super().__init__(storage.platform_type, storage.engine_type, storage.device_id)
+        self.storage = storage
+        self.max_items = max_items
+        self.policy = policy
+        self.batch_size = batch_size
+        self.block_timeout = block_timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self._units = deque()
+        self._condition = threading.Condition()
+        self._local = threading.local()
+        # Items queued or being written; only drops once a batch commits
+        self.depth = 0
+        self._writing: List[List[tuple]] = []
+        # Session changes from shed units, written ahead of the next batch
+        self._residue: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._unwritten_drops: Dict[Tuple[float, str], List] = {}
+        self._closed = False
+
+        # Metrics
+        self.high_water = 0
+        self.high_water_at: Optional[float] = None
+        self.enqueued = 0
+        self.enqueued_seconds = 0.0
+        self.written = 0
+        self.written_seconds = 0.0
+        self.coalesced = 0
+        self.dropped = 0
+        self.dropped_seconds = 0.0
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self.batches = 0
+        self.write_errors = 0
+        self.poisoned = 0
+        self.max_batch_seconds = 0.0
+
+        self._writer = threading.Thread(target=self._run, name="ingestion-writer", daemon=True)
+        self._writer.start()
+
+    # Writes - queued
+
+    @contextmanager
+    def transaction(self):
+        """Collects this thread's writes into one unit, queued at the end (dropped on error)"""
+        if getattr(self._local, 'ops', None) is not None:
+            yield self
+            return
+        self._local.ops = []
+        try:
+            yield self
+            ops = self._local.ops
+        finally:
+            self._local.ops = None
+        if ops:
+            self._put(ops)
+
+    def _write(self, op: tuple):
+        ops = getattr(self._local, 'ops', None)
+        if ops is not None:
+            ops.append(op)
+        else:
+            self._put([op])
+
+    def insert_activities(self, activities: List[Dict]):
+        self._write(('save', [dict(activity) for activity in activities]))
+
+    def open_session(self, tab_id: str, session: Dict, tab_info: Dict, last_active: bool = True):
+        self._write(('open', tab_id, dict(session), dict(tab_info), last_active))
+
+    def close_session(self, tab_id: str, activity: Dict):
+        self._write(('close', tab_id, dict(activity)))
+
+    def discard_session(self, tab_id: str):
+        self._write(('discard', tab_id))
+
+    def _put(self, ops: List[tuple]):
+        size = _size(ops)
+        activities = _activities(ops)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Ingestion queue is closed")
+            self.enqueued += len(activities)
+            self.enqueued_seconds += sum(activity['duration'] for activity in activities)
+            if self.depth + size > self.max_items and self.depth:
+                self._make_room(size)
+            self._units.append(ops)
+            self.depth += size
+            if self.depth > self.high_water:
+                self.high_water = self.depth
+                self.high_water_at = time.time()
+            self._condition.notify_all()
+
+    def _make_room(self, size: int):
+        """Applies the overflow policy"""
+        if self.policy == COALESCE:
+            self._compact()
+            if self.depth + size <= self.max_items:
+                return
+        if self.policy == DROP_OLDEST or not self._wait_for_room(size):
+            # Items being written can't be taken back, only queued ones
+            while self._units and self.depth + size > self.max_items:
+                ops = self._units.popleft()
+                self.depth -= _size(ops)
+                self._shed(ops)
+
+    def _wait_for_room(self, size: int) -> bool:
+        self.blocked += 1
+        started = time.monotonic()
+        deadline = None if self.block_timeout is None else started + self.block_timeout
+        try:
+            while self.depth and self.depth + size > self.max_items:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    logger.warning("Ingestion queue stayed full; shedding the oldest writes")
+                    return False
+                self._condition.wait(remaining)
+            return True
+        finally:
+            self.blocked_seconds += time.monotonic() - started
+
+    @staticmethod
+    def _session_changes(ops: List[tuple], into: 'OrderedDict[str, tuple]'):
+        """Folds a unit's session changes into into, keeping only each tab's latest"""
+        for op in ops:
+            if op[0] in ('open', 'close', 'discard'):
+                into.pop(op[1], None)
+                into[op[1]] = op if op[0] == 'open' else ('discard', op[1])
+
+    def _shed(self, ops: List[tuple]):
+        """
+        Drops one of the oldest units' activities, keeping its session changes
+        (written ahead of everything still queued) and its time on the books
+        """
+        self._session_changes(ops, self._residue)
+        self._count_dropped(_activities(ops))
+        self._condition.notify_all()
+
+    def _count_dropped(self, activities: List[Dict]):
+        for activity in activities:
+            bucket = activity['start_time'] - activity['start_time'] % HOUR
+            total = self._unwritten_drops.setdefault(
+                (bucket, extract_domain(activity['url'])), [0.0, 0])
+            total[0] += activity['duration']
+            total[1] += 1
+            self.dropped += 1
+            self.dropped_seconds += activity['duration']
+
+    def _compact(self):
+        """Rewrites everything queued as one unit: merged activities plus each tab's last session change"""
+        activities: List[Dict] = []
+        last_by_tab: Dict[str, Dict] = {}
+        state: 'OrderedDict[str, tuple]' = OrderedDict()
+        before = self.depth
+        for ops in self._units:
+            self._session_changes(ops, state)
+            for activity in _activities(ops):
+                tab_id = str(activity.get('tab_id', ''))
+                last = last_by_tab.get(tab_id)
+                if last is not None and last['url'] == activity['url']:
+                    last['end_time'] = max(last['end_time'], activity['end_time'])
+                    last['duration'] += activity['duration']
+                    self.coalesced += 1
+                else:
+                    last = dict(activity)
+                    last_by_tab[tab_id] = last
+                    activities.append(last)
+        compacted = ([('save', activities)] if activities else []) + list(state.values())
+        self._units = deque([compacted]) if compacted else deque()
+        self.depth = _size(compacted) + sum(_size(ops) for ops in self._writing)
+        logger.info("Ingestion queue compacted from %s to %s items", before, self.depth)
+
+    # The writer
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not (self._units or self._residue or self._unwritten_drops or self._closed):
+                    self._condition.wait()
+                if self._closed and not (self._units or self._residue or self._unwritten_drops):
+                    return
+                batch, size = [], 0
+                while self._units and (not batch or size + _size(self._units[0]) <= self.batch_size):
+                    ops = self._units.popleft()
+                    batch.append(ops)
+                    size += _size(ops)
+                residue, self._residue = self._residue, OrderedDict()
+                drops, self._unwritten_drops = self._unwritten_drops, {}
+                self._writing = batch
+            self._write_batch(batch, size, residue, drops)
+
+    def _write_batch(self, batch: List[List[tuple]], size: int, residue, drops):
+        if residue:
+            self._write_residue(residue)
+
+        def write():
+            for ops in batch:
+                self._apply(ops)
+            if drops:
+                self.storage.record_dropped(drops)
+
+        started = time.perf_counter()
+        if not self._retrying(write, "batch"):
+            # Never going in: account for it like any other shed write
+            residue = OrderedDict()
+            with self._condition:
+                self._writing = []
+                self.depth -= size
+                for ops in batch:
+                    self._session_changes(ops, residue)
+                    self._count_dropped(_activities(ops))
+                if self._closed:
+                    # Nobody's coming back for these; leave a trace at least
+                    logger.error("Closing with unwritten session changes %s and shed totals %s",
+                                 list(residue.values()), drops)
+                    residue, drops = {}, {}
+                # Anything shed meanwhile is newer, so it wins
+                for tab_id, op in residue.items():
+                    self._residue.setdefault(tab_id, op)
+                for key, (seconds, count) in drops.items():
+                    total = self._unwritten_drops.setdefault(key, [0.0, 0])
+                    total[0] += seconds
+                    total[1] += count
+                self._condition.notify_all()
+            return
+
+        seconds = time.perf_counter() - started
+        activities = [activity for ops in batch for activity in _activities(ops)]
+        with self._condition:
+            self._writing = []
+            self.depth -= size
+            self.batches += 1
+            self.written += len(activities)
+            self.written_seconds += sum(activity['duration'] for activity in activities)
+            self.max_batch_seconds = max(self.max_batch_seconds, seconds)
+            self._condition.notify_all()
+
+    def _write_residue(self, residue):
+        """
+        Writes the session changes left by shed or failed writes, in their
+        own transaction ahead of the batch - so one the storage refuses
+        can't take every later batch down with it. If it still fails after
+        the retries, each change is tried alone and any that fails again is
+        dropped (counted in poisoned).
+        """
+        if self._retrying(lambda: self._apply(list(residue.values())), "session changes"):
+            return
+        for op in residue.values():
+            try:
+                with self.storage.transaction():
+                    self._apply([op])
+            except Exception as e:
+                self.write_errors += 1
+                self.poisoned += 1
+                logger.error("Dropping %s of tab %s, the storage won't take it: %s", op[0], op[1], e)
+
+    def _retrying(self, write, what: str) -> bool:
+        """Runs write in a storage transaction, retrying max_retries times. False if it never went in."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.storage.transaction():
+                    write()
+                return True
+            except Exception as e:
+                self.write_errors += 1
+                logger.error("Ingestion %s failed (attempt %s): %s", what, attempt + 1, e)
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_delay * (attempt + 1))
+        return False
+
+    def _apply(self, ops: List[tuple]):
+        storage = self.storage
+        for op in ops:
+            if op[0] == 'save':
+                storage.insert_activities(op[1])
+            elif op[0] == 'open':
+                storage.open_session(*op[1:])
+            elif op[0] == 'close':
+                storage.close_session(op[1], op[2])
+            else:
+                storage.discard_session(op[1])
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until everything queued so far is written. False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self.depth or self._residue or self._unwritten_drops:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self):
+        """Writes out what's queued and stops the writer. The storage stays open."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._writer.join()
+
+    def stats(self) -> Dict:
+        """Counters, plus what's still pending, for dashboards and reconciling totals"""
+        with self._condition:
+            pending = [activity for ops in list(self._units) + self._writing
+                       for activity in _activities(ops)]
+            return {
+                'policy': self.policy,
+                'depth': self.depth,
+                'high_water': self.high_water,
+                'high_water_at': self.high_water_at,
+                'enqueued': self.enqueued,
+                'enqueued_seconds': self.enqueued_seconds,
+                'written': self.written,
+                'written_seconds': self.written_seconds,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'dropped_seconds': self.dropped_seconds,
+                'pending': len(pending),
+                'pending_seconds': sum(activity['duration'] for activity in pending),
+                'blocked': self.blocked,
+                'blocked_seconds': self.blocked_seconds,
+                'batches': self.batches,
+                'write_errors': self.write_errors,
+                'poisoned': self.poisoned,
+                'max_batch_seconds': self.max_batch_seconds,
+            }
+
+    # Everything else goes to the storage
+
+    def delete_activities(self, start_time: float, end_time: float) -> int:
+        self.flush()
+        return self.storage.delete_activities(start_time, end_time)
+
+    def replace_activities(self, start_time: float, end_time: float, activities: List[Dict]):
+        self.flush()
+        self.storage.replace_activities(start_time, end_time, activities)
+
+    def rebuild_derived(self):
+        self.flush()
+        self.storage.rebuild_derived()
+
+    def load_open_sessions(self):
+        self.flush()
+        return self.storage.load_open_sessions()
+
+    def get_activities(self, start_time: float, end_time: float) -> List[Dict]:
+        return self.storage.get_activities(start_time, end_time)
+
+    def get_domain_totals(self, start_time: float, end_time: float) -> Dict[str, float]:
+        return self.storage.get_domain_totals(start_time, end_time)
+
+    def record_dropped(self, totals):
+        self.storage.record_dropped(totals)
+
+    def get_dropped_totals(self, start_time: float, end_time: float) -> Dict[str, float]:
+        return self.storage.get_dropped_totals(start_time, end_time)
+
+    def cleanup_old_data(self):
+        self.storage.cleanup_old_data()
@@ -0,0 +1,266 @@
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ..utils.urls import extract_domain
+from .storage_backend import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend(StorageBackend):
+    """
+    Keeps activities in memory, column by column, sorted by start time -
+    for ephemeral tracking and tests. Numbers live in typed arrays (8 bytes
+    each rather than a boxed float), and range scans are two binary searches
+    plus a slice. Nothing survives the process.
+
+    Writes inside transaction() keep an undo log, so a failure rolls back
+    like it would in SQLite. Reads take the same lock as writes, so they
+    never see a half-done insert.
+    """
+
+    def __init__(self, platform_type: str, engine_type: str, device_id: str = ""):
+        super().__init__(platform_type, engine_type, device_id)
+        self._ids = array('q')
+        self._starts = array('d')
+        self._ends = array('d')
+        self._durations = array('d')
+        self._is_active = array('b')
+        self._urls: List[str] = []
+        self._titles: List[Optional[str]] = []
+        self._platforms: List[str] = []
+        self._engines: List[str] = []
+        self._devices: List[str] = []
+        self._tab_ids: List[str] = []
+        self._created: List[str] = []
+        # Natural key -> id, for upserts
+        self._keys: Dict[tuple, int] = {}
+        self._next_id = 1
+
+        self._open_sessions: Dict[str, Tuple[Dict, Dict]] = {}
+        # Window id -> the tab marked as in front there
+        self._front_tabs: Dict[object, str] = {}
+        self._undo: Optional[List[Callable[[], None]]] = None
+        # (hour start, domain) -> [seconds, count] shed by an ingestion queue
+        self._dropped: Dict[Tuple[float, str], List] = {}
+
+    def _columns(self) -> list:
+        return [self._ids, self._starts, self._ends, self._durations, self._is_active,
+                self._urls, self._titles, self._platforms, self._engines, self._devices,
+                self._tab_ids, self._created]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups several writes. Nests: only the outermost block keeps the undo
+        log, and an exception anywhere undoes everything since it started.
+        """
+        with self._lock:
+            if self._undo is not None:
+                yield self
+                return
+
+            self._undo = []
+            try:
+                yield self
+            except BaseException:
+                for undo in reversed(self._undo):
+                    undo()
+                raise
+            finally:
+                self._undo = None
+
+    def _on_rollback(self, undo: Callable[[], None]):
+        if self._undo is not None:
+            self._undo.append(undo)
+
+    def _key_at(self, index: int) -> tuple:
+        return (self._devices[index], self._tab_ids[index], self._starts[index], self._urls[index])
+
+    def _index_of(self, row_id: int, start_time: float) -> int:
+        index = bisect_left(self._starts, start_time)
+        while self._ids[index] != row_id:
+            index += 1
+        return index
+
+    def _remove_slice(self, lo: int, hi: int):
+        """Drops rows [lo, hi), keeping what's needed to put them back"""
+        if lo >= hi:
+            return
+        for index in range(lo, hi):
+            del self._keys[self._key_at(index)]
+        removed = []
+        for column in self._columns():
+            removed.append(column[lo:hi])
+            del column[lo:hi]
+
+        def undo():
+            for column, values in zip(self._columns(), removed):
+                column[lo:lo] = values
+            for index in range(lo, hi):
+                self._keys[self._key_at(index)] = self._ids[index]
+        self._on_rollback(undo)
+
+    def insert_activities(self, activities: List[Dict]):
+        with self.transaction():
+            for activity in activities:
+                self._upsert(activity)
+
+    def _upsert(self, activity: Dict):
+        start = float(activity['start_time'])
+        end = float(activity['end_time'])
+        url = activity['url']
+        device_id = activity.get('device_id') or self.device_id
+        tab_id = str(activity.get('tab_id', ''))
+        key = (device_id, tab_id, start, url)
+
+        existing = self._keys.get(key)
+        if existing is not None:
+            # Same rule as the SQLite upsert: only a later end time wins
+            index = self._index_of(existing, start)
+            if end <= self._ends[index]:
+                return
+            old = (self._ends[index], self._durations[index], self._is_active[index])
+            self._ends[index] = end
+            self._durations[index] = activity['duration']
+            self._is_active[index] = int(bool(activity['is_active']))
+
+            def undo():
+                at = self._index_of(existing, start)
+                self._ends[at], self._durations[at], self._is_active[at] = old
+            self._on_rollback(undo)
+            return
+
+        row_id = self._next_id
+        self._next_id += 1
+        index = bisect_right(self._starts, start)
+        values = (row_id, start, end, float(activity['duration']), int(bool(activity['is_active'])),
+                  url, activity.get('title'),
+                  activity.get('platform_type') or self.platform_type,
+                  activity.get('engine_type') or self.engine_type,
+                  device_id, tab_id,
+                  datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+        for column, value in zip(self._columns(), values):
+            column.insert(index, value)
+        self._keys[key] = row_id
+
+        def undo():
+            at = self._index_of(row_id, start)
+            del self._keys[key]
+            for column in self._columns():
+                del column[at]
+        self._on_rollback(undo)
+
+    def delete_activities(self, start_time: float, end_time: float) -> int:
+        with self.transaction():
+            lo = bisect_left(self._starts, start_time)
+            hi = bisect_left(self._starts, end_time)
+            self._remove_slice(lo, hi)
+        return max(hi - lo, 0)
+
+    def open_session(self, tab_id: str, session: Dict, tab_info: Dict, last_active: bool = True):
+        with self.transaction():
+            window_id = tab_info.get('window_id')
+            previous = (self._open_sessions.get(tab_id), self._front_tabs.get(window_id))
+            self._open_sessions[tab_id] = (dict(session), dict(tab_info))
+            if last_active:
+                self._front_tabs[window_id] = tab_id
+            elif previous[1] == tab_id:
+                del self._front_tabs[window_id]
+
+            def undo():
+                if previous[0] is None:
+                    self._open_sessions.pop(tab_id, None)
+                else:
+                    self._open_sessions[tab_id] = previous[0]
+                if previous[1] is None:
+                    self._front_tabs.pop(window_id, None)
+                else:
+                    self._front_tabs[window_id] = previous[1]
+            self._on_rollback(undo)
+
+    def close_session(self, tab_id: str, activity: Dict):
+        with self.transaction():
+            self.insert_activities([activity])
+            removed = self._open_sessions.pop(tab_id, None)
+            if removed is not None:
+                self._on_rollback(lambda: self._open_sessions.__setitem__(tab_id, removed))
+
+    def discard_session(self, tab_id: str):
+        with self.transaction():
+            removed = self._open_sessions.pop(tab_id, None)
+            if removed is not None:
+                self._on_rollback(lambda: self._open_sessions.__setitem__(tab_id, removed))
+
+    def load_open_sessions(self) -> Tuple[Dict, List[Dict]]:
+        with self._lock:
+            active_tabs = {tab_id: dict(session) for tab_id, (session, _) in self._open_sessions.items()}
+            fronts = [self._open_sessions[tab_id] for tab_id in self._front_tabs.values()
+                      if tab_id in self._open_sessions]
+        fronts.sort(key=lambda front: front[0]['start_time'])
+        return active_tabs, [dict(tab_info) for _, tab_info in fronts]
+
+    def record_dropped(self, totals: Dict[Tuple[float, str], List]):
+        with self.transaction():
+            for key, (seconds, count) in totals.items():
+                previous = list(self._dropped[key]) if key in self._dropped else None
+                total = self._dropped.setdefault(key, [0.0, 0])
+                total[0] += seconds
+                total[1] += count
+                self._on_rollback(lambda key=key, previous=previous: (
+                    self._dropped.pop(key) if previous is None
+                    else self._dropped.__setitem__(key, previous)))
+
+    def get_dropped_totals(self, start_time: float, end_time: float) -> Dict[str, float]:
+        totals = {}
+        with self._lock:
+            for (bucket_start, domain), (seconds, _) in self._dropped.items():
+                if start_time <= bucket_start < end_time:
+                    totals[domain] = totals.get(domain, 0) + seconds
+        return totals
+
+    def _range(self, start_time: float, end_time: float) -> List[int]:
+        """Indexes of activities inside the range, newest first"""
+        lo = bisect_left(self._starts, start_time)
+        hi = bisect_right(self._starts, end_time)
+        ends = self._ends
+        return [i for i in range(hi - 1, lo - 1, -1) if ends[i] <= end_time]
+
+    def get_activities(self, start_time: float, end_time: float) -> List[Dict]:
+        try:
+            with self._lock:
+                indexes = self._range(start_time, end_time)
+                return [
+                    {'id': self._ids[i], 'url': self._urls[i], 'title': self._titles[i],
+                     'start_time': self._starts[i], 'end_time': self._ends[i],
+                     'duration': self._durations[i], 'platform_type': self._platforms[i],
+                     'engine_type': self._engines[i], 'is_active': self._is_active[i],
+                     'created_at': self._created[i]}
+                    for i in indexes
+                ]
+        except Exception as e:
+            logger.error("Failed to get activities: %s", e)
+            return []
+
+    def get_domain_totals(self, start_time: float, end_time: float) -> Dict[str, float]:
+        totals = {}
+        with self._lock:
+            for i in self._range(start_time, end_time):
+                domain = extract_domain(self._urls[i])
+                totals[domain] = totals.get(domain, 0) + self._durations[i]
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def cleanup_old_data(self):
+        try:
+            cutoff = self._hot_window_start()
+            with self.transaction():
+                self._remove_slice(0, bisect_left(self._starts, cutoff))
+        except Exception as e:
+            logger.error("Failed to cleanup old data: %s", e)
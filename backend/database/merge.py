@@ -0,0 +1,202 @@
+"""
+Merges several devices' activity databases into one timeline.
+
+Each source is read in start_time order with one cursor on its own
+start_time index, a batch at a time, and the sources are merged through a
+heap holding one pending activity per source - so memory depends on the
+number of sources and the batch size, never on the size of the files.
+
+Where activities from different devices overlap, the last focus wins:
+the one that started later keeps the overlap, and the one it interrupted
+stops there and picks up again once it's over (if it was still running).
+Activities from the same device are left alone - the tracker already
+allows one per window.
+"""
+import heapq
+import logging
+import sqlite3
+from itertools import count
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# Columns copied from a source, and what to use on a database too old to have them
+COLUMNS = (
+    ('url', None),
+    ('title', "NULL"),
+    ('start_time', None),
+    ('end_time', None),
+    ('duration', None),
+    ('platform_type', None),
+    ('engine_type', None),
+    ('is_active', "0"),
+    ('device_id', "''"),
+    ('tab_id', "CAST(id AS TEXT)"),
+)
+
+
+class ActivitySource:
+    """
+    One device's activity database, opened read-only and walked in
+    start_time order. Rows that don't carry a device_id (everything from
+    a tracker that was never given one) get device_id, which defaults to
+    the file's name. Pass the device's cipher if its database is encrypted.
+    """
+
+    def __init__(self, path: str, device_id: Optional[str] = None, cipher=None,
+                 batch_size: int = 2000):
+        self.path = Path(path)
+        self.device_id = device_id or self.path.stem
+        self.cipher = cipher
+        self.batch_size = batch_size
+        self.read = 0
+
+    def _select(self, connection) -> str:
+        present = {row[1] for row in connection.execute("PRAGMA table_info(activities)")}
+        columns = []
+        for name, default in COLUMNS:
+            if name in present:
+                columns.append(name)
+            elif default is None:
+                raise ValueError(f"{self.path} has no activities.{name} column")
+            else:
+                columns.append(f"{default} AS {name}")
+        return f"SELECT {', '.join(columns)} FROM activities ORDER BY start_time"
+
+    def __iter__(self) -> Iterator[Dict]:
+        connection = sqlite3.connect(f"file:{quote(str(self.path))}?mode=ro", uri=True)
+        try:
+            cursor = connection.execute(self._select(connection))
+            names = [desc[0] for desc in cursor.description]
+            while True:
+                batch = cursor.fetchmany(self.batch_size)
+                if not batch:
+                    break
+                rows = [dict(zip(names, row)) for row in batch]
+                if self.cipher:
+                    for column in ('url', 'title'):
+                        values = self.cipher.decrypt_batch([row[column] for row in rows], column)
+                        for row, value in zip(rows, values):
+                            row[column] = value
+                elif any(isinstance(row['url'], bytes) for row in rows):
+                    # A database can be partly encrypted (cipher added later on)
+                    raise ValueError(f"{self.path} has encrypted rows - it needs its cipher")
+                for row in rows:
+                    if not row['device_id']:
+                        row['device_id'] = self.device_id
+                self.read += len(rows)
+                yield from rows
+        finally:
+            connection.close()
+
+
+def _piece(activity: Dict, start: float, end: float) -> Dict:
+    """Part of an activity, with its duration scaled to the part's share of the span"""
+    span = activity['end_time'] - activity['start_time']
+    duration = activity['duration'] * (end - start) / span if span > 0 else 0
+    return dict(activity, start_time=start, end_time=end, duration=duration)
+
+
+def merge_activities(sources: Iterable[Iterable[Dict]], stats: Optional[Dict] = None) -> Iterator[Dict]:
+    """
+    Merges activity streams that are each in start_time order, resolving
+    overlaps between devices. Yields each activity (or surviving piece of
+    one) once nothing can cut it any further. Pass a dict as stats to get
+    the number of activities 'trimmed' and 'resumed' after an interruption.
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault('trimmed', 0)
+    stats.setdefault('resumed', 0)
+    iterators = [iter(source) for source in sources]
+    order = count()
+    # (start_time, tie-break, source index or -1 for a resumed piece, activity)
+    heap: List = []
+
+    def advance(index: int):
+        activity = next(iterators[index], None)
+        if activity is not None:
+            heapq.heappush(heap, (activity['start_time'], next(order), index, activity))
+
+    def resume(activity: Dict, start: float):
+        if start < activity['end_time']:
+            heapq.heappush(heap, (start, next(order), -1, _piece(activity, start, activity['end_time'])))
+
+    for index in range(len(iterators)):
+        advance(index)
+
+    # Started but not yet yielded - a later start on another device can still cut them
+    running: List[Dict] = []
+    while heap:
+        start, _, index, activity = heapq.heappop(heap)
+        device = activity['device_id']
+        if index >= 0:
+            advance(index)
+        else:
+            # A resumed piece waits for whatever interrupted it to finish
+            busy_until = max((other['end_time'] for other in running
+                              if other['device_id'] != device and other['end_time'] > start),
+                             default=start)
+            if busy_until > start:
+                resume(activity, busy_until)
+                continue
+            stats['resumed'] += 1
+
+        still_running = []
+        for other in running:
+            if other['end_time'] <= start:
+                yield other
+            elif other['device_id'] != device:
+                stats['trimmed'] += 1
+                resume(other, activity['end_time'])
+                if start > other['start_time']:
+                    yield _piece(other, other['start_time'], start)
+            else:
+                still_running.append(other)
+        still_running.append(activity)
+        running = still_running
+
+    yield from sorted(running, key=lambda activity: activity['start_time'])
+
+
+def merge_databases(sources: Sequence[ActivitySource], storage, batch_size: int = 5000,
+                    stats: Optional[Dict] = None) -> int:
+    """
+    Merges the sources into storage (usually a fresh database), saving a
+    batch per transaction. Rows are upserted on their natural key, so
+    running it again with the same sources doesn't duplicate anything.
+    Returns the number of activities written, -1 on error.
+    """
+    stats = stats if stats is not None else {}
+    devices = [source.device_id for source in sources]
+    if len(set(devices)) != len(devices):
+        raise ValueError(f"Sources need different device ids, got {', '.join(devices)}")
+    target = Path(storage.db_path).resolve()
+    if any(source.path.resolve() == target for source in sources):
+        raise ValueError("Can't merge a database into itself")
+
+    written = 0
+    try:
+        batch: List[Dict] = []
+        for activity in merge_activities(sources, stats):
+            batch.append(activity)
+            if len(batch) >= batch_size:
+                if not storage.save_activities(batch):
+                    return -1
+                written += len(batch)
+                batch = []
+        if batch:
+            if not storage.save_activities(batch):
+                return -1
+            written += len(batch)
+    except Exception as e:
+        logger.error("Failed to merge activity databases: %s", e)
+        return -1
+    finally:
+        stats['read'] = sum(source.read for source in sources)
+        stats['written'] = written
+
+    logger.info("Merged %s activities from %s databases into %s (%s trimmed)",
+                written, len(sources), storage.db_path, stats['trimmed'])
+    return written
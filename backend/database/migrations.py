@@ -0,0 +1,442 @@
+import logging
+import sqlite3
+import threading
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Progress lives in the database itself so an interrupted backfill picks up
+# exactly where the last committed batch left off
+SCHEMA_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        status TEXT NOT NULL,
+        last_key INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def column_names(connection, table: str) -> List[str]:
+    """Lists a table's columns"""
+    return [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+
+
+class Migration:
+    """
+    One versioned schema change, split in three steps:
+
+    - apply_schema: quick DDL only (ADD COLUMN, CREATE TABLE). Runs while
+      the StorageManager starts up.
+    - backfill: fills in data one small batch at a time, keyed by rowid,
+      in the background while ingestion carries on.
+    - finalize: anything that needs the backfill done first (indexes,
+      constraints).
+    """
+    version = 0
+    name = ""
+
+    def apply_schema(self, connection, storage):
+        pass
+
+    def backfill(self, connection, storage, last_key: int, batch_size: int) -> Optional[int]:
+        """Processes rows after last_key. Returns the new last key, or None when done."""
+        return None
+
+    def finalize(self, connection, storage):
+        pass
+
+
+class LookupHashColumns(Migration):
+    """Adds title plus the url/domain lookup hashes, and hashes existing rows"""
+    version = 1
+    name = "lookup_hash_columns"
+
+    def apply_schema(self, connection, storage):
+        existing = column_names(connection, 'activities')
+        for column, kind in (('title', 'TEXT'), ('url_hash', 'BLOB'), ('domain_hash', 'BLOB')):
+            if column not in existing:
+                connection.execute(f"ALTER TABLE activities ADD COLUMN {column} {kind}")
+
+    def backfill(self, connection, storage, last_key, batch_size):
+        rows = connection.execute("""
+            SELECT id, url FROM activities
+            WHERE id > ? AND url_hash IS NULL
+            ORDER BY id LIMIT ?
+        """, (last_key, batch_size)).fetchall()
+        if not rows:
+            return None
+
+        ids = [row[0] for row in rows]
+        urls = storage._reveal([{'url': row[1], 'title': None} for row in rows])
+        connection.executemany(
+            "UPDATE activities SET url_hash = ?, domain_hash = ? WHERE id = ?",
+            [
+                (hashes[0], hashes[1], row_id)
+                for row_id, hashes in zip(ids, (storage._url_hashes(r['url']) for r in urls))
+            ]
+        )
+        return ids[-1]
+
+    def finalize(self, connection, storage):
+        # Domain lookups are what reports do most, so every platform gets this one
+        connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_domain_hash
+            ON activities(domain_hash, start_time)
+        """)
+        if storage.platform_type == "desktop":
+            connection.execute("""
+                CREATE INDEX IF NOT EXISTS idx_url_hash
+                ON activities(url_hash)
+            """)
+
+
+class OpenSessionsTable(Migration):
+    """Tracker state (open tab sessions) moves from a side JSON file into the DB"""
+    version = 2
+    name = "open_sessions_table"
+
+    def apply_schema(self, connection, storage):
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS open_sessions (
+                tab_id TEXT PRIMARY KEY,
+                start_time REAL NOT NULL,
+                session TEXT NOT NULL,
+                tab_info TEXT NOT NULL,
+                is_last_active INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+
+
+class NaturalKey(Migration):
+    """
+    Adds device_id/tab_id, removes duplicate activities, then puts a unique
+    index on (device_id, tab_id, start_time, url_hash) so inserts can upsert.
+    """
+    version = 3
+    name = "natural_key"
+
+    DELETE_DUPLICATES = """
+        DELETE FROM activities
+        WHERE id > ? AND id <= ? AND EXISTS (
+            SELECT 1 FROM activities AS earlier
+            WHERE earlier.start_time = activities.start_time
+              AND earlier.device_id = activities.device_id
+              AND earlier.tab_id = activities.tab_id
+              AND earlier.url_hash IS activities.url_hash
+              AND earlier.id < activities.id
+        )
+    """
+
+    def apply_schema(self, connection, storage):
+        existing = column_names(connection, 'activities')
+        for column in ('device_id', 'tab_id'):
+            if column not in existing:
+                connection.execute(f"ALTER TABLE activities ADD COLUMN {column} TEXT NOT NULL DEFAULT ''")
+
+    def backfill(self, connection, storage, last_key, batch_size):
+        # The start_time indexes make each EXISTS probe cheap
+        row = connection.execute("""
+            SELECT MAX(id) FROM (SELECT id FROM activities WHERE id > ? ORDER BY id LIMIT ?)
+        """, (last_key, batch_size)).fetchone()
+        if row[0] is None:
+            return None
+        connection.execute(self.DELETE_DUPLICATES, (last_key, row[0]))
+        return row[0]
+
+    def finalize(self, connection, storage):
+        # Rows written since the backfill's last batch haven't been checked yet
+        (last_key,) = connection.execute(
+            "SELECT last_key FROM schema_migrations WHERE version = ?", (self.version,)
+        ).fetchone()
+        connection.execute(self.DELETE_DUPLICATES, (last_key, 2 ** 63 - 1))
+        connection.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_natural_key
+            ON activities(device_id, tab_id, start_time, url_hash)
+        """)
+
+
+class SessionsTable(Migration):
+    """Stitched reading sessions (see sessions.SessionStitcher)"""
+    version = 4
+    name = "sessions_table"
+
+    def apply_schema(self, connection, storage):
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                domain_hash BLOB NOT NULL,
+                domain TEXT NOT NULL,
+                device_id TEXT NOT NULL DEFAULT '',
+                start_time REAL NOT NULL,
+                end_time REAL NOT NULL,
+                duration REAL NOT NULL,
+                activity_count INTEGER NOT NULL
+            )
+        """)
+        # The stitcher only ever looks at the tail of one domain's sessions
+        connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_sessions_tail
+            ON sessions(domain_hash, device_id, end_time)
+        """)
+        connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_sessions_time
+            ON sessions(start_time)
+        """)
+
+
+class ActivityRollups(Migration):
+    """Per-minute, per-hour and per-day domain totals (see downsampling.Downsampler)"""
+    version = 5
+    name = "activity_rollups"
+
+    def apply_schema(self, connection, storage):
+        # Clustered on (resolution, bucket_start), so the oldest buckets of a
+        # resolution sit together when they're folded into coarser ones
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS activity_rollups (
+                resolution INTEGER NOT NULL,
+                bucket_start REAL NOT NULL,
+                domain_hash BLOB NOT NULL,
+                device_id TEXT NOT NULL DEFAULT '',
+                domain TEXT NOT NULL,
+                duration REAL NOT NULL,
+                activity_count INTEGER NOT NULL,
+                PRIMARY KEY (resolution, bucket_start, domain_hash, device_id)
+            ) WITHOUT ROWID
+        """)
+
+
+class DroppedActivity(Migration):
+    """Hourly domain totals of activity an IngestionQueue had to shed"""
+    version = 6
+    name = "dropped_activity"
+
+    def apply_schema(self, connection, storage):
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS dropped_activity (
+                bucket_start REAL NOT NULL,
+                domain_hash BLOB NOT NULL,
+                device_id TEXT NOT NULL DEFAULT '',
+                domain TEXT NOT NULL,
+                duration REAL NOT NULL,
+                activity_count INTEGER NOT NULL,
+                PRIMARY KEY (bucket_start, domain_hash, device_id)
+            ) WITHOUT ROWID
+        """)
+
+
+class UsageRollups(Migration):
+    """Daily totals per domain and browser, plus an hourly profile, that reports read (see reports.UsageRollups)"""
+    version = 7
+    name = "usage_rollups"
+
+    def apply_schema(self, connection, storage):
+        # url is one of the domain's urls, as stored, to name it by.
+        # Clustered by domain and browser so a report sums each one's days
+        # in key order instead of sorting them
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS usage_rollups (
+                domain_hash BLOB NOT NULL,
+                engine_type TEXT NOT NULL,
+                device_id TEXT NOT NULL DEFAULT '',
+                day_start REAL NOT NULL,
+                url TEXT NOT NULL,
+                duration REAL NOT NULL,
+                activity_count INTEGER NOT NULL,
+                PRIMARY KEY (domain_hash, engine_type, device_id, day_start)
+            ) WITHOUT ROWID
+        """)
+        connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_usage_rollups_day
+            ON usage_rollups(day_start)
+        """)
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS usage_hours (
+                bucket_start REAL PRIMARY KEY,
+                duration REAL NOT NULL,
+                activity_count INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        # Activities up to this id have been folded in
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS usage_rollup_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                folded_id INTEGER NOT NULL
+            )
+        """)
+        # Days whose folded activities were deleted or changed since
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS usage_rollup_stale (
+                day_start REAL PRIMARY KEY
+            ) WITHOUT ROWID
+        """)
+
+
+class DurationSketchesTable(Migration):
+    """Per-day duration histograms (see duration_sketches.DurationSketches)"""
+    version = 8
+    name = "duration_sketches"
+
+    def apply_schema(self, connection, storage):
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS duration_sketches (
+                day_start REAL NOT NULL,
+                domain_hash BLOB NOT NULL,
+                engine_type TEXT NOT NULL,
+                device_id TEXT NOT NULL DEFAULT '',
+                domain TEXT NOT NULL,
+                sketch BLOB NOT NULL,
+                PRIMARY KEY (day_start, domain_hash, engine_type, device_id)
+            ) WITHOUT ROWID
+        """)
+
+
+class DistinctSketchesTable(Migration):
+    """Per-day HyperLogLog sketches of URLs and domains (see distinct_counts.DistinctCounters)"""
+    version = 9
+    name = "distinct_sketches"
+
+    def apply_schema(self, connection, storage):
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS distinct_sketches (
+                day_start REAL NOT NULL,
+                kind TEXT NOT NULL,
+                platform_type TEXT NOT NULL,
+                engine_type TEXT NOT NULL,
+                device_id TEXT NOT NULL DEFAULT '',
+                sketch BLOB NOT NULL,
+                PRIMARY KEY (day_start, kind, platform_type, engine_type, device_id)
+            ) WITHOUT ROWID
+        """)
+
+
+MIGRATIONS: List[Migration] = [
+    LookupHashColumns(),
+    OpenSessionsTable(),
+    NaturalKey(),
+    SessionsTable(),
+    ActivityRollups(),
+    DroppedActivity(),
+    UsageRollups(),
+    DurationSketchesTable(),
+    DistinctSketchesTable(),
+]
+
+
+class MigrationRunner:
+    """
+    Brings a database up to the latest schema without blocking ingestion.
+
+    Schema steps run straight away. Backfills run in batches of batch_size
+    rows, each batch committed together with its progress marker, on a
+    background thread with its own connection.
+    """
+
+    def __init__(self, storage, migrations: Optional[List[Migration]] = None,
+                 batch_size: int = 500, pause: float = 0.01):
+        self.storage = storage
+        self.migrations = sorted(migrations if migrations is not None else MIGRATIONS,
+                                 key=lambda m: m.version)
+        self.batch_size = batch_size
+        self.pause = pause
+        self._stop = threading.Event()
+        self._thread = None
+
+    def apply_schema(self, connection):
+        """Runs the quick DDL step of every migration this database hasn't seen"""
+        connection.execute(SCHEMA_MIGRATIONS_TABLE)
+        # IMMEDIATE so two processes opening the same new DB can't both ALTER
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            seen = {row[0] for row in connection.execute("SELECT version FROM schema_migrations")}
+            for migration in self.migrations:
+                if migration.version in seen:
+                    continue
+                migration.apply_schema(connection, self.storage)
+                connection.execute("""
+                    INSERT INTO schema_migrations (version, name, status)
+                    VALUES (?, ?, 'backfilling')
+                """, (migration.version, migration.name))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def pending(self, connection) -> List[Migration]:
+        """Migrations whose backfill or finalize step hasn't finished"""
+        unfinished = {
+            row[0] for row in connection.execute(
+                "SELECT version FROM schema_migrations WHERE status != 'done'"
+            )
+        }
+        return [m for m in self.migrations if m.version in unfinished]
+
+    def run_backfills(self, connection, max_batches: Optional[int] = None) -> bool:
+        """
+        Runs pending backfills batch by batch.
+        Returns True once everything is done, False if it stopped early.
+        """
+        batches = 0
+        for migration in self.pending(connection):
+            (last_key,) = connection.execute(
+                "SELECT last_key FROM schema_migrations WHERE version = ?", (migration.version,)
+            ).fetchone()
+
+            while True:
+                if self._stop.is_set() or (max_batches is not None and batches >= max_batches):
+                    return False
+                with connection:
+                    new_key = migration.backfill(connection, self.storage, last_key, self.batch_size)
+                    if new_key is None:
+                        break
+                    connection.execute("""
+                        UPDATE schema_migrations
+                        SET last_key = ?, updated_at = CURRENT_TIMESTAMP
+                        WHERE version = ?
+                    """, (new_key, migration.version))
+                last_key = new_key
+                batches += 1
+                if self._stop.wait(self.pause):
+                    return False
+
+            with connection:
+                migration.finalize(connection, self.storage)
+                connection.execute("""
+                    UPDATE schema_migrations
+                    SET status = 'done', updated_at = CURRENT_TIMESTAMP
+                    WHERE version = ?
+                """, (migration.version,))
+            logger.info("Finished migration %s (%s)", migration.version, migration.name)
+        return True
+
+    def start(self):
+        """Finishes the remaining backfills on a background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="storage-migrations", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        connection = None
+        try:
+            connection = sqlite3.connect(self.storage.db_path, timeout=30)
+            self.run_backfills(connection)
+        except Exception as e:
+            logger.error("Background migration failed: %s", e)
+        finally:
+            if connection:
+                connection.close()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stops the background thread after its current batch"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
@@ -0,0 +1,175 @@
+import sys
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Set, Tuple
+
+# Rough per-object overheads used to size cached results. Doesn't need to be
+# exact, just close enough that the memory bound means something.
+_ROW_OVERHEAD = 240
+_VALUE_OVERHEAD = 40
+
+
+def _estimate_size(result: Any) -> int:
+    """Rough memory footprint of a cached result (lists of dicts or a dict)"""
+    if isinstance(result, dict):
+        return _ROW_OVERHEAD + sum(
+            _VALUE_OVERHEAD + sys.getsizeof(key) for key in result
+        )
+    if isinstance(result, list):
+        size = _ROW_OVERHEAD
+        for row in result:
+            size += _ROW_OVERHEAD
+            for value in row.values():
+                size += _VALUE_OVERHEAD + (len(value) if isinstance(value, (str, bytes)) else 0)
+        return size
+    return sys.getsizeof(result)
+
+
+def _copy(result: Any) -> Any:
+    """Hands out copies so callers can't change what's cached"""
+    if isinstance(result, list):
+        return [dict(row) if isinstance(row, dict) else row for row in result]
+    if isinstance(result, dict):
+        return dict(result)
+    return result
+
+
+class QueryCache:
+    """
+    LRU cache of query results keyed by (query, time range), bounded by an
+    estimate of the memory the results take.
+
+    Every entry is indexed by the time buckets its range covers, so a write
+    only drops the entries whose buckets it actually touches - saving an
+    activity for today leaves last week's cached results alone.
+    Ranges wider than max_indexed_buckets (think "since the beginning of
+    time") aren't spread over thousands of buckets; they're kept aside and
+    checked by plain overlap instead.
+    """
+
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024, bucket_seconds: int = 86400,
+                 max_indexed_buckets: int = 400):
+        self.max_bytes = max_bytes
+        self.bucket_seconds = bucket_seconds
+        self.max_indexed_buckets = max_indexed_buckets
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, int]]' = OrderedDict()
+        self._buckets: Dict[int, Set[Hashable]] = {}
+        self._entry_buckets: Dict[Hashable, range] = {}
+        self._wide: Dict[Hashable, range] = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, query: str, start_time: float, end_time: float) -> Hashable:
+        # Millisecond precision is plenty and stops float noise splitting keys
+        return (query, round(start_time, 3), round(end_time, 3))
+
+    def _bucket_range(self, start_time: float, end_time: float) -> range:
+        return range(int(start_time // self.bucket_seconds), int(end_time // self.bucket_seconds) + 1)
+
+    def _lookup(self, query: str, start_time: float, end_time: float,
+                compute: Callable[[], Any]) -> Any:
+        key = self._key(query, start_time, end_time)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        result = compute()
+        self._store(key, start_time, end_time, result)
+        return result
+
+    def get_or_compute(self, query: str, start_time: float, end_time: float,
+                       compute: Callable[[], Any]) -> Any:
+        """Returns the cached result for this query and range, computing it on a miss"""
+        return _copy(self._lookup(query, start_time, end_time, compute))
+
+    def aligned(self, start_time: float, end_time: float) -> Tuple[float, float]:
+        """The range widened out to whole buckets"""
+        low = start_time // self.bucket_seconds * self.bucket_seconds
+        high = -(-end_time // self.bucket_seconds) * self.bucket_seconds
+        return low, high
+
+    def get_or_compute_range(self, query: str, start_time: float, end_time: float,
+                             compute: Callable[[float, float], Any],
+                             trim: Callable[[Any, float, float], Any]) -> Any:
+        """
+        Like get_or_compute, for queries whose answer for a wider range can
+        be cut down to a narrower one. The range is widened to whole buckets
+        and cached that way: compute(low, high) runs over the widened range
+        and trim(result, start_time, end_time) cuts each answer back down.
+        So "today so far" asked every few seconds, with end_time moving on
+        each time, keeps hitting the one entry for today.
+        """
+        low, high = self.aligned(start_time, end_time)
+        result = self._lookup(query, low, high, lambda: compute(low, high))
+        return _copy(trim(result, start_time, end_time))
+
+    def _store(self, key: Hashable, start_time: float, end_time: float, result: Any):
+        size = _estimate_size(result)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (result, size)
+        self.current_bytes += size
+        buckets = self._bucket_range(start_time, end_time)
+        if len(buckets) > self.max_indexed_buckets:
+            self._wide[key] = buckets
+        else:
+            self._entry_buckets[key] = buckets
+            for bucket in buckets:
+                self._buckets.setdefault(bucket, set()).add(key)
+
+        while self.current_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key: Hashable):
+        _, size = self._entries.pop(key)
+        self.current_bytes -= size
+        if self._wide.pop(key, None) is not None:
+            return
+        for bucket in self._entry_buckets.pop(key):
+            keys = self._buckets.get(bucket)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[bucket]
+
+    def invalidate_spans(self, spans: Iterable[Tuple[float, float]]):
+        """Drops every entry whose range shares a bucket with one of the (start, end) spans"""
+        touched = set()
+        for start_time, end_time in spans:
+            touched.update(self._bucket_range(start_time, end_time))
+
+        stale = set()
+        for bucket in touched:
+            stale.update(self._buckets.get(bucket, ()))
+        for key, buckets in self._wide.items():
+            if any(bucket in buckets for bucket in touched):
+                stale.add(key)
+        for key in stale:
+            self._drop(key)
+
+    def invalidate_before(self, cutoff: float):
+        """Drops every entry that reaches back before cutoff (used by retention)"""
+        last_bucket = int(cutoff // self.bucket_seconds)
+        stale = set()
+        for bucket in [b for b in self._buckets if b <= last_bucket]:
+            stale.update(self._buckets[bucket])
+        stale.update(key for key, buckets in self._wide.items() if buckets.start <= last_bucket)
+        for key in stale:
+            self._drop(key)
+
+    def clear(self):
+        """Forgets everything"""
+        self._entries.clear()
+        self._buckets.clear()
+        self._entry_buckets.clear()
+        self._wide.clear()
+        self.current_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,380 @@
+import time
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ..utils.urls import extract_domain
+
+PERIODS = ('day', 'week', 'month', 'year')
+HOUR = 3600
+DAY = 86400
+# What rolled-up history shows up as in the per-browser split - rollups
+# don't keep the engine
+DOWNSAMPLED = 'downsampled'
+
+
+def period_bounds(period: str, day: date) -> Tuple[float, float]:
+    """The (start, end) timestamps of the local day/week/month/year containing day"""
+    if period == 'day':
+        first, last = day, day + timedelta(days=1)
+    elif period == 'week':
+        first = day - timedelta(days=day.weekday())
+        last = first + timedelta(days=7)
+    elif period == 'month':
+        first = day.replace(day=1)
+        last = (first + timedelta(days=32)).replace(day=1)
+    elif period == 'year':
+        first, last = day.replace(month=1, day=1), date(day.year + 1, 1, 1)
+    else:
+        raise ValueError(f"Unknown report period {period!r}")
+    return (datetime.combine(first, datetime.min.time()).timestamp(),
+            datetime.combine(last, datetime.min.time()).timestamp())
+
+
+class UsageReport:
+    """
+    Totals for one period, built up from a stream of
+    (domain_hash, engine_type, start_time, duration) rows so a year costs
+    no more memory than a day. Time counts towards the hour it started in.
+
+    Rows are keyed by domain hash; only the top domains get their names
+    looked up (and decrypted) at the end. The hour-of-day and timeline
+    buckets are worked out once per clock hour rather than per row, which
+    assumes the local UTC offset is a whole number of hours.
+    """
+
+    def __init__(self, period: str, start_time: float, end_time: float, top: int = 20):
+        self.period = period
+        self.start_time = start_time
+        self.end_time = end_time
+        self.top = top
+        self.total = 0.0
+        self.activity_count = 0
+        self.domains: Dict[bytes, List] = {}  # domain hash -> [seconds, count]
+        self.engines: Dict[str, float] = {}
+        self.hours = [0.0] * 24
+        self.timeline: Dict[str, float] = {}
+        # Domain hash -> (stored url or domain, its cipher context), for
+        # rows that can't be looked up in the activities table
+        self.stored_names: Dict[bytes, Tuple[str, str]] = {}
+        self._buckets: Dict[int, Tuple[int, Optional[str]]] = {}
+
+    def _bucket(self, epoch_hour: int) -> Tuple[int, Optional[str]]:
+        """(local hour of day, timeline key) for an hour since the epoch"""
+        bucket = self._buckets.get(epoch_hour)
+        if bucket is None:
+            local = time.localtime(epoch_hour * HOUR)
+            if self.period == 'year':
+                key = f"{local.tm_year:04d}-{local.tm_mon:02d}"
+            elif self.period in ('week', 'month'):
+                key = f"{local.tm_year:04d}-{local.tm_mon:02d}-{local.tm_mday:02d}"
+            else:
+                key = None
+            bucket = self._buckets[epoch_hour] = (local.tm_hour, key)
+        return bucket
+
+    def _close_hour(self, epoch_hour: Optional[int], seconds: float):
+        if epoch_hour is None or not seconds:
+            return
+        hour, key = self._bucket(epoch_hour)
+        self.hours[hour] += seconds
+        if key is not None:
+            self.timeline[key] = self.timeline.get(key, 0.0) + seconds
+
+    def add_rows(self, rows):
+        """Adds a batch of (domain_hash, engine_type, start_time, duration[, count]) rows"""
+        domains, engines = self.domains, self.engines
+        current_hour, hour_seconds = None, 0.0
+        total, count = 0.0, 0
+        for row in rows:
+            domain_hash, engine, start, duration = row[0], row[1], row[2], row[3]
+            n = row[4] if len(row) > 4 else 1
+            epoch_hour = int(start // HOUR)
+            if epoch_hour != current_hour:
+                self._close_hour(current_hour, hour_seconds)
+                current_hour, hour_seconds = epoch_hour, 0.0
+            hour_seconds += duration
+            total += duration
+            count += n
+            entry = domains.get(domain_hash)
+            if entry is None:
+                domains[domain_hash] = [duration, n]
+            else:
+                entry[0] += duration
+                entry[1] += n
+            engines[engine] = engines.get(engine, 0.0) + duration
+        self._close_hour(current_hour, hour_seconds)
+        self.total += total
+        self.activity_count += count
+
+    def add_totals(self, rows):
+        """Adds a batch of (domain_hash, engine_type, duration, count) rows, with no time to place them at"""
+        domains, engines = self.domains, self.engines
+        for domain_hash, engine, duration, n in rows:
+            entry = domains.get(domain_hash)
+            if entry is None:
+                domains[domain_hash] = [duration, n]
+            else:
+                entry[0] += duration
+                entry[1] += n
+            engines[engine] = engines.get(engine, 0.0) + duration
+            self.total += duration
+            self.activity_count += n
+
+    def add_hours(self, rows):
+        """Adds (hour start, duration) rows to the hourly profile and timeline only"""
+        for bucket_start, duration in rows:
+            self._close_hour(int(bucket_start // HOUR), duration)
+
+    def name(self, domain_hash: bytes, stored: str, context: str):
+        """Remembers how a domain was stored ('url' or 'domain'), for rows that carry one"""
+        self.stored_names.setdefault(domain_hash, (stored, context))
+
+    def top_domains(self) -> List[Tuple[bytes, float, int]]:
+        ranked = sorted(self.domains.items(), key=lambda item: item[1][0], reverse=True)
+        return [(domain_hash, seconds, count) for domain_hash, (seconds, count) in ranked[:self.top]]
+
+    def to_dict(self, names: Dict[bytes, str]) -> Dict:
+        total = self.total or 1.0
+        return {
+            'period': self.period,
+            'start': datetime.fromtimestamp(self.start_time).isoformat(),
+            'end': datetime.fromtimestamp(self.end_time).isoformat(),
+            'total_seconds': self.total,
+            'activities': self.activity_count,
+            'domains': len(self.domains),
+            'top_domains': [
+                {'domain': names.get(domain_hash, '?'), 'seconds': seconds,
+                 'activities': count, 'share': seconds / total}
+                for domain_hash, seconds, count in self.top_domains()
+            ],
+            'browsers': [
+                {'browser': engine, 'seconds': seconds, 'share': seconds / total}
+                for engine, seconds in sorted(self.engines.items(), key=lambda item: item[1], reverse=True)
+            ],
+            'hours': self.hours,
+            'timeline': dict(sorted(self.timeline.items())),
+        }
+
+
+class UsageRollups:
+    """
+    Daily (domain, browser, device) totals in usage_rollups, plus the time
+    per hour in usage_hours, so a year's report reads about 365 rows per
+    domain rather than every activity.
+
+    Kept up to date lazily rather than on the insert path: refresh() folds
+    in the activities added since last time (ids only go up), then
+    re-derives the days StorageManager.mark_rollups_stale() flagged when
+    folded activities were deleted (a replay, cleanup or downsampling) or
+    stretched by a resend. So the tables mirror the activities table, and
+    history that's been downsampled or archived is read from there.
+    """
+
+    def __init__(self, storage, batch_size: int = 50000):
+        self.storage = storage
+        self.batch_size = batch_size
+
+    def folded_id(self) -> int:
+        row = self.storage.connection.execute(
+            "SELECT folded_id FROM usage_rollup_state WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    def _fold(self, where: str, params: tuple):
+        """Adds the activities matching where into their daily and hourly buckets"""
+        connection = self.storage.connection
+        connection.execute(f"""
+            INSERT INTO usage_rollups (domain_hash, engine_type, device_id, day_start,
+                                       url, duration, activity_count)
+            SELECT domain_hash, engine_type, device_id, CAST(start_time / {DAY} AS INTEGER) * {DAY},
+                   MIN(url), SUM(duration), COUNT(*)
+            FROM activities WHERE domain_hash IS NOT NULL AND {where}
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT(domain_hash, engine_type, device_id, day_start) DO UPDATE SET
+                duration = duration + excluded.duration,
+                activity_count = activity_count + excluded.activity_count
+        """, params)
+        connection.execute(f"""
+            INSERT INTO usage_hours (bucket_start, duration, activity_count)
+            SELECT CAST(start_time / {HOUR} AS INTEGER) * {HOUR}, SUM(duration), COUNT(*)
+            FROM activities WHERE domain_hash IS NOT NULL AND {where}
+            GROUP BY 1
+            ON CONFLICT(bucket_start) DO UPDATE SET
+                duration = duration + excluded.duration,
+                activity_count = activity_count + excluded.activity_count
+        """, params)
+
+    def refresh(self) -> Dict[str, int]:
+        """Brings the rollups up to date. Returns how many activities and days it folded in."""
+        storage = self.storage
+        connection = storage.connection
+        folded = 0
+        with storage._lock:
+            folded_id = self.folded_id()
+            stale = [day_start for (day_start,) in connection.execute(
+                "SELECT day_start FROM usage_rollup_stale ORDER BY day_start")]
+            if stale:
+                with storage.transaction():
+                    for day_start in stale:
+                        connection.execute("DELETE FROM usage_rollups WHERE day_start = ?", (day_start,))
+                        connection.execute("""
+                            DELETE FROM usage_hours WHERE bucket_start >= ? AND bucket_start < ?
+                        """, (day_start, day_start + DAY))
+                        self._fold("id <= ? AND start_time >= ? AND start_time < ?",
+                                   (folded_id, day_start, day_start + DAY))
+                    connection.execute("DELETE FROM usage_rollup_stale")
+
+            max_id = storage._max_id()
+            while folded_id < max_id:
+                upto = min(folded_id + self.batch_size, max_id)
+                with storage.transaction():
+                    self._fold("id > ? AND id <= ?", (folded_id, upto))
+                    connection.execute("""
+                        INSERT INTO usage_rollup_state (id, folded_id) VALUES (1, ?)
+                        ON CONFLICT(id) DO UPDATE SET folded_id = excluded.folded_id
+                    """, (upto,))
+                folded += upto - folded_id
+                folded_id = upto
+        return {'activities': folded, 'days': len(stale)}
+
+    def rebuild(self) -> Dict[str, int]:
+        with self.storage.transaction():
+            for table in ('usage_rollups', 'usage_hours', 'usage_rollup_state', 'usage_rollup_stale'):
+                self.storage.connection.execute(f"DELETE FROM {table}")
+        return self.refresh()
+
+
+def _stream(storage, sql: str, params, batch_size: int) -> Iterator[list]:
+    """Yields query results a batch at a time, holding the storage lock only per batch"""
+    with storage._lock:
+        cursor = storage.connection.execute(sql, params)
+    while True:
+        with storage._lock:
+            batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        yield batch
+
+
+def _domain_names(storage, report: UsageReport) -> Dict[bytes, str]:
+    """Names the top domains, decrypting one stored value per domain"""
+    stored = {'domain': {}, 'url': {}}
+    for domain_hash, _, _ in report.top_domains():
+        if domain_hash in report.stored_names:
+            value, context = report.stored_names[domain_hash]
+            stored[context][domain_hash] = value
+            continue
+        with storage._lock:
+            row = storage.connection.execute(
+                "SELECT url FROM activities WHERE domain_hash = ? LIMIT 1", (domain_hash,)).fetchone()
+            if row is None:
+                # Rolled up, but its activities have since been cleaned up
+                row = storage.connection.execute(
+                    "SELECT url FROM usage_rollups WHERE domain_hash = ? LIMIT 1", (domain_hash,)).fetchone()
+        if row:
+            stored['url'][domain_hash] = row[0]
+
+    names = {}
+    for context, values in stored.items():
+        plain = list(values.values())
+        if storage.cipher and plain:
+            plain = storage.cipher.decrypt_batch(plain, context)
+        names.update((domain_hash, extract_domain(value)) for domain_hash, value in zip(values, plain))
+    return names
+
+
+def build_report(storage, period: str, day: date, top: int = 20, use_rollups: bool = True,
+                 batch_size: int = 5000, timings: Optional[Dict[str, float]] = None) -> Dict:
+    """
+    Works out a usage report for the period containing day from a
+    StorageManager: top domains, per-browser split, hourly profile and a
+    timeline (per day for a week or month, per month for a year).
+
+    Recent activity comes from the daily usage rollups and hourly profile
+    (refreshed first), or without use_rollups by streaming the activities
+    themselves in batches. History that's no longer in the activities
+    table comes from the downsampled rollups and the archive. Only the
+    names of the domains shown are decrypted.
+
+    Pass a dict as timings to get seconds spent per phase.
+    """
+    timings = {} if timings is None else timings
+    start_time, end_time = period_bounds(period, day)
+    report = UsageReport(period, start_time, end_time, top)
+
+    if use_rollups:
+        started = time.perf_counter()
+        UsageRollups(storage).refresh()
+        timings['refresh rollups'] = time.perf_counter() - started
+
+        # Whole UTC days come from the rollups, the part-days at either end
+        # of the (local) period from the activities
+        started = time.perf_counter()
+        first_day = -(-start_time // DAY) * DAY
+        last_day = max(end_time // DAY * DAY, first_day)
+        with storage._lock:
+            # +day_start keeps SQLite off the day index: summing in key order
+            # over the whole table (only as long as the activities table
+            # holds) beats sorting a year's rows by domain
+            report.add_totals(storage.connection.execute("""
+                SELECT domain_hash, engine_type, SUM(duration), SUM(activity_count) FROM usage_rollups
+                WHERE +day_start >= ? AND +day_start < ?
+                GROUP BY domain_hash, engine_type
+            """, (first_day, last_day)).fetchall())
+            report.add_hours(storage.connection.execute("""
+                SELECT bucket_start, duration FROM usage_hours
+                WHERE bucket_start >= ? AND bucket_start < ?
+            """, (first_day, last_day)).fetchall())
+        timings['usage rollups'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        edges = [(start_time, min(first_day, end_time)), (max(last_day, start_time), end_time)]
+        for edge_start, edge_end in edges:
+            for batch in _stream(storage, """
+                SELECT domain_hash, engine_type, start_time, duration FROM activities
+                WHERE start_time >= ? AND start_time < ? AND domain_hash IS NOT NULL
+                ORDER BY start_time
+            """, (edge_start, edge_end), batch_size):
+                report.add_rows(batch)
+        timings['part days'] = time.perf_counter() - started
+    else:
+        started = time.perf_counter()
+        for batch in _stream(storage, """
+            SELECT domain_hash, engine_type, start_time, duration FROM activities
+            WHERE start_time >= ? AND start_time < ?
+            ORDER BY start_time
+        """, (start_time, end_time), batch_size):
+            report.add_rows(batch)
+        timings['activities'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for batch in _stream(storage, """
+        SELECT domain_hash, bucket_start, domain, duration, activity_count FROM activity_rollups
+        WHERE bucket_start >= ? AND bucket_start < ?
+        ORDER BY bucket_start
+    """, (start_time, end_time), batch_size):
+        for domain_hash, _, domain, _, _ in batch:
+            report.name(domain_hash, domain, 'domain')
+        report.add_rows([(domain_hash, DOWNSAMPLED, bucket_start, duration, count)
+                         for domain_hash, bucket_start, _, duration, count in batch])
+    timings['downsampled'] = time.perf_counter() - started
+
+    if storage.archive and start_time < storage._hot_window_start():
+        started = time.perf_counter()
+        # Streamed a batch at a time; add_rows doesn't need them in order
+        rows = (row for row in storage.archive.iter_range(start_time, end_time)
+                if row['start_time'] < end_time)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            for row in batch:
+                report.name(row['domain_hash'], row['url'], 'url')
+            report.add_rows([(row['domain_hash'], row['engine_type'], row['start_time'], row['duration'])
+                             for row in batch])
+        timings['archive'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    names = _domain_names(storage, report)
+    timings['domain names'] = time.perf_counter() - started
+    return report.to_dict(names)
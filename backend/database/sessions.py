@@ -0,0 +1,126 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from ..utils.urls import extract_domain
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStitcher:
+    """
+    Merges activities on the same domain (per device) that are at most
+    gap_seconds apart into one reading session, kept in the sessions table.
+
+    Flicking to another tab for two seconds and back splits one read into
+    several activities; the session table glues them back together. It's
+    updated as activities are inserted and only ever touches the newest
+    session for the domain, so reports never have to re-stitch history.
+    """
+
+    def __init__(self, storage, gap_seconds: float = 30.0, attach: bool = True):
+        self.storage = storage
+        self.gap_seconds = gap_seconds
+        if attach:
+            storage.add_write_listener(self.on_activities, self.rebuild)
+
+    def on_activities(self, activities: List[Dict]):
+        """Folds a batch of newly inserted (or stretched) activities into the sessions table"""
+        connection = self.storage.connection
+        for activity in sorted(activities, key=lambda a: a['start_time']):
+            start, end = activity['start_time'], activity['end_time']
+            duration, count = activity['duration'], 1
+            if 'previous_end_time' in activity:
+                # Only the stretch is new, and it carries on the session the activity is in
+                start = activity['previous_end_time']
+                duration -= activity['previous_duration']
+                count = 0
+            tail = connection.execute("""
+                SELECT id, start_time, end_time FROM sessions
+                WHERE domain_hash = ? AND device_id = ?
+                  AND end_time >= ? AND start_time <= ?
+                ORDER BY end_time DESC LIMIT 1
+            """, (activity['domain_hash'], activity['device_id'],
+                  start - self.gap_seconds, end + self.gap_seconds)).fetchone()
+
+            if tail:
+                connection.execute("""
+                    UPDATE sessions
+                    SET start_time = ?, end_time = ?, duration = duration + ?,
+                        activity_count = activity_count + ?
+                    WHERE id = ?
+                """, (min(tail[1], start), max(tail[2], end), duration, count, tail[0]))
+            else:
+                connection.execute("""
+                    INSERT INTO sessions (domain_hash, domain, device_id, start_time,
+                                          end_time, duration, activity_count)
+                    VALUES (?, ?, ?, ?, ?, ?, 1)
+                """, (activity['domain_hash'], self.storage._stored_domain(extract_domain(activity['url'])),
+                      activity['device_id'], start, end, duration))
+
+    def rebuild(self, batch_size: int = 5000) -> int:
+        """
+        Re-stitches the whole history in one ordered pass - for a new gap
+        threshold, or after a bulk import. Open sessions live in memory, one
+        per (domain, device), so this never re-reads what it has written.
+        Returns the number of sessions.
+        """
+        storage = self.storage
+        sessions = []
+        tails: Dict[Tuple[bytes, str], Dict] = {}
+        cursor = storage.connection.execute("""
+            SELECT url, domain_hash, device_id, start_time, end_time, duration
+            FROM activities ORDER BY start_time
+        """)
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            for url, domain_hash, device_id, start, end, duration in batch:
+                key = (domain_hash, device_id)
+                tail = tails.get(key)
+                if tail and start - tail['end_time'] <= self.gap_seconds:
+                    tail['end_time'] = max(tail['end_time'], end)
+                    tail['duration'] += duration
+                    tail['activity_count'] += 1
+                    continue
+                tail = {'domain_hash': domain_hash, 'device_id': device_id, 'start_time': start,
+                        'end_time': end, 'duration': duration, 'activity_count': 1,
+                        'url': url}
+                tails[key] = tail
+                sessions.append(tail)
+
+        urls = storage._reveal([{'url': s['url'], 'title': None} for s in sessions])
+        with storage.transaction():
+            storage.connection.execute("DELETE FROM sessions")
+            storage.connection.executemany("""
+                INSERT INTO sessions (domain_hash, domain, device_id, start_time,
+                                      end_time, duration, activity_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [
+                (s['domain_hash'], self.storage._stored_domain(extract_domain(u['url'])), s['device_id'],
+                 s['start_time'], s['end_time'], s['duration'], s['activity_count'])
+                for s, u in zip(sessions, urls)
+            ])
+        logger.info("Rebuilt %s sessions", len(sessions))
+        return len(sessions)
+
+    def get_sessions(self, start_time: float, end_time: float,
+                     min_duration: float = 0, domain: Optional[str] = None) -> List[Dict]:
+        """Gets sessions starting within a time range, newest first"""
+        sql = """
+            SELECT id, domain, device_id, start_time, end_time, duration, activity_count
+            FROM sessions WHERE start_time >= ? AND start_time <= ? AND duration >= ?
+        """
+        params = [start_time, end_time, min_duration]
+        if domain is not None:
+            sql += " AND domain_hash = ?"
+            params.append(self.storage._lookup_hash(extract_domain(domain)))
+        cursor = self.storage.connection.execute(sql + " ORDER BY start_time DESC", params)
+
+        columns = [desc[0] for desc in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        if self.storage.cipher and rows:
+            domains = self.storage.cipher.decrypt_batch([row['domain'] for row in rows], 'domain')
+            for row, value in zip(rows, domains):
+                row['domain'] = value
+        return rows
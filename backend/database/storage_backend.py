@@ -0,0 +1,152 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from ..utils.profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+
+class StorageBackend(ABC):
+    """
+    What the trackers (and anything reading activities back) need from a
+    store. StorageManager is the SQLite one; MemoryBackend keeps everything
+    in arrays for ephemeral sessions and tests.
+
+    Subclasses implement the abstract operations below (a backend missing
+    one can't be created). insert_activities and delete_activities raise
+    on failure so an enclosing transaction() rolls back; the public
+    save/query methods log and return False/[] instead.
+
+    Backends are shared by every window's tracker thread: transaction()
+    holds _lock for its whole length, so writers take turns. Keep the
+    work done inside one to the writes themselves - anything that can be
+    worked out beforehand (hashing, encryption, encoding) should be, so
+    other windows only wait for the store.
+    """
+
+    def __init__(self, platform_type: str, engine_type: str, device_id: str = ""):
+        self.platform_type = platform_type
+        self.engine_type = engine_type
+        self.device_id = device_id
+        self._lock = threading.RLock()
+
+    # Writes
+
+    @abstractmethod
+    def transaction(self):
+        """Context manager grouping writes; nests, and rolls back on error"""
+
+    @abstractmethod
+    def insert_activities(self, activities: List[Dict]):
+        """Upserts a batch on its natural key (device, tab, start time, URL)"""
+
+    @abstractmethod
+    def delete_activities(self, start_time: float, end_time: float) -> int:
+        """Deletes activities starting in [start_time, end_time)"""
+
+    def replace_activities(self, start_time: float, end_time: float, activities: List[Dict]):
+        """
+        Swaps the activities starting in [start_time, end_time) for a new
+        batch in one transaction, e.g. when a replay re-derives that range.
+        Derived tables aren't updated as it goes - call rebuild_derived()
+        once the replacing is done. Raises on failure.
+        """
+        with self.transaction():
+            self.delete_activities(start_time, end_time)
+            if activities:
+                self.insert_activities(activities)
+
+    def rebuild_derived(self):
+        """Recomputes whatever the backend derives from its activities"""
+
+    @profiled
+    def save_activity(self, activity_data: Dict) -> bool:
+        """Saves a single activity record"""
+        return self.save_activities([activity_data])
+
+    def save_activities(self, activities: List[Dict]) -> bool:
+        """
+        Saves a batch of activity records in one transaction.
+        An activity may carry its own platform_type/engine_type; otherwise
+        the backend's are used.
+        """
+        try:
+            self.insert_activities(activities)
+            return True
+        except Exception as e:
+            logger.error("Failed to save activity: %s", e)
+            return False
+
+    # Open sessions (the tracker's crash-safe state)
+
+    @abstractmethod
+    def open_session(self, tab_id: str, session: Dict, tab_info: Dict, last_active: bool = True):
+        """
+        Records the open session for a tab, by default as the front tab of
+        its window (tab_info['window_id']) - the window's previous front
+        tab loses the mark.
+        """
+
+    @abstractmethod
+    def close_session(self, tab_id: str, activity: Dict):
+        """Writes a finished activity and drops its open session together"""
+
+    def switch_session(self, closed_tab_id: Optional[str], activity: Optional[Dict],
+                       tab_id: str, session: Dict, tab_info: Dict):
+        """
+        Closes one tab's session with its finished activity (if activity is
+        given) and opens another's as its window's front tab, committing
+        both together - what a tab switch writes.
+        """
+        with self.transaction():
+            if activity is not None:
+                self.close_session(closed_tab_id, activity)
+            self.open_session(tab_id, session, tab_info)
+
+    @abstractmethod
+    def discard_session(self, tab_id: str):
+        """Drops a tab's open session without saving an activity for it"""
+
+    @abstractmethod
+    def load_open_sessions(self) -> Tuple[Dict, List[Dict]]:
+        """Gets the open sessions back as (active_tabs, front tab_info per window, oldest first)"""
+
+    # Shed activity (see ingestion_queue.IngestionQueue)
+
+    @abstractmethod
+    def record_dropped(self, totals: Dict[Tuple[float, str], List]):
+        """Adds to the shed totals, given as {(hour start, domain): [seconds, count]}"""
+
+    @abstractmethod
+    def get_dropped_totals(self, start_time: float, end_time: float) -> Dict[str, float]:
+        """Seconds shed per domain in hours starting within a time range"""
+
+    # Reads
+
+    @abstractmethod
+    def get_activities(self, start_time: float, end_time: float) -> List[Dict]:
+        """Activities inside a time range, newest first"""
+
+    @abstractmethod
+    def get_domain_totals(self, start_time: float, end_time: float) -> Dict[str, float]:
+        """Total seconds per domain within a time range, biggest first"""
+
+    # Retention
+
+    def _retention_days(self) -> int:
+        """How many days stay in the hot table for this platform"""
+        return 7 if self.platform_type == "mobile" else 30
+
+    def _hot_window_start(self) -> float:
+        """Anything starting before this may have been moved out of the hot table"""
+        return datetime.now().timestamp() - (self._retention_days() * 86400)
+
+    @abstractmethod
+    def cleanup_old_data(self):
+        """Drops (or archives) activities older than the retention window"""
+
+    def close(self):
+        pass
@@ -1,33 +1,99 @@
 import sqlite3
+import json
 import logging
-from datetime import datetime
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List
-import json
-from enum import Enum
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from ..core.activity_tracker import BrowserType, PlatformType
+from ..utils.profiling import profiled
+from ..utils.urls import extract_domain
+from .encryption import ActivityCipher, lookup_hash
+from .migrations import MigrationRunner
+from .query_cache import QueryCache
+from .storage_backend import StorageBackend
+from .tuning import apply_profile, resolve_profile
+
+logger = logging.getLogger(__name__)
 
-class StorageManager:
+# Columns handed back to callers - the lookup hashes stay internal
+ACTIVITY_COLUMNS = (
+    'id', 'url', 'title', 'start_time', 'end_time', 'duration',
+    'platform_type', 'engine_type', 'is_active', 'created_at'
+)
+
+class StorageManager(StorageBackend):
     """
     Handles all database operations for activity tracking.
     Uses SQLite3 with platform-specific optimizations.
+
+    Pass a cipher to keep URLs and titles encrypted at rest. Lookups by URL
+    or domain still hit an index through the url_hash/domain_hash columns.
+
+    Activities are keyed by (device_id, tab_id, start_time, url_hash), so
+    re-sending a batch after a failed sync doesn't create duplicates.
+
+    Set cache_bytes to keep recent range query results in memory. Writes
+    made through this manager drop only the cached results they affect.
+
+    Pass an archive directory and cleanup moves expired rows into compressed
+    archive segments instead of deleting them. Queries reaching back past the
+    hot window read those segments transparently.
+
+    Without an archive, mobile cleanup downsamples instead: expired rows are
+    folded into per-minute, then per-hour, domain totals; once those outgrow
+    disk_budget_bytes their oldest days become daily totals (see
+    downsampling.Downsampler). Pass downsample to turn that on or off
+    regardless of platform.
+
+    SQLite itself is tuned from a named profile (see tuning.PROFILES):
+    'desktop', 'mobile' or 'server', or a dict of settings. By default it's
+    the profile recorded for this database by calibration, if there is one,
+    otherwise the platform's own. The settings in effect end up in .tuning.
     """
     
-    def __init__(self, platform_type: str, engine_type: str, db_path: str = "activity.db"):
-        self.platform_type = platform_type
-        self.engine_type = engine_type
+    def __init__(self, platform_type: str, engine_type: str, db_path: str = "activity.db",
+                 cipher: Optional[ActivityCipher] = None, archive_dir: Optional[str] = None,
+                 migration_batch_size: int = 500, device_id: str = "",
+                 cache_bytes: int = 0, downsample: Optional[bool] = None,
+                 disk_budget_bytes: int = 32 * 1024 * 1024,
+                 tuning_profile: Optional[Union[str, Dict]] = None):
+        super().__init__(platform_type, engine_type, device_id)
         self.db_path = Path(db_path)
+        self.cipher = cipher
+        self._natural_key_ready = False
+        self.cache = QueryCache(max_bytes=cache_bytes) if cache_bytes else None
+        self.archive = None
+        if archive_dir:
+            # Only pulled in when archiving is on - it's not needed to start up
+            from .archive import ArchiveStore
+            self.archive = ArchiveStore(archive_dir)
+        self.downsample = downsample
+        self.disk_budget_bytes = disk_budget_bytes
+        self._downsampler = None
+        self.tuning_profile = tuning_profile
+        self.tuning: Dict = {}
         self.connection = None
+        self._transaction_depth = 0
+        self._write_listeners: List[Callable[[List[Dict]], None]] = []
+        self._rebuilds: List[Callable[[], object]] = []
+        # Set inside replace_activities' transaction, which holds the lock
+        self._replacing = False
+        self.migrations = MigrationRunner(self, batch_size=migration_batch_size)
         self._setup_database()
         
     def _setup_database(self):
         """Sets up SQLite database with proper configuration"""
         try:
-            self.connection = sqlite3.connect(self.db_path)
+            # Shared by tracker threads; _lock keeps their transactions apart
+            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            # Before WAL and the tables, or page_size can't take
+            settings = resolve_profile(self.tuning_profile, self.platform_type, self.db_path)
+            self.tuning = apply_profile(self.connection, settings)
             self.connection.execute("PRAGMA journal_mode=WAL")  # Better concurrency
             self._create_tables()
+            self._run_migrations()
         except Exception as e:
-            logging.error(f"Database setup failed: {str(e)}")
+            logger.error("Database setup failed: %s", e)
             raise
         
     def _create_tables(self):
@@ -65,70 +131,568 @@ class StorageManager:
                     ON activities(start_time)
                 """)
 
-    def save_activity(self, activity_data: Dict) -> bool:
-        """Saves a single activity record"""
-        try:
-            with self.connection:
-                self.connection.execute("""
-                    INSERT INTO activities (
-                        url, start_time, end_time, duration,
-                        platform_type, engine_type, is_active
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    activity_data['url'],
-                    activity_data['start_time'],
-                    activity_data['end_time'],
-                    activity_data['duration'],
-                    self.platform_type,
-                    self.engine_type,
-                    activity_data['is_active']
-                ))
-            return True
-        except Exception as e:
-            logging.error(f"Failed to save activity: {str(e)}")
-            return False
+    @contextmanager
+    def transaction(self):
+        """
+        Groups several writes into one transaction. Nests: only the outermost
+        block commits, and an exception anywhere rolls the whole thing back.
+        """
+        with self._lock:
+            if self._transaction_depth:
+                self._transaction_depth += 1
+                try:
+                    yield self.connection
+                finally:
+                    self._transaction_depth -= 1
+                return
+
+            self._transaction_depth = 1
+            try:
+                with self.connection:
+                    yield self.connection
+            finally:
+                self._transaction_depth = 0
+
+    def _run_migrations(self):
+        """
+        Brings the schema up to date. New and small databases finish their
+        backfills right here; anything bigger carries on in the background.
+        """
+        self.migrations.apply_schema(self.connection)
+        if not self.migrations.run_backfills(self.connection, max_batches=1):
+            logger.info("Continuing schema migrations in the background")
+            self.migrations.start()
+
+    def _lookup_hash(self, value: str) -> bytes:
+        """Hash used for the url_hash/domain_hash lookup columns"""
+        if self.cipher:
+            return self.cipher.lookup_hash(value)
+        return lookup_hash(value)
+
+    def _stored_domain(self, domain: str):
+        """A domain as derived tables store it - encrypted like URLs when there's a cipher"""
+        if self.cipher:
+            return self.cipher.encrypt_batch([domain], 'domain')[0]
+        return domain
+
+    def _url_hashes(self, url: str) -> tuple:
+        """The (url_hash, domain_hash) pair stored alongside a URL"""
+        return self._lookup_hash(url), self._lookup_hash(extract_domain(url))
+
+    def _prepare_rows(self, activities: List[Dict]) -> List[tuple]:
+        """Turns a batch of activity dicts into insert rows, encrypting in one go"""
+        urls = [activity['url'] for activity in activities]
+        titles = [activity.get('title') for activity in activities]
+        if self.cipher:
+            stored_urls = self.cipher.encrypt_batch(urls, 'url')
+            stored_titles = self.cipher.encrypt_batch(titles, 'title')
+        else:
+            stored_urls, stored_titles = urls, titles
+
+        return [
+            (
+                stored_urls[i],
+                stored_titles[i],
+                *self._url_hashes(url),
+                activity['start_time'],
+                activity['end_time'],
+                activity['duration'],
+                activity.get('platform_type') or self.platform_type,
+                activity.get('engine_type') or self.engine_type,
+                activity['is_active'],
+                activity.get('device_id') or self.device_id,
+                str(activity.get('tab_id', ''))
+            )
+            for i, (url, activity) in enumerate(zip(urls, activities))
+        ]
+
+    def _reveal_rows(self, cursor) -> List[Dict]:
+        """Turns query rows into dicts, decrypting the whole batch at once"""
+        columns = [desc[0] for desc in cursor.description]
+        return self._reveal([dict(zip(columns, row)) for row in cursor.fetchall()])
+
+    def _reveal(self, rows: List[Dict]) -> List[Dict]:
+        """Decrypts url/title across a whole batch of row dicts"""
+        if self.cipher and rows:
+            for column in ('url', 'title'):
+                values = self.cipher.decrypt_batch([row[column] for row in rows], column)
+                for row, value in zip(rows, values):
+                    row[column] = value
+        return rows
+
+    def add_write_listener(self, listener: Callable[[List[Dict]], None],
+                           rebuild: Optional[Callable[[], object]] = None):
+        """
+        Registers a callback that sees every batch of newly inserted activities
+        (plaintext, with device_id/url_hash/domain_hash filled in). It runs
+        inside the insert's transaction, so derived tables commit together
+        with the rows they were derived from. Retried rows that turned out to
+        be duplicates are left out.
+
+        A resend that stretches a row that's already there (a later end
+        time) comes through too, as the row's new values plus
+        previous_end_time and previous_duration - listeners add the
+        difference rather than a whole new activity.
+
+        rebuild recomputes the listener's table from scratch; it's run by
+        rebuild_derived() after writes the listeners didn't see.
+        """
+        self._write_listeners.append(listener)
+        if rebuild is not None:
+            self._rebuilds.append(rebuild)
+
+    def _new_rows(self, activities: List[Dict], rows: List[tuple]) -> List[Dict]:
+        """
+        Picks out the activities whose natural key isn't in the table yet,
+        and those that extend a row that is (with its previous end/duration)
+        """
+        def key(row):
+            return (row[10], row[11], row[4], row[2])
+
+        # natural key -> (end_time, duration) of the row already stored
+        existing = {}
+        if self._has_natural_key():
+            for i in range(0, len(rows), 500):
+                chunk = rows[i:i + 500]
+                placeholders = ', '.join(['(?, ?, ?, ?)'] * len(chunk))
+                for *row_key, end_time, duration in self.connection.execute(f"""
+                    SELECT device_id, tab_id, start_time, url_hash, end_time, duration FROM activities
+                    WHERE (device_id, tab_id, start_time, url_hash) IN (VALUES {placeholders})
+                """, [value for row in chunk for value in key(row)]):
+                    existing[tuple(row_key)] = (end_time, duration)
+
+        fresh = []
+        for activity, row in zip(activities, rows):
+            row_key = key(row)
+            previous = existing.get(row_key)
+            # Mirrors the upsert: only a later end time changes the stored row
+            if previous is not None and row[5] <= previous[0]:
+                continue
+            existing[row_key] = (row[5], row[6])
+            changed = dict(activity, device_id=row[10], tab_id=row[11],
+                           url_hash=row[2], domain_hash=row[3])
+            if previous is not None:
+                changed['previous_end_time'], changed['previous_duration'] = previous
+            fresh.append(changed)
+        return fresh
+
+    def _has_natural_key(self) -> bool:
+        """
+        Whether the unique natural-key index exists yet. On an old database
+        it only shows up once the dedupe migration has finished.
+        """
+        if not self._natural_key_ready:
+            self._natural_key_ready = self.connection.execute("""
+                SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_natural_key'
+            """).fetchone() is not None
+        return self._natural_key_ready
+
+    def insert_activities(self, activities: List[Dict]):
+        """
+        Inserts a batch, raising on failure so callers' transactions roll back.
+        Rows are upserted on their natural key (device, tab, start time, URL):
+        a retried batch is a no-op, and a resend with a later end time just
+        extends the row that's already there.
+        """
+        self._insert_rows(activities, self._prepare_rows(activities))
+
+    def _insert_rows(self, activities: List[Dict], rows: List[tuple]):
+        """Writes rows made by _prepare_rows - the only part that needs the lock"""
+        sql = """
+            INSERT INTO activities (
+                url, title, url_hash, domain_hash,
+                start_time, end_time, duration,
+                platform_type, engine_type, is_active,
+                device_id, tab_id
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+        if self._has_natural_key():
+            sql += """
+                ON CONFLICT(device_id, tab_id, start_time, url_hash) DO UPDATE SET
+                    end_time = excluded.end_time,
+                    duration = excluded.duration,
+                    is_active = excluded.is_active
+                WHERE excluded.end_time > activities.end_time
+            """
+        with self.transaction():
+            notify = self._write_listeners and not self._replacing
+            fresh = self._new_rows(activities, rows) if notify else None
+            last_id = self._max_id()
+            written = self.connection.executemany(sql, rows).rowcount
+            # Rows written but not added were resends stretching existing ones
+            if written > self._max_id() - last_id:
+                self.mark_rollups_stale(min(activity['start_time'] for activity in activities),
+                                        max(activity['end_time'] for activity in activities))
+            if fresh:
+                for listener in self._write_listeners:
+                    listener(fresh)
+            # Still under the lock, so no reader can cache the old rows in between
+            if self.cache is not None:
+                self.cache.invalidate_spans(
+                    (activity['start_time'], activity['end_time']) for activity in activities
+                )
+
+    def _max_id(self) -> int:
+        return self.connection.execute("SELECT COALESCE(MAX(id), 0) FROM activities").fetchone()[0]
+
+    def mark_rollups_stale(self, start_time: float, end_time: float):
+        """
+        Flags the usage rollup days overlapping [start_time, end_time) after
+        folded activities there were deleted or changed, so the next
+        refresh re-derives just those (see reports.UsageRollups). Days with
+        nothing rolled up yet are left alone.
+        """
+        self.connection.execute("""
+            INSERT OR IGNORE INTO usage_rollup_stale (day_start)
+            SELECT DISTINCT day_start FROM usage_rollups WHERE day_start > ? - 86400 AND day_start < ?
+        """, (start_time, end_time))
+
+    def _session_row(self, tab_id: str, session: Dict, tab_info: Dict, last_active: bool) -> tuple:
+        return (tab_id, session['start_time'], json.dumps(session), json.dumps(tab_info), int(last_active))
+
+    def _write_session(self, row: tuple, window_id):
+        if row[4]:
+            self.connection.execute("""
+                UPDATE open_sessions SET is_last_active = 0
+                WHERE is_last_active = 1 AND tab_id != ?
+                  AND json_extract(tab_info, '$.window_id') IS ?
+            """, (row[0], window_id))
+        self.connection.execute("""
+            INSERT INTO open_sessions (tab_id, start_time, session, tab_info, is_last_active)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(tab_id) DO UPDATE SET
+                start_time = excluded.start_time,
+                session = excluded.session,
+                tab_info = excluded.tab_info,
+                is_last_active = excluded.is_last_active
+        """, row)
+
+    def open_session(self, tab_id: str, session: Dict, tab_info: Dict, last_active: bool = True):
+        """
+        Records (or replaces) the open session for a tab, by default marking
+        it as its window's front tab. Just one small row write per event.
+        """
+        row = self._session_row(tab_id, session, tab_info, last_active)
+        with self.transaction():
+            self._write_session(row, tab_info.get('window_id'))
+
+    def close_session(self, tab_id: str, activity: Dict):
+        """
+        Writes a finished activity and drops its open session in the same
+        transaction, so after a crash the two can never disagree.
+        """
+        rows = self._prepare_rows([activity])
+        with self.transaction():
+            self._insert_rows([activity], rows)
+            self.connection.execute("DELETE FROM open_sessions WHERE tab_id = ?", (tab_id,))
+
+    def switch_session(self, closed_tab_id: Optional[str], activity: Optional[Dict],
+                       tab_id: str, session: Dict, tab_info: Dict):
+        """
+        Closes one tab's session and opens another's in one transaction.
+        Rows are hashed, encrypted and encoded before taking the lock.
+        """
+        rows = self._prepare_rows([activity]) if activity is not None else None
+        row = self._session_row(tab_id, session, tab_info, True)
+        with self.transaction():
+            if rows is not None:
+                self._insert_rows([activity], rows)
+                self.connection.execute("DELETE FROM open_sessions WHERE tab_id = ?", (closed_tab_id,))
+            self._write_session(row, tab_info.get('window_id'))
 
+    def discard_session(self, tab_id: str):
+        with self.transaction():
+            self.connection.execute("DELETE FROM open_sessions WHERE tab_id = ?", (tab_id,))
+
+    def load_open_sessions(self) -> Tuple[Dict, List[Dict]]:
+        """Gets the open sessions back as (active_tabs, front tabs oldest first)"""
+        active_tabs = {}
+        front_tabs = []
+        with self._lock:
+            rows = self.connection.execute("""
+                SELECT tab_id, session, tab_info, is_last_active FROM open_sessions
+                ORDER BY start_time
+            """).fetchall()
+        for tab_id, session, tab_info, is_last_active in rows:
+            active_tabs[tab_id] = json.loads(session)
+            if is_last_active:
+                front_tabs.append(json.loads(tab_info))
+        return active_tabs, front_tabs
+
+    @staticmethod
+    def _trim_activities(activities: List[Dict], start_time: float, end_time: float) -> List[Dict]:
+        """The activities of a wider range that fall within [start_time, end_time]"""
+        return [activity for activity in activities
+                if activity['start_time'] >= start_time and activity['end_time'] <= end_time]
+
+    def _cached_activities(self, start_time: float, end_time: float) -> List[Dict]:
+        """
+        Activities in a range, through the result cache when there is one.
+        The cache keeps whole buckets (days) and trims them to the range.
+        """
+        with self._lock:
+            if self.cache is None:
+                return self._query_activities(start_time, end_time)
+            return self.cache.get_or_compute_range('activities', start_time, end_time,
+                                                   self._query_activities, self._trim_activities)
+
+    @profiled
     def get_activities(self, start_time: float, end_time: float) -> List[Dict]:
         """Gets activities within a time range"""
         try:
-            cursor = self.connection.execute("""
-                SELECT * FROM activities 
-                WHERE start_time >= ? AND end_time <= ?
-                ORDER BY start_time DESC
-            """, (start_time, end_time))
-            
-            columns = [desc[0] for desc in cursor.description]
-            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return self._cached_activities(start_time, end_time)
         except Exception as e:
-            logging.error(f"Failed to get activities: {str(e)}")
+            logger.error("Failed to get activities: %s", e)
             return []
 
+    def _query_activities(self, start_time: float, end_time: float) -> List[Dict]:
+        cursor = self.connection.execute(f"""
+            SELECT {', '.join(ACTIVITY_COLUMNS)} FROM activities 
+            WHERE start_time >= ? AND end_time <= ?
+            ORDER BY start_time DESC
+        """, (start_time, end_time))
+        
+        activities = self._reveal_rows(cursor)
+        if self.archive and start_time < self._hot_window_start():
+            activities = self._merge_archived(activities, start_time, end_time)
+        return activities
+
+    def get_domain_totals(self, start_time: float, end_time: float) -> Dict[str, float]:
+        """Gets total seconds per domain within a time range, biggest first"""
+        try:
+            with self._lock:
+                if self.cache is None:
+                    totals = self._query_domain_totals(start_time, end_time)
+                else:
+                    totals = self.cache.get_or_compute('domain_totals', start_time, end_time,
+                                                       lambda: self._query_domain_totals(start_time, end_time))
+            if self._downsamples() and start_time < self._hot_window_start():
+                for domain, duration in self._get_downsampler().get_domain_totals(start_time, end_time).items():
+                    totals[domain] = totals.get(domain, 0) + duration
+            return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+        except Exception as e:
+            logger.error("Failed to get domain totals: %s", e)
+            return {}
+
+    def _query_domain_totals(self, start_time: float, end_time: float) -> Dict[str, float]:
+        """
+        Summed by SQLite per domain hash, so only one URL per domain comes
+        back to be decrypted. Rows the hash backfill hasn't reached yet are
+        grouped by URL instead and land on their domain here.
+        """
+        groups = self.connection.execute("""
+            SELECT SUM(duration), MIN(url) FROM activities
+            WHERE start_time >= ? AND end_time <= ?
+            GROUP BY COALESCE(domain_hash, url)
+        """, (start_time, end_time)).fetchall()
+        urls = [url for _, url in groups]
+        if self.cipher and urls:
+            urls = self.cipher.decrypt_batch(urls, 'url')
+
+        totals = {}
+        for (duration, _), url in zip(groups, urls):
+            domain = extract_domain(url)
+            totals[domain] = totals.get(domain, 0) + duration
+        if self.archive and start_time < self._hot_window_start():
+            # A crash between archiving and deleting can leave a row in both places
+            counted = {row[0] for row in self.connection.execute(
+                "SELECT id FROM activities WHERE start_time >= ? AND start_time < ?",
+                (start_time, self._hot_window_start())
+            )}
+            archived = [row for row in self.archive.iter_range(start_time, end_time)
+                        if row['id'] not in counted]
+            urls = [row['url'] for row in archived]
+            if self.cipher and urls:
+                urls = self.cipher.decrypt_batch(urls, 'url')
+            for row, url in zip(archived, urls):
+                domain = extract_domain(url)
+                totals[domain] = totals.get(domain, 0) + row['duration']
+        return totals
+
+    def record_dropped(self, totals: Dict[Tuple[float, str], List]):
+        keys = list(totals)
+        domains = [domain for _, domain in keys]
+        stored = self.cipher.encrypt_batch(domains, 'domain') if self.cipher else domains
+        with self.transaction():
+            self.connection.executemany("""
+                INSERT INTO dropped_activity (bucket_start, domain_hash, device_id, domain,
+                                              duration, activity_count)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(bucket_start, domain_hash, device_id) DO UPDATE SET
+                    duration = duration + excluded.duration,
+                    activity_count = activity_count + excluded.activity_count
+            """, [
+                (bucket_start, self._lookup_hash(domain), self.device_id, stored_domain,
+                 *totals[(bucket_start, domain)])
+                for (bucket_start, domain), stored_domain in zip(keys, stored)
+            ])
+
+    def get_dropped_totals(self, start_time: float, end_time: float) -> Dict[str, float]:
+        with self._lock:
+            rows = self.connection.execute("""
+                SELECT MIN(domain), SUM(duration) FROM dropped_activity
+                WHERE bucket_start >= ? AND bucket_start < ?
+                GROUP BY domain_hash
+            """, (start_time, end_time)).fetchall()
+        domains = [row[0] for row in rows]
+        if self.cipher and domains:
+            domains = self.cipher.decrypt_batch(domains, 'domain')
+        return {domain: duration for domain, (_, duration) in zip(domains, rows)}
+
+    def _merge_archived(self, activities: List[Dict], start_time: float, end_time: float) -> List[Dict]:
+        """Adds archived rows for the part of a range that's past the hot window"""
+        seen = {activity['id'] for activity in activities}
+        archived = []
+        for row in self.archive.read_range(start_time, end_time):
+            # A crash between writing a segment and deleting its rows can leave
+            # a row in both places (ids are never reused, so this is safe)
+            if row['id'] in seen:
+                continue
+            seen.add(row['id'])
+            archived.append({column: row.get(column) for column in ACTIVITY_COLUMNS})
+        activities.extend(self._reveal(archived))
+        activities.sort(key=lambda activity: activity['start_time'], reverse=True)
+        return activities
+
+    def get_activities_for_url(self, url: str) -> List[Dict]:
+        """Gets every activity for an exact URL (works when encrypted too)"""
+        try:
+            with self._lock:
+                cursor = self.connection.execute(f"""
+                    SELECT {', '.join(ACTIVITY_COLUMNS)} FROM activities
+                    WHERE url_hash = ?
+                    ORDER BY start_time DESC
+                """, (self._lookup_hash(url),))
+
+                return self._reveal_rows(cursor)
+        except Exception as e:
+            logger.error("Failed to get activities for url: %s", e)
+            return []
+
+    def get_activities_for_domain(self, domain: str, start_time: float, end_time: float) -> List[Dict]:
+        """Gets activities on one domain within a time range"""
+        try:
+            with self._lock:
+                cursor = self.connection.execute(f"""
+                    SELECT {', '.join(ACTIVITY_COLUMNS)} FROM activities
+                    WHERE domain_hash = ? AND start_time >= ? AND end_time <= ?
+                    ORDER BY start_time DESC
+                """, (self._lookup_hash(extract_domain(domain)), start_time, end_time))
+
+                return self._reveal_rows(cursor)
+        except Exception as e:
+            logger.error("Failed to get activities for domain: %s", e)
+            return []
+
+    def delete_activities(self, start_time: float, end_time: float) -> int:
+        """
+        Deletes activities starting in [start_time, end_time), e.g. before a
+        replay re-derives that range. Raises on failure so callers'
+        transactions roll back. Returns how many rows went.
+        """
+        with self.transaction():
+            deleted = self.connection.execute("""
+                DELETE FROM activities WHERE start_time >= ? AND start_time < ?
+            """, (start_time, end_time)).rowcount
+            if deleted:
+                self.mark_rollups_stale(start_time, end_time)
+            if self.cache is not None:
+                self.cache.invalidate_spans([(start_time, end_time)])
+        return deleted
+
+    def replace_activities(self, start_time: float, end_time: float, activities: List[Dict]):
+        """
+        Swaps the activities starting in [start_time, end_time) for a new
+        batch in one transaction. Write listeners don't see the new rows -
+        the rows they replace were counted already - so call
+        rebuild_derived() once the replacing is done.
+        """
+        with self.transaction():
+            self._replacing = True
+            try:
+                self.delete_activities(start_time, end_time)
+                if activities:
+                    self.insert_activities(activities)
+            finally:
+                self._replacing = False
+
+    def rebuild_derived(self):
+        """Rebuilds every table kept by a write listener (sessions, sketches...)"""
+        for rebuild in self._rebuilds:
+            rebuild()
+
+    def _downsamples(self) -> bool:
+        """Whether cleanup folds expired rows into rollups rather than dropping them"""
+        if self.archive:
+            return False
+        return self.downsample if self.downsample is not None else self.platform_type == "mobile"
+
+    def _get_downsampler(self):
+        if self._downsampler is None:
+            from .downsampling import Downsampler
+            self._downsampler = Downsampler(self, disk_budget_bytes=self.disk_budget_bytes)
+        return self._downsampler
+
     def cleanup_old_data(self):
-        """Cleans up old data based on platform type"""
+        """
+        Cleans up old data based on platform type.
+        With an archive configured, expired rows are moved into a new archive
+        segment first; the segment is fully on disk before anything is deleted.
+        When downsampling, they're folded into rollups in the same transaction
+        that deletes them.
+        """
         try:
-            days_to_keep = 7 if self.platform_type == "mobile" else 30
-            cutoff_time = datetime.now().timestamp() - (days_to_keep * 86400)
-            
-            print(f"\nCutoff time: {datetime.fromtimestamp(cutoff_time)}")
-            
-            cursor = self.connection.execute("SELECT start_time FROM activities")
-            times = cursor.fetchall()
-            print(f"Current times in DB: {[datetime.fromtimestamp(t[0]) for t in times]}")
-            
-            with self.connection:
-                self.connection.execute("""
-                    DELETE FROM activities WHERE start_time < ?
-                """, (cutoff_time,))
-
-                cursor = self.connection.execute("SELECT COUNT(*) FROM activities")
-                count = cursor.fetchone()[0]
-                print(f"Records after deletion: {count}")
-                
-                
+            with self._lock:
+                cutoff_time = self._hot_window_start()
+                # Only touch rows that exist right now, so a late insert can't be
+                # deleted without having been archived
+                max_id = self._max_id()
+
+                if self.archive:
+                    cursor = self.connection.execute("""
+                        SELECT * FROM activities WHERE start_time < ? AND id <= ?
+                        ORDER BY start_time
+                    """, (cutoff_time, max_id))
+                    columns = [desc[0] for desc in cursor.description]
+
+                    def expired_rows():
+                        while True:
+                            batch = cursor.fetchmany(self.archive.chunk_rows)
+                            if not batch:
+                                return
+                            for row in batch:
+                                yield dict(zip(columns, row))
+
+                    segment = self.archive.write_segment(expired_rows())
+                    if segment:
+                        logger.info("Archived expired activities to %s", segment.name)
+
+                if self._downsamples():
+                    self._get_downsampler().run(cutoff_time)
+                else:
+                    with self.transaction():
+                        self.connection.execute("""
+                            DELETE FROM activities WHERE start_time < ? AND id <= ?
+                        """, (cutoff_time, max_id))
+                        self.mark_rollups_stale(0, cutoff_time)
+                        # Archived rows still come back from queries, so only a real
+                        # delete makes cached results stale
+                        if self.cache is not None and not self.archive:
+                            self.cache.invalidate_before(cutoff_time)
+
         except Exception as e:
-            logging.error(f"Failed to cleanup old data: {str(e)}")
+            logger.error("Failed to cleanup old data: %s", e)
+
+    def snapshot(self, dest: str, **options) -> Dict:
+        """
+        Takes a consistent backup of the database while it's in use (see
+        snapshot.create_snapshot for the options). Returns its stats.
+        """
+        from .snapshot import create_snapshot
+        return create_snapshot(str(self.db_path), dest, **options)
 
     def close(self):
         """Properly closes the database connection"""
+        self.migrations.stop()
         if self.connection:
             self.connection.close()
\ No newline at end of file
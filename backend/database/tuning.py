@@ -0,0 +1,208 @@
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Named SQLite settings per kind of device. cache_size is in KiB when
+# negative (SQLite's convention), mmap_size in bytes.
+PROFILES: Dict[str, Dict] = {
+    # Plenty of memory, one user, durability across app crashes is enough
+    'desktop': {
+        'page_size': 4096,
+        'synchronous': 'NORMAL',
+        'cache_size': -16384,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 1000,
+    },
+    # Small cache, no mmap (address space and memory pressure), and short
+    # WAL so it doesn't eat flash
+    'mobile': {
+        'page_size': 4096,
+        'synchronous': 'NORMAL',
+        'cache_size': -2048,
+        'mmap_size': 0,
+        'temp_store': 'FILE',
+        'wal_autocheckpoint': 250,
+    },
+    # Bulk ingestion from many devices: big pages, big cache, rare checkpoints
+    'server': {
+        'page_size': 8192,
+        'synchronous': 'NORMAL',
+        'cache_size': -131072,
+        'mmap_size': 1024 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 4000,
+    },
+}
+
+_SYNCHRONOUS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+_TEMP_STORE = ('DEFAULT', 'FILE', 'MEMORY')
+_INTEGER_SETTINGS = ('page_size', 'cache_size', 'mmap_size', 'wal_autocheckpoint')
+
+
+def calibrated_profile_path(db_path) -> str:
+    """Where calibration records the winning profile for a database"""
+    return f"{db_path}.tuning.json"
+
+
+def resolve_profile(profile: Union[str, Dict, None], platform_type: str, db_path=None) -> Dict:
+    """
+    Turns a profile name or dict into settings. With no profile, a calibrated
+    one recorded for db_path wins; otherwise the platform's own.
+    """
+    if isinstance(profile, dict):
+        return validate_profile(profile)
+    if profile is None:
+        if db_path is not None and os.path.exists(calibrated_profile_path(db_path)):
+            return load_profile(calibrated_profile_path(db_path))
+        profile = 'mobile' if platform_type == 'mobile' else 'desktop'
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown tuning profile: {profile}")
+    return dict(PROFILES[profile])
+
+
+def validate_profile(settings: Dict) -> Dict:
+    """Checks settings before they go anywhere near a PRAGMA (which can't take parameters)"""
+    checked = {}
+    for key, value in settings.items():
+        if key in _INTEGER_SETTINGS:
+            checked[key] = int(value)
+        elif key == 'synchronous' and str(value).upper() in _SYNCHRONOUS:
+            checked[key] = str(value).upper()
+        elif key == 'temp_store' and str(value).upper() in _TEMP_STORE:
+            checked[key] = str(value).upper()
+        else:
+            raise ValueError(f"Bad tuning setting {key}={value!r}")
+    page_size = checked.get('page_size')
+    if page_size is not None and (page_size < 512 or page_size > 65536 or page_size & (page_size - 1)):
+        raise ValueError(f"page_size must be a power of two from 512 to 65536, not {page_size}")
+    return checked
+
+
+def apply_profile(connection, settings: Dict) -> Dict:
+    """
+    Applies settings to a connection and returns what SQLite actually uses.
+    Call it before switching to WAL: page_size only takes on a database
+    that has no tables yet (and never on one already in WAL mode).
+    """
+    settings = validate_profile(settings)
+    for key in ('page_size', 'synchronous', 'cache_size', 'mmap_size', 'temp_store',
+                'wal_autocheckpoint'):
+        if key in settings:
+            connection.execute(f"PRAGMA {key} = {settings[key]}")
+    applied = {}
+    for key in settings:
+        # Some settings don't exist for every database (no mmap for :memory:)
+        row = connection.execute(f"PRAGMA {key}").fetchone()
+        applied[key] = row[0] if row else None
+    return applied
+
+
+def load_profile(path: str) -> Dict:
+    import json
+    with open(path) as f:
+        return validate_profile(json.load(f)['settings'])
+
+
+def candidate_profiles(platform_type: str = 'desktop') -> Dict[str, Dict]:
+    """
+    Profiles worth trying on a new disk. Phones only get the mobile ones -
+    a benchmark run won't show the memory a big cache or mmap costs them.
+    """
+    if platform_type == 'mobile':
+        return {
+            'mobile': dict(PROFILES['mobile']),
+            'mobile-big-cache': dict(PROFILES['mobile'], cache_size=-8192),
+            'mobile-long-wal': dict(PROFILES['mobile'], wal_autocheckpoint=1000),
+            'mobile-memory-temp': dict(PROFILES['mobile'], temp_store='MEMORY'),
+        }
+    candidates = {name: dict(settings) for name, settings in PROFILES.items()}
+    candidates['desktop-full-sync'] = dict(PROFILES['desktop'], synchronous='FULL')
+    candidates['desktop-no-mmap'] = dict(PROFILES['desktop'], mmap_size=0)
+    candidates['server-4k-pages'] = dict(PROFILES['server'], page_size=4096)
+    return candidates
+
+
+def run_workload(storage, rows: int = 20000, switches: int = 500, scans: int = 200) -> Dict[str, float]:
+    """
+    A synthetic tracker workload: batched inserts, single tab-switch
+    transactions (the latency-sensitive path) and range scans.
+    Returns seconds per phase.
+    """
+    start = 1_700_000_000.0
+    activities = [
+        {'url': f'https://site{i % 300}.example.com/page/{i}', 'title': f'Page {i}',
+         'tab_id': f'tab{i % 40}', 'start_time': start + i * 30, 'end_time': start + i * 30 + 25,
+         'duration': 25, 'is_active': False}
+        for i in range(rows + switches)
+    ]
+    timings = {}
+    started = time.perf_counter()
+    for i in range(0, rows, 500):
+        storage.save_activities(activities[i:min(i + 500, rows)])
+    timings['insert'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for activity in activities[rows:]:
+        storage.open_session(activity['tab_id'], {'start_time': activity['start_time']},
+                             {'tab_id': activity['tab_id']})
+        storage.close_session(activity['tab_id'], activity)
+    timings['switch'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    span = (rows + switches) * 30
+    for i in range(scans):
+        window_start = start + (i * 7919 * 30) % span
+        storage.get_activities(window_start, window_start + 3600)
+    timings['scan'] = time.perf_counter() - started
+    return timings
+
+
+def calibrate(platform_type: str, directory: Optional[str] = None,
+              candidates: Optional[Dict[str, Dict]] = None, rounds: int = 1,
+              weights: Optional[Dict[str, float]] = None, **workload) -> List[Dict]:
+    """
+    Runs the workload against each candidate on a fresh database in
+    directory (use the disk the real database lives on) and ranks them,
+    best first. The score is the weighted sum of phase times; by default
+    tab switches weigh most since they're what users wait on.
+    """
+    from .storage_manager import StorageManager
+    from ..core.activity_tracker import BrowserType
+
+    candidates = candidates or candidate_profiles(platform_type)
+    weights = weights or {'insert': 1.0, 'switch': 3.0, 'scan': 1.0}
+    engine = (BrowserType.CHROMIUM_MOBILE.value if platform_type == 'mobile'
+              else BrowserType.CHROMIUM_DESKTOP.value)
+    results = []
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        for name, settings in candidates.items():
+            best = None
+            for round_number in range(rounds):
+                db_path = os.path.join(tmp, f"{name}-{round_number}.db")
+                storage = StorageManager(platform_type, engine, db_path=db_path,
+                                         tuning_profile=settings, downsample=False)
+                try:
+                    timings = run_workload(storage, **workload)
+                finally:
+                    storage.close()
+                score = sum(weights.get(phase, 0) * seconds for phase, seconds in timings.items())
+                if best is None or score < best['score']:
+                    best = {'name': name, 'settings': validate_profile(settings),
+                            'score': score, 'timings': timings}
+            results.append(best)
+            logger.info("Calibration: %s scored %.3f", name, best['score'])
+    return sorted(results, key=lambda result: result['score'])
+
+
+def record_profile(db_path, result: Dict) -> str:
+    """Saves a calibration winner so StorageManager picks it up for db_path"""
+    import json
+    path = calibrated_profile_path(db_path)
+    with open(path, 'w') as f:
+        json.dump(dict(result, calibrated_at=time.time()), f, indent=2)
+    return path
@@ -0,0 +1,160 @@
+"""
+Logging that stays off the hot path.
+
+setup_logging() points the root logger at a queue; a listener thread takes
+records off it and does the formatting and file writes. Handlers only pay
+for a queue put, and log calls use %s arguments so nothing is formatted
+unless a record actually goes out.
+
+Warnings and errors also pass a RepeatFilter first: a run of identical
+messages (a state file that's gone unwritable, say) is logged once per
+window and the repeats are counted, instead of one disk write per event.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional, Tuple
+
+_setup_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+_handler: Optional[QueueHandler] = None
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Lets the first of a run of identical records at or above level through,
+    then drops the rest for window seconds, counting them. The next one to
+    get through says how many were skipped, and flush() reports counts that
+    never got a next one.
+    """
+
+    def __init__(self, window: float = 60.0, level: int = logging.WARNING,
+                 max_keys: int = 1024, clock=time.monotonic):
+        super().__init__()
+        self.window = window
+        self.level = level
+        self.max_keys = max_keys
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (logger, level, message) -> [window start, repeats skipped]
+        self._seen: Dict[Tuple[str, int, str], List] = {}
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = self._clock()
+        expired = []
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is not None and now - seen[0] < self.window:
+                seen[1] += 1
+                self.suppressed += 1
+                return False
+            skipped = seen[1] if seen else 0
+            if seen is None and len(self._seen) >= self.max_keys:
+                expired = self._expire(now)
+            self._seen[key] = [now, 0]
+        if skipped:
+            record.msg = f"{record.getMessage()} (repeated {skipped} more times)"
+            record.args = None
+        self._report(expired)
+        return True
+
+    def _expire(self, now: float) -> list:
+        """Forgets messages whose window is over, returning those with repeats to report"""
+        expired = [(key, seen[1]) for key, seen in self._seen.items() if now - seen[0] >= self.window]
+        for key, _ in expired:
+            del self._seen[key]
+        if len(self._seen) >= self.max_keys:
+            # Everything's still hot - make room anyway, oldest first
+            oldest = min(self._seen, key=lambda key: self._seen[key][0])
+            expired.append((oldest, self._seen.pop(oldest)[1]))
+        return [(key, count) for key, count in expired if count]
+
+    def _report(self, counts: list):
+        for (name, level, message), count in counts:
+            # A different message, so it isn't filtered itself
+            logging.getLogger(name).log(level, "%s (repeated %s more times)", message, count)
+
+    def flush(self):
+        """Reports every outstanding repeat count and starts afresh"""
+        with self._lock:
+            counts = [(key, seen[1]) for key, seen in self._seen.items() if seen[1]]
+            self._seen.clear()
+        self._report(counts)
+
+
+class _ThreadQueueHandler(QueueHandler):
+    """
+    QueueHandler formats records before queueing them so they can be
+    pickled across processes. Ours stay in-process, so the listener thread
+    gets them as they are and does the formatting.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def start_queue_logging(logger: logging.Logger, handlers: list,
+                        repeat_window: Optional[float] = 60.0) -> Tuple[QueueHandler, QueueListener]:
+    """
+    Sends logger's records through a queue to handlers, which run on a
+    listener thread. Pass repeat_window=None to keep every repeat.
+    Returns the queue handler and the (started) listener.
+    """
+    records = queue.SimpleQueue()
+    handler = _ThreadQueueHandler(records)
+    if repeat_window is not None:
+        handler.addFilter(RepeatFilter(repeat_window))
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    logger.addHandler(handler)
+    return handler, listener
+
+
+def stop_queue_logging(logger: logging.Logger, handler: QueueHandler, listener: QueueListener):
+    """Reports outstanding repeats, writes out whatever is queued and stops the listener"""
+    for repeat_filter in handler.filters:
+        if isinstance(repeat_filter, RepeatFilter):
+            repeat_filter.flush()
+    logger.removeHandler(handler)
+    listener.stop()
+    for target in listener.handlers:
+        target.close()
+
+
+def setup_logging(filename: str = 'tracker.log', level: int = logging.INFO,
+                  fmt: str = '%(asctime)s - %(message)s', repeat_window: Optional[float] = 60.0) -> bool:
+    """
+    Routes the root logger to filename through the queue. Like basicConfig
+    it leaves a root logger that already has handlers alone, and only the
+    first call does anything. Returns whether it set logging up.
+    """
+    global _listener, _handler
+    with _setup_lock:
+        root = logging.getLogger()
+        if _listener is not None or root.handlers:
+            return False
+        # delay: the file isn't opened until there's something to write
+        file_handler = logging.FileHandler(filename, delay=True)
+        file_handler.setFormatter(logging.Formatter(fmt))
+        root.setLevel(level)
+        _handler, _listener = start_queue_logging(root, [file_handler], repeat_window)
+    atexit.register(stop_logging)
+    return True
+
+
+def stop_logging():
+    """Flushes and stops what setup_logging started"""
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is None:
+            return
+        handler, listener = _handler, _listener
+        _handler = _listener = None
+    stop_queue_logging(logging.getLogger(), handler, listener)
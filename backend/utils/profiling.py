@@ -0,0 +1,255 @@
+"""
+Opt-in profiling for the tracker and storage hot paths.
+
+Functions decorated with @profiled cost one global lookup while profiling
+is off. Turn it on with:
+
+    TRACKER_PROFILE=1        profile from startup
+    TRACKER_PROFILE=signal   SIGUSR1 toggles profiling on and off
+    TRACKER_PROFILE_DIR=...  where the output goes (default ./profiles)
+
+or call enable_profiling()/disable_profiling(). While it's on, calls into
+the hooks run under cProfile, a sampling thread records their stacks and
+tracemalloc tracks allocations. Turning it off writes:
+
+    <prefix>.pstats          cProfile stats (python -m pstats, snakeviz...)
+    <prefix>.collapsed       collapsed stacks for flamegraph.pl / speedscope
+    <prefix>.summary.txt     per-hook call counts and times, top allocations
+"""
+import atexit
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from functools import wraps
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_profiler = None
+
+
+class Profiler:
+    """
+    One profiling run. Each thread gets its own cProfile.Profile (cProfile
+    only sees the thread that enabled it), and they're merged on dump.
+    """
+
+    def __init__(self, output_dir: str = "profiles", sample_interval: float = 0.005,
+                 trace_frames: int = 16):
+        import cProfile
+        import tracemalloc
+        self._cprofile = cProfile
+        self._tracemalloc = tracemalloc
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.trace_frames = trace_frames
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiles = []
+        # Threads currently inside a hook -> how deep
+        self._active_threads: Dict[int, int] = {}
+        self.stacks: Dict[str, int] = {}
+        self.calls: Dict[str, list] = {}
+        self._sampler = None
+        self._stopping = threading.Event()
+        self._started_tracemalloc = False
+        self._baseline = None
+
+    def start(self):
+        if not self._tracemalloc.is_tracing():
+            self._tracemalloc.start(self.trace_frames)
+            self._started_tracemalloc = True
+        self._baseline = self._tracemalloc.take_snapshot()
+        self._sampler = threading.Thread(target=self._sample_loop, name="tracker-profiler",
+                                         daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> Optional[str]:
+        """Stops sampling and writes the results. Returns the output prefix."""
+        self._stopping.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        snapshot = self._tracemalloc.take_snapshot()
+        if self._started_tracemalloc:
+            self._tracemalloc.stop()
+        return self._dump(snapshot)
+
+    def call(self, name: str, func, args, kwargs):
+        """Runs one hook call under the profiler"""
+        local = self._local
+        profile = getattr(local, 'profile', None)
+        if profile is None:
+            profile = local.profile = self._cprofile.Profile()
+            with self._lock:
+                self._profiles.append(profile)
+        thread_id = threading.get_ident()
+        depth = self._active_threads.get(thread_id, 0)
+        self._active_threads[thread_id] = depth + 1
+        if depth == 0:
+            profile.enable()
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            if depth == 0:
+                profile.disable()
+                del self._active_threads[thread_id]
+            else:
+                self._active_threads[thread_id] = depth
+            with self._lock:
+                totals = self.calls.setdefault(name, [0, 0.0])
+                totals[0] += 1
+                totals[1] += elapsed
+
+    def _sample_loop(self):
+        """Records the stack of every thread that's inside a hook"""
+        while not self._stopping.wait(self.sample_interval):
+            frames = sys._current_frames()
+            for thread_id in list(self._active_threads):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def _dump(self, snapshot) -> Optional[str]:
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"profile-{os.getpid()}-{int(time.time())}")
+
+        with self._lock:
+            profiles = list(self._profiles)
+        if profiles:
+            import pstats
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(f"{prefix}.pstats")
+
+        with open(f"{prefix}.collapsed", 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+        with open(f"{prefix}.summary.txt", 'w') as f:
+            f.write("hook calls total_ms mean_ms\n")
+            for name, (count, total) in sorted(self.calls.items(), key=lambda item: -item[1][1]):
+                f.write(f"{name} {count} {total * 1000:.3f} {total * 1000 / count:.4f}\n")
+            f.write("\nTop allocations since profiling started:\n")
+            for stat in snapshot.compare_to(self._baseline, 'lineno')[:25]:
+                f.write(f"{stat}\n")
+
+        logger.info("Wrote profile to %s.*", prefix)
+        return prefix
+
+
+def profiled(func):
+    """Marks a function as a profiling hook"""
+    name = func.__qualname__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _profiler
+        if profiler is None:
+            return func(*args, **kwargs)
+        return profiler.call(name, func, args, kwargs)
+    return wrapper
+
+
+def profiling_enabled() -> bool:
+    return _profiler is not None
+
+
+def enable_profiling(output_dir: Optional[str] = None, **options) -> bool:
+    """Starts profiling the hooks. Returns False if it was already on."""
+    global _profiler
+    if _profiler is not None:
+        return False
+    profiler = Profiler(output_dir or os.environ.get('TRACKER_PROFILE_DIR', 'profiles'), **options)
+    profiler.start()
+    _profiler = profiler
+    # Don't lose a run that's still going when the process exits
+    atexit.register(disable_profiling)
+    return True
+
+
+def disable_profiling() -> Optional[str]:
+    """Stops profiling and writes the results. Returns the output prefix."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return None
+    atexit.unregister(disable_profiling)
+    try:
+        return profiler.stop()
+    except Exception as e:
+        logger.error("Couldn't write profile: %s", e)
+        return None
+
+
+def toggle_profiling(*_):
+    """Flips profiling on or off"""
+    if _profiler is None:
+        enable_profiling()
+    else:
+        disable_profiling()
+
+
+# Set by the signal handler, acted on by the watcher thread. Starting and
+# stopping a run takes locks, joins the sampler and writes files, none of
+# which is safe in a handler that can interrupt the main thread mid-hook.
+_toggle_requested = threading.Event()
+_toggle_watcher = None
+
+
+def _request_toggle(*_):
+    """The signal handler - only asks the watcher to toggle"""
+    _toggle_requested.set()
+
+
+def _watch_toggles():
+    while True:
+        _toggle_requested.wait()
+        _toggle_requested.clear()
+        try:
+            toggle_profiling()
+        except Exception as e:
+            logger.error("Couldn't toggle profiling: %s", e)
+
+
+def install_signal_handler(signum: Optional[int] = None) -> bool:
+    """Makes a signal (SIGUSR1 by default) toggle profiling"""
+    global _toggle_watcher
+    signum = signum if signum is not None else getattr(signal, 'SIGUSR1', None)
+    if signum is None:
+        return False
+    try:
+        signal.signal(signum, _request_toggle)
+    except ValueError:
+        # Only the main thread can install signal handlers
+        logger.error("Couldn't install profiling signal handler outside the main thread")
+        return False
+    if _toggle_watcher is None:
+        _toggle_watcher = threading.Thread(target=_watch_toggles, name="tracker-profiler-toggle",
+                                           daemon=True)
+        _toggle_watcher.start()
+    return True
+
+
+def _configure_from_env():
+    setting = os.environ.get('TRACKER_PROFILE', '').lower()
+    if setting == 'signal':
+        install_signal_handler()
+    elif setting in ('1', 'on', 'true'):
+        enable_profiling()
+
+
+_configure_from_env()
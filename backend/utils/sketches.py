@@ -0,0 +1,261 @@
+"""
+Small mergeable summaries that can be stored as blobs and added together.
+
+LogHistogram answers quantile queries (p50/p90/p99 of a duration) to
+within a fixed relative error, whatever the number of values. Sketches
+made with the same accuracy merge by adding bucket counts, so per-day
+sketches combine into any range without touching the raw values.
+
+HyperLogLog counts distinct values in a few KiB, and sketches merge into
+the count of their union the same way.
+"""
+import hashlib
+import math
+import struct
+import sys
+from array import array
+from itertools import compress
+from typing import Dict, Iterable, Optional
+
+_HISTOGRAM_VERSION = 1
+_HISTOGRAM_HEAD = struct.Struct('<BdddddQI')
+
+
+class LogHistogram:
+    """
+    A quantile sketch over non-negative values with logarithmic buckets
+    (the DDSketch scheme). Value v goes into bucket ceil(log_gamma(v)) with
+    gamma = (1 + a) / (1 - a), and a quantile is answered with the middle of
+    its bucket, so it's within relative error a of a value that really is
+    at that rank. Values at or below min_value share one bucket.
+
+    Durations from a tenth of a second to a day need about 700 buckets at
+    1% accuracy; a typical domain-day uses a few dozen.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, count: int = 1):
+        if value < 0:
+            raise ValueError("LogHistogram only takes non-negative values")
+        if value <= self.min_value:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def remove(self, value: float, count: int = 1):
+        """Takes values that were added back out. min and max stay as they were."""
+        if value <= self.min_value:
+            self.zero_count -= count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            left = self.buckets.get(index, 0) - count
+            if left > 0:
+                self.buckets[index] = left
+            else:
+                self.buckets.pop(index, None)
+        self.count -= count
+        self.total -= value * count
+
+    def update(self, values: Iterable[float]):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: 'LogHistogram'):
+        """Adds another sketch's values into this one"""
+        if (other.relative_accuracy, other.min_value) != (self.relative_accuracy, self.min_value):
+            raise ValueError("Can only merge sketches made with the same settings")
+        buckets = self.buckets
+        for index, count in other.buckets.items():
+            buckets[index] = buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        """The value at quantile q (0 to 1), or None when empty"""
+        if not self.count:
+            return None
+        if not 0 <= q <= 1:
+            raise ValueError("q must be between 0 and 1")
+        rank = q * (self.count - 1)
+        # The extremes are kept exactly
+        if rank == 0:
+            return self.min
+        if rank >= self.count - 1:
+            return self.max
+        seen = self.zero_count
+        if rank < seen:
+            return self.min
+        value = self.max
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                break
+        return min(max(value, self.min), self.max)
+
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def to_bytes(self) -> bytes:
+        indexes = sorted(self.buckets)
+        return (_HISTOGRAM_HEAD.pack(_HISTOGRAM_VERSION, self.relative_accuracy, self.min_value,
+                                     self.total, self.min, self.max, self.zero_count, len(indexes))
+                + struct.pack(f'<{len(indexes)}i{len(indexes)}Q', *indexes,
+                              *(self.buckets[index] for index in indexes)))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'LogHistogram':
+        (version, accuracy, min_value, total, low, high,
+         zero_count, size) = _HISTOGRAM_HEAD.unpack_from(data)
+        if version != _HISTOGRAM_VERSION:
+            raise ValueError(f"Unknown histogram version {version}")
+        sketch = cls(accuracy, min_value)
+        values = struct.unpack_from(f'<{size}i{size}Q', data, _HISTOGRAM_HEAD.size)
+        sketch.buckets = dict(zip(values[:size], values[size:]))
+        sketch.zero_count = zero_count
+        sketch.count = zero_count + sum(values[size:])
+        sketch.total, sketch.min, sketch.max = total, low, high
+        return sketch
+
+
+_HLL_VERSION = 1
+_HLL_DENSE = 0
+_HLL_SPARSE = 1
+_HLL_HEAD = struct.Struct('<BBB')
+# 2 ** -rank for every possible register value
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(66)]
+
+
+class HyperLogLog:
+    """
+    Approximate distinct counter (HyperLogLog with linear counting for
+    small cardinalities) in 2**p one-byte registers. The standard error is
+    1.04 / sqrt(2**p): 1.6% at the default p=12, so about 95% of estimates
+    are within 3.3% of the true count. Below a few thousand distinct values
+    linear counting makes it close to exact.
+
+    Feed it anything with add(), or add_digest() for values that are
+    already uniformly distributed hashes (their first 8 bytes are used).
+    Merging takes the max of each register, so a union of any number of
+    sketches has the same error bound as one.
+    """
+
+    def __init__(self, p: int = 12):
+        if not 4 <= p <= 16:
+            raise ValueError("p must be between 4 and 16")
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    @property
+    def standard_error(self) -> float:
+        return 1.04 / math.sqrt(self.m)
+
+    def add_digest(self, digest: bytes):
+        h = int.from_bytes(digest[:8], 'little')
+        rest_bits = 64 - self.p
+        index = h >> rest_bits
+        rank = rest_bits - (h & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add(self, value):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        self.add_digest(hashlib.blake2b(value, digest_size=8).digest())
+
+    def count(self) -> int:
+        m = self.m
+        registers = self.registers
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(_INVERSE_POWERS[rank] for rank in registers)
+        if estimate <= 2.5 * m:
+            zeros = registers.count(0)
+            if zeros:
+                estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def merge(self, other: 'HyperLogLog'):
+        """Makes this the union of itself and other"""
+        if other.p != self.p:
+            raise ValueError("Can only merge sketches with the same p")
+        self.registers = bytearray(_max_bytes(self.registers, other.registers))
+        return self
+
+    def merge_bytes(self, data: bytes):
+        """Merges a serialised sketch in without building it first - cheap for sparse ones"""
+        version, encoding, p = _HLL_HEAD.unpack_from(data)
+        if version != _HLL_VERSION or p != self.p:
+            raise ValueError("Can only merge sketches with the same p")
+        body = memoryview(data)[_HLL_HEAD.size:]
+        if encoding == _HLL_DENSE:
+            self.registers = bytearray(_max_bytes(self.registers, body))
+            return self
+        size = len(body) // 3
+        indexes = array('H')
+        indexes.frombytes(body[:2 * size])
+        if sys.byteorder == 'big':
+            indexes.byteswap()
+        registers = self.registers
+        for index, rank in zip(indexes, body[2 * size:]):
+            if rank > registers[index]:
+                registers[index] = rank
+        return self
+
+    def to_bytes(self) -> bytes:
+        """
+        Sparse while few registers are set (their indexes as uint16s, then
+        their values), all of the registers after that.
+        """
+        registers = self.registers
+        if (self.m - registers.count(0)) * 3 < self.m:
+            # Both halves are picked out in C rather than by walking the registers
+            indexes = array('H', compress(range(self.m), registers))
+            if sys.byteorder == 'big':
+                indexes.byteswap()
+            return (_HLL_HEAD.pack(_HLL_VERSION, _HLL_SPARSE, self.p) + indexes.tobytes()
+                    + registers.replace(b'\x00', b''))
+        return _HLL_HEAD.pack(_HLL_VERSION, _HLL_DENSE, self.p) + bytes(registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        _, _, p = _HLL_HEAD.unpack_from(data)
+        return cls(p).merge_bytes(data)
+
+
+def _max_bytes(a, b) -> bytes:
+    """
+    Byte-wise max of two equal-length register arrays, as arithmetic on
+    two big ints (register values are under 128, so a byte's top bit is
+    free to show which side is bigger).
+    """
+    size = len(a)
+    x = int.from_bytes(a, 'little')
+    y = int.from_bytes(b, 'little')
+    high = int.from_bytes(b'\x80' * size, 'little')
+    # Top bit of each byte set where x's byte >= y's byte
+    x_wins = (((x | high) - y) & high) >> 7
+    mask = x_wins * 0xFF
+    return ((x & mask) | (y & ~mask)).to_bytes(size, 'little')
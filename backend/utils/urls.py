@@ -0,0 +1,25 @@
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+
+@lru_cache(maxsize=4096)
+def extract_domain(url: str) -> str:
+    """
+    Pulls the host out of a URL so we can group activity by site.
+    Drops a leading "www." and lowercases it. Anything we can't parse
+    (about:blank, chrome://newtab...) just comes back as-is.
+
+    A bare host like "www.Example.com" works too, so callers can pass
+    either a URL or a domain.
+    """
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        host = None
+    if not host:
+        if ':' in url or '/' in url:
+            return url
+        host = url.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
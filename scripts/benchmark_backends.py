@@ -0,0 +1,109 @@
+"""
+Runs the same workload against every storage backend.
+
+    python -m scripts.benchmark_backends --rows 50000
+
+The workload is batched inserts, a tracker-style stream of single writes
+(tab switches), a set of one-hour range scans, a domain aggregate over
+everything and a retention pass. Times are printed per backend; there's no
+budget, it's for comparing engines and spotting regressions.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from backend.core.activity_tracker import BrowserType, PlatformType
+from backend.database.memory_backend import MemoryBackend
+from backend.database.storage_manager import StorageManager
+
+
+def make_activities(count: int, start: float):
+    """Synthetic activities spread over a few hundred sites, 30s apart"""
+    return [
+        {
+            'url': f'https://site{i % 300}.example.com/page/{i}',
+            'title': f'Page {i} of site {i % 300}',
+            'tab_id': f'tab{i % 40}',
+            'start_time': start + i * 30,
+            'end_time': start + i * 30 + 25,
+            'duration': 25,
+            'is_active': False
+        }
+        for i in range(count)
+    ]
+
+
+def run(backend, rows: int, batch_size: int, singles: int, scans: int) -> dict:
+    """Times each phase of the workload against one backend"""
+    # Start 40 days back so the retention pass has something to drop
+    start = (datetime.now() - timedelta(days=40)).timestamp()
+    activities = make_activities(rows + singles, start)
+    timings = {}
+
+    started = time.perf_counter()
+    for i in range(0, rows, batch_size):
+        backend.save_activities(activities[i:i + batch_size])
+    timings['batch insert'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for activity in activities[rows:]:
+        with backend.transaction():
+            backend.open_session(activity['tab_id'], {'start_time': activity['start_time']},
+                                 {'tab_id': activity['tab_id']})
+            backend.close_session(activity['tab_id'], activity)
+    timings['tab switches'] = time.perf_counter() - started
+
+    end = activities[-1]['end_time']
+    rng = random.Random(42)
+    started = time.perf_counter()
+    for _ in range(scans):
+        window_start = rng.uniform(start, end - 3600)
+        backend.get_activities(window_start, window_start + 3600)
+    timings['range scans'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    backend.get_domain_totals(start, end)
+    timings['aggregate'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    backend.cleanup_old_data()
+    timings['retention'] = time.perf_counter() - started
+    return timings
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=50_000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--singles', type=int, default=2_000)
+    parser.add_argument('--scans', type=int, default=500)
+    args = parser.parse_args(argv)
+
+    platform = PlatformType.DESKTOP.value
+    engine = BrowserType.CHROMIUM_DESKTOP.value
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            'sqlite': lambda: StorageManager(platform, engine, db_path=os.path.join(tmp, 'bench.db')),
+            'memory': lambda: MemoryBackend(platform, engine),
+        }
+        for name, make_backend in backends.items():
+            backend = make_backend()
+            try:
+                results[name] = run(backend, args.rows, args.batch_size, args.singles, args.scans)
+            finally:
+                backend.close()
+
+    names = list(results)
+    print(f"{'phase':>14}" + ''.join(f"{name:>12}" for name in names))
+    for phase in results[names[0]]:
+        print(f"{phase:>14}" + ''.join(f"{results[name][phase]:>11.3f}s" for name in names))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Measures NDJSON archive replay throughput as workers are added.
+
+    python -m scripts.benchmark_replay --events 1000000 --workers 1,2,4,8
+
+Writes a synthetic archive of tab switches spread over several days, then
+replays it into a fresh database with each worker count. Prints events/s,
+MB/s and the peak RSS of this process, which should stay about the same
+whatever the archive size - the file is mapped, not read in.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from backend.core.activity_tracker import BrowserType, PlatformType
+from backend.core.ndjson_replay import replay_ndjson
+from backend.database.storage_manager import StorageManager
+
+PLATFORM = PlatformType.DESKTOP.value
+ENGINE = BrowserType.CHROMIUM_DESKTOP.value
+
+
+def write_archive(path: str, events: int):
+    with open(path, 'w') as f:
+        f.write(json.dumps({'tracker': 'ChromiumTracker', 'platform_type': PLATFORM}) + '\n')
+        for i in range(events):
+            tab_info = {'url': f'https://site{i % 300}.example.com/page/{i % 5000}',
+                        'title': f'Page {i % 5000}', 'tab_id': f'tab{i % 40}',
+                        'window_id': f'w{i % 3}'}
+            f.write(json.dumps({'event': 'tab_activated', 'timestamp': 1_700_000_000.0 + i * 20,
+                                'tab_info': tab_info}, separators=(',', ':')) + '\n')
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--events', type=int, default=1_000_000)
+    parser.add_argument('--workers', default='1,2,4', help="comma separated worker counts")
+    parser.add_argument('--chunk-mb', type=float, default=16)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = os.path.join(tmp, 'events.ndjson')
+        write_archive(archive, args.events)
+        size_mb = os.path.getsize(archive) / 2**20
+        print(f"archive: {args.events} events, {size_mb:.1f} MB; rss {peak_rss_mb():.0f} MB")
+
+        for workers in (int(w) for w in args.workers.split(',')):
+            storage = StorageManager(PLATFORM, ENGINE, db_path=os.path.join(tmp, f'replay-{workers}.db'))
+            try:
+                started = time.perf_counter()
+                saved = replay_ndjson(archive, storage, workers=workers,
+                                      chunk_bytes=int(args.chunk_mb * 2**20))
+                elapsed = time.perf_counter() - started
+            finally:
+                storage.close()
+            print(f"{workers:>3} workers: {args.events / elapsed:10.0f} events/s "
+                  f"{size_mb / elapsed:7.1f} MB/s  {saved} activities  "
+                  f"peak rss {peak_rss_mb():.0f} MB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
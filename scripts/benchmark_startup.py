@@ -0,0 +1,89 @@
+"""
+Measures how long it takes to import the trackers and construct one.
+
+    python -m scripts.benchmark_startup
+
+Each import is timed in a fresh interpreter (best of --runs) so module
+caching doesn't hide regressions. Construction is timed against a large
+saved state, which shouldn't matter since state is loaded lazily.
+Exits with status 1 if anything goes over its budget.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Budgets in milliseconds, on top of a bare interpreter start
+IMPORT_BUDGET_MS = 60.0
+CONSTRUCT_BUDGET_MS = 5.0
+
+TRACKER_MODULES = (
+    'backend.core.browsers.chromium_tracker',
+    'backend.core.browsers.gecko_tracker',
+    'backend.core.browsers.webkit_tracker',
+)
+
+
+def time_import(module: str, runs: int) -> float:
+    """Best-of-N wall time (ms) to import a module, minus a bare interpreter"""
+    def best(code):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], check=True)
+            timings.append(time.perf_counter() - started)
+        return min(timings) * 1000
+
+    return best(f'import {module}') - best('pass')
+
+
+def time_construction(runs: int, state_tabs: int) -> float:
+    """Best-of-N time (ms) to construct a tracker next to a big state file"""
+    from backend.core.browsers.chromium_tracker import ChromiumTracker
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        with open(f"{db_path}.state", 'w') as f:
+            json.dump({
+                'active_tabs': {
+                    f'tab{i}': {'start_time': 0.0, 'url': f'https://site{i}.com', 'browser_type': 'x'}
+                    for i in range(state_tabs)
+                },
+                'last_active': None
+            }, f)
+
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            ChromiumTracker(platform_type='desktop', db_path=db_path)
+            timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--state-tabs', type=int, default=20_000)
+    args = parser.parse_args(argv)
+
+    ok = True
+    for module in TRACKER_MODULES:
+        elapsed = time_import(module, args.runs)
+        within = elapsed <= IMPORT_BUDGET_MS
+        ok = ok and within
+        print(f"import {module}: {elapsed:.1f}ms (budget {IMPORT_BUDGET_MS:.0f}ms) "
+              f"{'ok' if within else 'OVER BUDGET'}")
+
+    elapsed = time_construction(args.runs, args.state_tabs)
+    within = elapsed <= CONSTRUCT_BUDGET_MS
+    ok = ok and within
+    print(f"construct ChromiumTracker ({args.state_tabs} saved tabs): {elapsed:.2f}ms "
+          f"(budget {CONSTRUCT_BUDGET_MS:.0f}ms) {'ok' if within else 'OVER BUDGET'}")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
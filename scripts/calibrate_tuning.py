@@ -0,0 +1,45 @@
+"""
+Picks the SQLite tuning profile that runs fastest on this machine's disk.
+
+    python -m scripts.calibrate_tuning --db ~/.tracker/activity.db --platform desktop
+
+Runs a synthetic tracker workload (batched inserts, single tab switches,
+range scans) against every candidate profile on scratch databases next to
+--db, prints the ranking and records the winner in <db>.tuning.json, where
+StorageManager picks it up the next time it opens that database. Use
+--dry-run to only print the ranking.
+"""
+import argparse
+import os
+import sys
+
+from backend.core.activity_tracker import PlatformType
+from backend.database.tuning import calibrate, record_profile
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--db', default='activity.db', help="database the profile is for")
+    parser.add_argument('--platform', default=PlatformType.DESKTOP.value,
+                        choices=[p.value for p in PlatformType])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--switches', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=3, help="best of this many runs per candidate")
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args(argv)
+
+    directory = os.path.dirname(os.path.abspath(args.db))
+    results = calibrate(args.platform, directory=directory, rounds=args.rounds,
+                        rows=args.rows, switches=args.switches)
+    for result in results:
+        timings = '  '.join(f"{phase} {seconds:6.3f}s" for phase, seconds in result['timings'].items())
+        print(f"{result['name']:>18}: score {result['score']:7.3f}  {timings}")
+
+    if not args.dry_run:
+        path = record_profile(args.db, results[0])
+        print(f"recorded {results[0]['name']} in {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""
+Seeds the activity database from browser history files.
+
+    python -m scripts.import_history ~/copy-of/History ~/copy-of/places.sqlite
+
+Works on copies of Chromium's History and Firefox's places.sqlite (the
+browser locks the live ones). Importing the same file again only adds
+visits that weren't there before.
+"""
+import argparse
+import sys
+import time
+
+from backend.core.activity_tracker import BrowserType, PlatformType
+from backend.database.importers import import_history
+from backend.database.storage_manager import StorageManager
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('files', nargs='+', help="History / places.sqlite copies")
+    parser.add_argument('--db', default='activity.db')
+    parser.add_argument('--platform', default=PlatformType.DESKTOP.value,
+                        choices=[platform.value for platform in PlatformType])
+    parser.add_argument('--since', type=float, default=None, help="unix time to import from")
+    parser.add_argument('--max-gap', type=float, default=1800,
+                        help="longest a visit can count for when the browser didn't record it")
+    args = parser.parse_args(argv)
+
+    storage = StorageManager(args.platform, BrowserType.CHROMIUM_DESKTOP.value, db_path=args.db)
+    try:
+        for path in args.files:
+            started = time.perf_counter()
+            added = import_history(storage, path, since=args.since, max_gap=args.max_gap)
+            print(f"{path}: {added} activities in {time.perf_counter() - started:.2f}s")
+    finally:
+        storage.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
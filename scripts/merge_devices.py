@@ -0,0 +1,58 @@
+"""
+Merges several devices' activity databases into one timeline database.
+
+    python -m scripts.merge_devices laptop=~/laptop/activity.db phone=~/phone/activity.db --out all.db
+
+Each source is [device=]path; the device name labels rows that weren't
+recorded with a device id (it defaults to the file name). Sources are
+streamed in time order and merged with a heap, so memory stays flat
+however big they are. Where devices overlap, the one focused last wins.
+Running it again with the same sources only adds what's new.
+"""
+import argparse
+import sys
+import time
+
+from backend.core.activity_tracker import BrowserType, PlatformType
+from backend.database.merge import ActivitySource, merge_databases
+from backend.database.storage_manager import StorageManager
+
+
+def parse_source(spec: str, batch_size: int) -> ActivitySource:
+    device, sep, path = spec.partition('=')
+    if not sep:
+        device, path = None, spec
+    return ActivitySource(path, device_id=device, batch_size=batch_size)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('sources', nargs='+', help="[device=]path of each activity database")
+    parser.add_argument('--out', required=True, help="database to merge into")
+    parser.add_argument('--platform', default=PlatformType.DESKTOP.value,
+                        choices=[platform.value for platform in PlatformType])
+    parser.add_argument('--read-batch', type=int, default=2000, help="rows fetched per source at a time")
+    parser.add_argument('--write-batch', type=int, default=5000, help="rows saved per transaction")
+    args = parser.parse_args(argv)
+
+    sources = [parse_source(spec, args.read_batch) for spec in args.sources]
+    storage = StorageManager(args.platform, BrowserType.CHROMIUM_DESKTOP.value, db_path=args.out)
+    stats = {}
+    started = time.perf_counter()
+    try:
+        written = merge_databases(sources, storage, batch_size=args.write_batch, stats=stats)
+    finally:
+        storage.close()
+    elapsed = time.perf_counter() - started
+    if written < 0:
+        print("Merge failed, see the log", file=sys.stderr)
+        return 1
+
+    print(f"{stats['read']} activities from {len(sources)} databases -> {written} in {args.out} "
+          f"({stats['trimmed']} trimmed where devices overlapped) in {elapsed:.2f}s, "
+          f"{stats['read'] / elapsed if elapsed else 0:,.0f} rows/s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
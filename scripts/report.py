@@ -0,0 +1,126 @@
+"""
+Prints a usage report for a day, week, month or year.
+
+    python -m scripts.report --db ~/.tracker/activity.db --period month --format text
+    python -m scripts.report --period year --date 2024-06-01 --format json --profile
+
+Shows the top domains, the split between browsers, time per hour of day
+and a timeline (per day for a week or month, per month for a year) as
+text, CSV or JSON. Totals come from daily rollups that are brought up
+to date incrementally on each run (the first run on a big database builds
+them), and history that's been downsampled or archived is read from there,
+so a year costs about as much as a day. --no-rollups streams the raw
+activities instead. --profile prints where the time went to stderr.
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from datetime import date
+
+from backend.core.activity_tracker import BrowserType, PlatformType
+from backend.database.reports import PERIODS, UsageRollups, build_report
+from backend.database.storage_manager import StorageManager
+
+
+def hms(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def render_text(report: dict, out):
+    out.write(f"{report['period'].title()} report, {report['start'][:10]} to {report['end'][:10]}\n")
+    out.write(f"{hms(report['total_seconds'])} over {report['activities']} activities "
+              f"on {report['domains']} domains\n\n")
+
+    out.write("Top domains\n")
+    for row in report['top_domains']:
+        out.write(f"  {row['domain']:<40} {hms(row['seconds']):>9} {row['share']:6.1%}\n")
+
+    out.write("\nBrowsers\n")
+    for row in report['browsers']:
+        out.write(f"  {row['browser']:<40} {hms(row['seconds']):>9} {row['share']:6.1%}\n")
+
+    out.write("\nBy hour of day\n")
+    peak = max(report['hours']) or 1
+    for hour, seconds in enumerate(report['hours']):
+        out.write(f"  {hour:02d}:00 {'#' * round(30 * seconds / peak):<30} {hms(seconds):>9}\n")
+
+    if report['timeline']:
+        out.write("\nTimeline\n")
+        for key, seconds in report['timeline'].items():
+            out.write(f"  {key:<12} {hms(seconds):>9}\n")
+
+
+def render_csv(report: dict, out):
+    """One table: section, key, seconds, share"""
+    writer = csv.writer(out)
+    total = report['total_seconds'] or 1
+    writer.writerow(['section', 'key', 'seconds', 'share'])
+    writer.writerow(['total', report['period'], round(report['total_seconds'], 3), 1])
+    for row in report['top_domains']:
+        writer.writerow(['domain', row['domain'], round(row['seconds'], 3), round(row['share'], 4)])
+    for row in report['browsers']:
+        writer.writerow(['browser', row['browser'], round(row['seconds'], 3), round(row['share'], 4)])
+    for hour, seconds in enumerate(report['hours']):
+        writer.writerow(['hour', f"{hour:02d}", round(seconds, 3), round(seconds / total, 4)])
+    for key, seconds in report['timeline'].items():
+        writer.writerow(['timeline', key, round(seconds, 3), round(seconds / total, 4)])
+
+
+def render_json(report: dict, out):
+    json.dump(report, out, indent=2)
+    out.write('\n')
+
+
+RENDERERS = {'text': render_text, 'csv': render_csv, 'json': render_json}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--db', default='activity.db')
+    parser.add_argument('--platform', default=PlatformType.DESKTOP.value,
+                        choices=[platform.value for platform in PlatformType])
+    parser.add_argument('--period', default='week', choices=PERIODS)
+    parser.add_argument('--date', type=date.fromisoformat, default=date.today(),
+                        help="any day in the period (YYYY-MM-DD, default today)")
+    parser.add_argument('--format', default='text', choices=sorted(RENDERERS))
+    parser.add_argument('--top', type=int, default=20, help="how many domains to list")
+    parser.add_argument('--archive', default=None, help="archive directory, if the database has one")
+    parser.add_argument('--no-rollups', action='store_true',
+                        help="stream every activity instead of reading the usage rollups")
+    parser.add_argument('--rebuild-rollups', action='store_true',
+                        help="recompute the usage rollups from scratch first")
+    parser.add_argument('--profile', action='store_true', help="print a timing breakdown to stderr")
+    args = parser.parse_args(argv)
+
+    timings = {}
+    started = time.perf_counter()
+    storage = StorageManager(args.platform, BrowserType.CHROMIUM_DESKTOP.value, db_path=args.db,
+                             archive_dir=args.archive)
+    timings['open'] = time.perf_counter() - started
+    try:
+        if args.rebuild_rollups:
+            started = time.perf_counter()
+            UsageRollups(storage).rebuild()
+            timings['rebuild rollups'] = time.perf_counter() - started
+        report = build_report(storage, args.period, args.date, top=args.top,
+                              use_rollups=not args.no_rollups, timings=timings)
+    finally:
+        storage.close()
+
+    started = time.perf_counter()
+    RENDERERS[args.format](report, sys.stdout)
+    timings['render'] = time.perf_counter() - started
+
+    if args.profile:
+        for phase, seconds in timings.items():
+            print(f"{phase:>14}: {seconds * 1000:8.1f} ms", file=sys.stderr)
+        print(f"{'total':>14}: {sum(timings.values()) * 1000:8.1f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import pytest
+from backend.core.activity_tracker import BrowserType, PlatformType
+from backend.database.memory_backend import MemoryBackend
+from backend.database.storage_manager import StorageManager
+
+
+@pytest.fixture
+def make_storage(tmp_path):
+    """
+    Opens StorageManagers in the test's temp dir - desktop Chromium unless
+    told otherwise, any other StorageManager options passed through - and
+    closes them after the test
+    """
+    opened = []
+
+    def make(name="activity.db", platform_type=PlatformType.DESKTOP.value,
+             engine_type=BrowserType.CHROMIUM_DESKTOP.value, **options):
+        storage = StorageManager(platform_type=platform_type, engine_type=engine_type,
+                                 db_path=str(tmp_path / name), **options)
+        opened.append(storage)
+        return storage
+
+    yield make
+    for storage in opened:
+        storage.close()
+
+
+@pytest.fixture
+def storage(make_storage):
+    """An empty desktop Chromium database"""
+    return make_storage()
+
+
+def _activity(start, end=None, url='https://example.com/', tab_id='tab1', **fields):
+    end = start + fields.get('duration', 60) if end is None else end
+    activity = {'url': url, 'tab_id': tab_id, 'start_time': start, 'end_time': end,
+                'duration': end - start, 'is_active': False}
+    activity.update(fields)
+    return activity
+
+
+@pytest.fixture
+def make_activity():
+    """
+    Builds a finished activity: make_activity(start, end=None, url=..., tab_id=..., **fields).
+    Without an end it lasts a minute (or duration, if given); otherwise its
+    duration is end - start. Any other column (title, device_id...) goes
+    in fields.
+    """
+    return _activity
+
+
+@pytest.fixture
+def make_tracker():
+    """
+    Builds trackers on a MemoryBackend - nothing in the tracker tests
+    needs to outlive them, so they skip the database - and closes both
+    after the test
+    """
+    built = []
+
+    def make(tracker_class, platform_type, engine_type):
+        storage = MemoryBackend(platform_type, engine_type)
+        tracker = tracker_class(platform_type=platform_type, storage=storage)
+        built.append((tracker, storage))
+        return tracker
+
+    yield make
+    for tracker, storage in built:
+        tracker.close()
+        storage.close()
@@ -3,15 +3,18 @@ from datetime import datetime
 import json
 import os
 from backend.core.activity_tracker import ActivityTracker, BrowserType, PlatformType
+from backend.database.memory_backend import MemoryBackend
 
 @pytest.fixture
 def tracker():
     """Creates a fresh tracker for each test"""
     tracker = ActivityTracker("test.db")
     yield tracker
+    tracker.close()
     # Cleanup after tests
-    if os.path.exists("test.db.state"):
-        os.remove("test.db.state")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(f"test.db{suffix}"):
+            os.remove(f"test.db{suffix}")
 
 @pytest.fixture
 def sample_tab_info():
@@ -85,11 +88,167 @@ def test_crash_recovery(tracker, sample_tab_info):
     """Tests recovery after simulated crash"""
     tracker.track_tab_change(sample_tab_info)
     
-    # Simulate crash by corrupting state file
+    # Simulate a crash: the tracker never shuts down cleanly, and a stale,
+    # corrupted state file from an older version is lying around
     with open("test.db.state", 'w') as f:
         f.write("corrupted data")
     
-    # New tracker should handle corrupted state
+    # New tracker recovers the open session from the database and drops the bad file
     new_tracker = ActivityTracker("test.db")
-    assert new_tracker.active_tabs == {}
-    assert new_tracker.last_active is None
\ No newline at end of file
+    assert list(new_tracker.active_tabs) == [sample_tab_info['tab_id']]
+    assert new_tracker.last_active == sample_tab_info
+    assert not os.path.exists("test.db.state")
+    new_tracker.close()
+
+def test_session_closed_with_activity(tracker, sample_tab_info):
+    """Tests that switching tabs writes the activity and moves the open session together"""
+    tracker.track_tab_change(sample_tab_info)
+    new_tab = dict(sample_tab_info, url='https://example.org', tab_id='tab2')
+    tracker.track_tab_change(new_tab)
+
+    storage = tracker.storage
+    activities = storage.get_activities(0, datetime.now().timestamp() + 60)
+    assert [a['url'] for a in activities] == ['https://example.com']
+    open_tabs = [row[0] for row in storage.connection.execute("SELECT tab_id FROM open_sessions")]
+    assert open_tabs == ['tab2']
+
+def test_legacy_state_file_imported():
+    """Tests that a state file from before the move to SQLite is picked up once"""
+    with open("legacy.db.state", 'w') as f:
+        json.dump({
+            'active_tabs': {'tab9': {'start_time': 1.0, 'url': 'https://old.com', 'browser_type': 'x'}},
+            'last_active': {'tab_id': 'tab9', 'url': 'https://old.com', 'window_id': 'w'}
+        }, f)
+
+    tracker = ActivityTracker("legacy.db")
+    try:
+        assert 'tab9' in tracker.active_tabs
+        assert tracker.last_active['url'] == 'https://old.com'
+        assert not os.path.exists("legacy.db.state")
+    finally:
+        tracker.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(f"legacy.db{suffix}"):
+                os.remove(f"legacy.db{suffix}")
+
+def test_legacy_state_kept_when_import_fails(tmp_path):
+    """Tests that the old state file isn't deleted if the database couldn't take it"""
+    db_path = str(tmp_path / "legacy.db")
+    with open(f"{db_path}.state", 'w') as f:
+        json.dump({'active_tabs': {'tab9': {'start_time': 1.0, 'url': 'https://old.com'}}}, f)
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("disk full")
+
+    storage = MemoryBackend(PlatformType.DESKTOP.value, BrowserType.CHROMIUM_DESKTOP.value)
+    storage.open_session = broken
+    assert ActivityTracker(db_path, storage=storage).active_tabs == {}
+    assert os.path.exists(f"{db_path}.state")
+
+    del storage.open_session
+    assert 'tab9' in ActivityTracker(db_path, storage=storage).active_tabs
+    assert not os.path.exists(f"{db_path}.state")
+
+def test_windows_tracked_independently(tmp_path, sample_tab_info):
+    """Tests that each window keeps its own front tab, across restarts too"""
+    db_path = str(tmp_path / "windows.db")
+    tracker = ActivityTracker(db_path)
+    try:
+        tracker.track_tab_change(sample_tab_info)
+        other = dict(sample_tab_info, url='https://example.org', tab_id='tab2', window_id='window2')
+        tracker.track_tab_change(other)
+        # Another window's tab doesn't close ours
+        assert set(tracker.active_tabs) == {'tab1', 'tab2'}
+        assert tracker.last_active == other
+
+        tracker.track_tab_change(dict(sample_tab_info, url='https://example.net', tab_id='tab3'))
+        assert set(tracker.active_tabs) == {'tab2', 'tab3'}
+        assert tracker.front_tab('window2') == other
+    finally:
+        tracker.close()
+
+    restarted = ActivityTracker(db_path)
+    try:
+        assert restarted.front_tab('window1')['tab_id'] == 'tab3'
+        assert restarted.front_tab('window2')['tab_id'] == 'tab2'
+        assert restarted.last_active['tab_id'] == 'tab3'
+    finally:
+        restarted.close()
+
+def test_concurrent_windows(tmp_path, sample_tab_info):
+    """Tests that handlers racing on several threads don't lose or mix up sessions"""
+    import threading
+    tracker = ActivityTracker(str(tmp_path / "threads.db"), lock_stripes=4)
+    windows, switches = 8, 50
+    failures = []
+    start = threading.Barrier(windows)
+
+    def run(window):
+        start.wait()
+        for i in range(switches):
+            tab = dict(sample_tab_info, url=f'https://site{window}.com/{i}',
+                       tab_id=f'w{window}-tab{i % 3}', window_id=f'w{window}')
+            if not tracker.track_tab_change(tab):
+                failures.append(tab)
+
+    threads = [threading.Thread(target=run, args=(window,)) for window in range(windows)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert failures == []
+        # One tab left open per window, everything before it saved exactly once
+        assert sorted(tracker.active_tabs) == sorted(f'w{w}-tab{(switches - 1) % 3}' for w in range(windows))
+        activities = tracker.storage.get_activities(0, datetime.now().timestamp() + 60)
+        assert len(activities) == windows * (switches - 1)
+        assert all(a['duration'] >= 0 for a in activities)
+        open_tabs = tracker.storage.connection.execute("SELECT COUNT(*) FROM open_sessions").fetchone()[0]
+        assert open_tabs == windows
+    finally:
+        tracker.close()
+
+def test_windows_progress_during_a_write(tmp_path, sample_tab_info):
+    """Tests that one window's slow write doesn't hold up another window's handler until its own write"""
+    import threading
+    tracker = ActivityTracker(str(tmp_path / "overlap.db"))
+    storage = tracker._get_storage()
+    in_write, release, prepared = threading.Event(), threading.Event(), threading.Event()
+
+    def slow_listener(activities):
+        if any(a['tab_id'] == 'a1' for a in activities):
+            in_write.set()
+            release.wait(5)
+    storage.add_write_listener(slow_listener)
+
+    prepare_rows = storage._prepare_rows
+
+    def watched_prepare(activities):
+        if any(a['tab_id'] == 'b1' for a in activities):
+            prepared.set()
+        return prepare_rows(activities)
+    storage._prepare_rows = watched_prepare
+
+    def tab(tab_id, window_id):
+        return dict(sample_tab_info, url=f'https://{tab_id}.com/', tab_id=tab_id, window_id=window_id)
+
+    try:
+        assert tracker.track_tab_change(tab('a1', 1)) and tracker.track_tab_change(tab('b1', 2))
+        results = {}
+        window_a = threading.Thread(target=lambda: results.setdefault('a', tracker.track_tab_change(tab('a2', 1))))
+        window_b = threading.Thread(target=lambda: results.setdefault('b', tracker.track_tab_change(tab('b2', 2))))
+        window_a.start()
+        assert in_write.wait(5)
+        # Window 1 is mid-write, holding the storage; window 2 still gets its row ready
+        window_b.start()
+        assert prepared.wait(5)
+        assert not release.is_set() and window_a.is_alive()
+        release.set()
+        window_a.join()
+        window_b.join()
+        assert results == {'a': True, 'b': True}
+        saved = tracker.storage.get_activities(0, datetime.now().timestamp() + 60)
+        assert sorted(a['url'] for a in saved) == ['https://a1.com/', 'https://b1.com/']
+    finally:
+        release.set()
+        tracker.close()
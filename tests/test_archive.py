@@ -0,0 +1,108 @@
+import pytest
+import json
+from datetime import datetime, timedelta
+from backend.core.activity_tracker import BrowserType, PlatformType
+from backend.database.archive import _FOOTER_LEN, MAGIC, ArchiveStore
+
+@pytest.fixture
+def storage(make_storage, tmp_path):
+    """Creates a mobile test database with an archive directory"""
+    return make_storage("archived.db", PlatformType.MOBILE.value, BrowserType.CHROMIUM_MOBILE.value,
+                        archive_dir=str(tmp_path / "archive"))
+
+def days_ago(days):
+    return (datetime.now() - timedelta(days=days)).timestamp()
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma"])
+def test_segment_roundtrip(tmp_path, codec):
+    """Tests writing a segment and reading a range back from it"""
+    archive = ArchiveStore(str(tmp_path), codec=codec, chunk_rows=10)
+    rows = [
+        {'id': i, 'url': f'https://site{i}.com', 'start_time': float(i * 100),
+         'end_time': float(i * 100 + 50), 'blob': bytes([i % 256])}
+        for i in range(35)
+    ]
+    path = archive.write_segment(iter(rows))
+    assert path is not None and path.exists()
+
+    result = archive.read_range(1000, 2050)
+    assert [row['id'] for row in result] == list(range(10, 21))
+    assert result[0]['blob'] == bytes([10])
+
+def test_mixed_column_types_across_chunks(tmp_path):
+    """Tests titles that are None in one chunk, encrypted bytes in the next and mixed in a third"""
+    archive = ArchiveStore(str(tmp_path), chunk_rows=4)
+    titles = [None] * 4 + [b'\x00enc%d' % i for i in range(4)] + ['plain', None, b'\xffenc', 'old']
+    rows = [{'id': i, 'title': title, 'start_time': float(i), 'end_time': float(i + 1)}
+            for i, title in enumerate(titles)]
+    archive.write_segment(iter(rows))
+    assert [row['title'] for row in archive.read_range(0, 100)] == titles
+
+def test_empty_segment_not_written(tmp_path):
+    """Tests that archiving nothing leaves no files behind"""
+    archive = ArchiveStore(str(tmp_path))
+    assert archive.write_segment(iter([])) is None
+    assert list(tmp_path.iterdir()) == []
+
+def test_unknown_footer_rejected(tmp_path):
+    """Tests that a segment with a footer layout we never wrote isn't read"""
+    archive = ArchiveStore(str(tmp_path))
+    path = archive.write_segment(iter([{'id': 1, 'start_time': 1.0, 'end_time': 2.0}]))
+    data = path.read_bytes()
+    (length,) = _FOOTER_LEN.unpack(data[-len(MAGIC) - _FOOTER_LEN.size:-len(MAGIC)])
+    body = data[:-len(MAGIC) - _FOOTER_LEN.size - length]
+    footer = json.loads(data[len(body):len(body) + length])
+    footer['blob_columns'] = []
+    for chunk in footer['chunks']:
+        del chunk['blob_columns']
+    footer = json.dumps(footer).encode('utf-8')
+    path.write_bytes(body + footer + _FOOTER_LEN.pack(len(footer)) + MAGIC)
+
+    with pytest.raises(ValueError):
+        ArchiveStore(str(tmp_path))._read_footer(path)
+    assert ArchiveStore(str(tmp_path)).read_range(0, 10) == []
+
+def test_cleanup_moves_rows_to_archive(storage, make_activity):
+    """Tests that expired rows leave the hot table but stay queryable"""
+    storage.save_activity(make_activity(days_ago(15), url='https://old.example.com'))
+    storage.save_activity(make_activity(days_ago(0), url='https://example.com'))
+
+    storage.cleanup_old_data()
+
+    hot = storage.connection.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+    assert hot == 1
+    assert len(storage.archive.segments()) == 1
+
+    everything = storage.get_activities(0, datetime.now().timestamp() + 3600)
+    assert [a['url'] for a in everything] == ['https://example.com', 'https://old.example.com']
+
+def test_recent_queries_skip_archive(storage, make_activity):
+    """Tests that ranges inside the hot window don't read archive segments"""
+    storage.save_activity(make_activity(days_ago(15), url='https://old.example.com'))
+    storage.cleanup_old_data()
+
+    since_yesterday = (datetime.now() - timedelta(days=1)).timestamp()
+    assert storage.get_activities(since_yesterday, datetime.now().timestamp()) == []
+
+def test_duplicate_rows_read_once(storage, make_activity):
+    """Tests recovery when a crash left rows in both the table and a segment"""
+    storage.save_activity(make_activity(days_ago(15)))
+    rows = storage.connection.execute("SELECT * FROM activities")
+    columns = [d[0] for d in rows.description]
+    storage.archive.write_segment(dict(zip(columns, row)) for row in rows.fetchall())
+
+    assert len(storage.get_activities(0, datetime.now().timestamp())) == 1
+
+def test_domain_totals_include_archive(storage, make_activity):
+    """Tests that archived rows count towards domain totals, once each"""
+    storage.save_activity(make_activity(days_ago(15), url='https://old.example.com/a'))
+    storage.cleanup_old_data()
+    storage.save_activity(make_activity(days_ago(14), url='https://old.example.com/b'))
+    storage.save_activity(make_activity(days_ago(0), url='https://example.com/'))
+    # Left in both places by a crash mid-archive
+    rows = storage.connection.execute("SELECT * FROM activities WHERE start_time < ?", (days_ago(1),))
+    columns = [d[0] for d in rows.description]
+    storage.archive.write_segment(dict(zip(columns, row)) for row in rows.fetchall())
+
+    totals = storage.get_domain_totals(0, datetime.now().timestamp() + 3600)
+    assert totals == {'old.example.com': 120, 'example.com': 60}
@@ -1,24 +1,17 @@
 import pytest
 from datetime import datetime
-import os
 from backend.core.browsers.chromium_tracker import ChromiumTracker
 from backend.core.activity_tracker import BrowserType, PlatformType
 
 @pytest.fixture
-def desktop_tracker():
+def desktop_tracker(make_tracker):
     """Creates a desktop Chromium tracker"""
-    tracker = ChromiumTracker(platform_type=PlatformType.DESKTOP.value, db_path="test_desktop.db")
-    yield tracker
-    if os.path.exists("test_desktop.db.state"):
-        os.remove("test_desktop.db.state")
+    return make_tracker(ChromiumTracker, PlatformType.DESKTOP.value, BrowserType.CHROMIUM_DESKTOP.value)
 
 @pytest.fixture
-def mobile_tracker():
+def mobile_tracker(make_tracker):
     """Creates a mobile Chromium tracker"""
-    tracker = ChromiumTracker(platform_type=PlatformType.MOBILE.value, db_path="test_mobile.db")
-    yield tracker
-    if os.path.exists("test_mobile.db.state"):
-        os.remove("test_mobile.db.state")
+    return make_tracker(ChromiumTracker, PlatformType.MOBILE.value, BrowserType.CHROMIUM_MOBILE.value)
 
 @pytest.fixture
 def sample_tab():
@@ -122,4 +115,29 @@ def test_multiple_tab_switches(desktop_tracker, sample_tab):
     
     # Verify first tab is no longer active
     assert sample_tab['tab_id'] not in desktop_tracker.active_tabs
-    assert desktop_tracker.last_active['url'] == second_tab['url']
\ No newline at end of file
+    assert desktop_tracker.last_active['url'] == second_tab['url']
+
+
+def test_handle_tab_updates_batch(desktop_tracker, sample_tab):
+    """Tests that a batch of updates is tracked in order with per-item reasons for the rest"""
+    rejected = desktop_tracker.handle_tab_updates([
+        sample_tab,
+        {'url': 'https://example.com', 'tab_id': 'tab1', 'window_id': 'window1'},  # same URL
+        {'url': 'https://example.org', 'window_id': 'window1'},
+        {'url': 'https://example.org', 'tab_id': 'tab2', 'window_id': 'window1'},
+    ])
+    assert list(rejected) == [1, 2]
+    assert rejected[2] == ["tab_id: missing"]
+    assert desktop_tracker.front_tab('window1')['url'] == 'https://example.org'
+
+def test_handle_tab_updates_checked_once(desktop_tracker, sample_tab, monkeypatch):
+    """Tests that each update in a batch goes through the schema check once"""
+    from backend.core.validation import TAB_UPDATE
+    checked = []
+    is_valid = TAB_UPDATE.is_valid
+    monkeypatch.setattr(TAB_UPDATE, 'is_valid', lambda item: checked.append(item) or is_valid(item))
+    batch = [dict(sample_tab, url=f'https://site{i}.com/') for i in range(5)] + [{'url': 'x'}]
+    assert list(desktop_tracker.handle_tab_updates(batch)) == [5]
+    assert len(checked) == len(batch)
+    # A single update on its own is still checked
+    assert not desktop_tracker.handle_tab_updated({'url': 'https://a.com/', 'window_id': 'window1'})
@@ -0,0 +1,49 @@
+import pytest
+from backend.core.activity_tracker import BrowserType
+from backend.database.distinct_counts import DistinctCounters
+
+CHROMIUM = BrowserType.CHROMIUM_DESKTOP.value
+GECKO = BrowserType.GECKO_DESKTOP.value
+DAY = 86400
+
+@pytest.fixture
+def make_activities(make_activity):
+    """count one-second visits on a day, spread over that many domains"""
+    def make(day, count, domains, engine=CHROMIUM):
+        start = DAY * (100 + day)
+        return [make_activity(start + i, start + i + 1, url=f'https://site{i % domains}.com/page{i}',
+                              tab_id='t1', engine_type=engine)
+                for i in range(count)]
+    return make
+
+def exact(storage, column, start, end, engine=None):
+    sql = f"SELECT COUNT(DISTINCT {column}) FROM activities WHERE start_time >= ? AND start_time < ?"
+    params = [start, end]
+    if engine:
+        sql += " AND engine_type = ?"
+        params.append(engine)
+    return storage.connection.execute(sql, params).fetchone()[0]
+
+def test_counts_match_count_distinct(storage, make_activities):
+    counters = DistinctCounters(storage)
+    for day in range(5):
+        storage.save_activities(make_activities(day, 2000, domains=50 + day * 20))
+    storage.save_activities(make_activities(2, 300, domains=400, engine=GECKO))
+
+    start, end = DAY * 100, DAY * 105
+    for kind, column in (('domain', 'domain_hash'), ('url', 'url_hash')):
+        true_count = exact(storage, column, start, end)
+        assert abs(counters.count_distinct(start, end, kind) - true_count) <= 0.05 * true_count
+    # Per browser, and for a range of fewer days
+    assert abs(counters.count_distinct(start, end, engine_type=GECKO)
+               - exact(storage, 'domain_hash', start, end, GECKO)) <= 10
+    assert counters.count_distinct(DAY * 101, DAY * 102) == pytest.approx(70, abs=2)
+    assert counters.count_distinct(0, DAY) == 0
+
+def test_rebuild_matches_incremental(storage, make_activities):
+    storage.save_activities(make_activities(0, 500, domains=30))
+    counters = DistinctCounters(storage)
+    assert counters.count_distinct(0, DAY * 200) == 0
+    assert counters.rebuild() == 2
+    assert counters.count_distinct(0, DAY * 200) == pytest.approx(30, abs=1)
+    assert counters.count_distinct(0, DAY * 200, kind='nonsense') == 0
@@ -0,0 +1,130 @@
+import pytest
+from datetime import datetime
+from backend.core.activity_tracker import BrowserType, PlatformType
+from backend.database.downsampling import DAY, HOUR, MINUTE, Downsampler
+
+NOW = datetime.now().timestamp()
+STORY = 'https://news.site/story'
+
+@pytest.fixture
+def storage(make_storage):
+    """A mobile database, which downsamples by default"""
+    return make_storage("mobile.db", PlatformType.MOBILE.value, BrowserType.CHROMIUM_MOBILE.value)
+
+def days_ago(days, offset=0):
+    """A timestamp at a round hour, so bucket maths is easy to check"""
+    moment = NOW - days * DAY
+    return moment - moment % HOUR + offset
+
+def activity_count(storage):
+    return storage.connection.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+
+def test_cleanup_folds_into_minutes(storage, make_activity):
+    """Tests that expired activities become minute buckets instead of vanishing"""
+    storage.save_activities([make_activity(days_ago(10, 30), duration=60, url=STORY),
+                             make_activity(days_ago(1), url=STORY)])
+    storage.cleanup_old_data()
+
+    assert activity_count(storage) == 1
+    rollups = storage._get_downsampler().get_rollups(0, NOW)
+    # 60s starting at :30 straddles two minutes
+    assert [(r['resolution'], r['bucket_start'] - days_ago(10), r['duration'], r['activity_count'])
+            for r in rollups] == [(MINUTE, 0, 30, 1), (MINUTE, 60, 30, 0)]
+    assert rollups[0]['domain'] == 'news.site'
+
+def test_old_history_goes_straight_to_hours(storage, make_activity):
+    storage.save_activities([make_activity(days_ago(45, 100), duration=300, url=STORY),
+                             make_activity(days_ago(45, 2000), duration=300, url=STORY, tab_id='tab2')])
+    storage.cleanup_old_data()
+
+    rollups = storage._get_downsampler().get_rollups(0, NOW)
+    assert [(r['resolution'], r['duration'], r['activity_count']) for r in rollups] == [(HOUR, 600, 2)]
+
+def test_domain_totals_include_rollups(storage, make_activity):
+    """Tests that downsampled history still shows up in domain totals"""
+    storage.save_activities([
+        make_activity(days_ago(20), duration=120, url=STORY),
+        make_activity(days_ago(60), duration=300, url='https://www.video.site/watch'),
+        make_activity(days_ago(1), duration=30, url=STORY),
+    ])
+    before = storage.get_domain_totals(0, NOW + DAY)
+    storage.cleanup_old_data()
+
+    assert activity_count(storage) == 1
+    assert storage.get_domain_totals(0, NOW + DAY) == before == {'video.site': 300, 'news.site': 150}
+
+def test_minutes_merge_into_hours(storage, make_activity):
+    """Tests that minute buckets fold into hours once they're old enough"""
+    storage.save_activities([make_activity(days_ago(20, i * 300), duration=60, url=STORY, tab_id=f'tab{i}')
+                             for i in range(10)])
+    downsampler = Downsampler(storage, minute_days=30)
+    downsampler.run()
+    assert len(downsampler.get_rollups(0, NOW, MINUTE)) == 10
+
+    downsampler.minute_days = 10
+    assert downsampler.run()['merged'] == 10
+    hours = downsampler.get_rollups(0, NOW)
+    assert [(r['resolution'], r['duration'], r['activity_count']) for r in hours] == [
+        (HOUR, 600, 10)]
+
+def test_disk_budget_folds_oldest_days(storage, make_activity):
+    """Tests that the oldest hourly buckets become daily ones when over budget, losing no time"""
+    storage.save_activities([
+        make_activity(days_ago(day, i * HOUR), duration=60, url=f'https://site{i % 3}.com/', tab_id=f'{day}-{i}')
+        for day in range(41, 200) for i in range(12)
+    ])
+    downsampler = Downsampler(storage, disk_budget_bytes=10 ** 12)
+    downsampler.run()
+    full = downsampler.used_bytes()
+    totals = downsampler.get_domain_totals(0, NOW)
+
+    downsampler.disk_budget_bytes = full // 2
+    assert downsampler.run()['coarsened'] > 0
+    assert downsampler.used_bytes() <= full // 2
+    assert downsampler.get_domain_totals(0, NOW) == pytest.approx(totals)
+    remaining = downsampler.get_rollups(0, NOW)
+    assert remaining[0]['resolution'] == DAY and remaining[0]['bucket_start'] % DAY == 0
+    # The newest history keeps its hours
+    assert (remaining[-1]['resolution'], remaining[-1]['bucket_start']) == (HOUR, days_ago(41, 11 * HOUR))
+
+    # Daily buckets are the last resort and are never dropped
+    downsampler.disk_budget_bytes = 1
+    downsampler.run()
+    assert {row['resolution'] for row in downsampler.get_rollups(0, NOW)} == {DAY}
+    assert downsampler.get_domain_totals(0, NOW) == pytest.approx(totals)
+
+def test_hot_activities_dont_count_against_budget(storage, make_activity):
+    """Tests that a big hot table leaves the rollups alone"""
+    storage.save_activity(make_activity(days_ago(45), url=STORY))
+    storage.save_activities([make_activity(days_ago(1, i), duration=1, url=f'https://site{i}.com/{i}', tab_id=str(i))
+                             for i in range(3000)])
+    downsampler = Downsampler(storage, disk_budget_bytes=64 * 1024)
+    assert downsampler.run()['coarsened'] == 0
+    assert [row['resolution'] for row in downsampler.get_rollups(0, NOW)] == [HOUR]
+
+def test_unhashed_rows_wait_for_backfill(storage, make_activity):
+    """Tests that rows the hash backfill hasn't reached stay put until it has"""
+    storage.save_activities([make_activity(days_ago(20), url=STORY),
+                             make_activity(days_ago(21), url=STORY, tab_id='tab2')])
+    storage.connection.execute("UPDATE activities SET domain_hash = NULL WHERE tab_id = 'tab2'")
+    assert Downsampler(storage).run()['folded'] == 1
+    assert activity_count(storage) == 1
+
+def test_desktop_still_deletes(make_storage, make_activity):
+    storage = make_storage("desktop.db")
+    storage.save_activity(make_activity(days_ago(45), url=STORY))
+    storage.cleanup_old_data()
+    assert activity_count(storage) == 0
+    assert storage.connection.execute("SELECT COUNT(*) FROM activity_rollups").fetchone()[0] == 0
+
+def test_encrypted_domains(make_storage, make_activity):
+    """Tests that rollup domains are stored encrypted"""
+    pytest.importorskip("cryptography")
+    from backend.database.encryption import ActivityCipher
+    storage = make_storage("enc.db", PlatformType.MOBILE.value, BrowserType.CHROMIUM_MOBILE.value,
+                           cipher=ActivityCipher(ActivityCipher.generate_key()))
+    storage.save_activity(make_activity(days_ago(10), url=STORY))
+    storage.cleanup_old_data()
+    raw = storage.connection.execute("SELECT domain FROM activity_rollups").fetchone()[0]
+    assert isinstance(raw, bytes)
+    assert storage.get_domain_totals(0, NOW) == {'news.site': 60}
@@ -0,0 +1,61 @@
+import pytest
+from backend.core.activity_tracker import BrowserType
+from backend.database.duration_sketches import DurationSketches
+
+CHROMIUM = BrowserType.CHROMIUM_DESKTOP.value
+GECKO = BrowserType.GECKO_DESKTOP.value
+
+@pytest.fixture
+def make_activities(make_activity):
+    """One activity every five minutes from day 10, the i-th lasting i + 1 seconds"""
+    def make(count, url='https://news.site/story', engine=CHROMIUM, device='', offset=0):
+        start = 86400 * 10 + offset
+        return [make_activity(start + i * 300, start + i * 300 + i + 1, url=f'{url}/{i}', tab_id='t1',
+                              engine_type=engine, device_id=device)
+                for i in range(count)]
+    return make
+
+def test_percentiles_per_domain_and_browser(storage, make_activities):
+    sketches = DurationSketches(storage)
+    storage.save_activities(make_activities(100))
+    storage.save_activities(make_activities(50, url='https://video.site/watch', engine=GECKO, offset=7))
+
+    by_domain = sketches.get_percentiles(0, 86400 * 20)
+    assert list(by_domain) == ['news.site', 'video.site']
+    assert by_domain['news.site']['count'] == 100
+    assert by_domain['news.site']['p50'] == pytest.approx(50, rel=0.02)
+    assert by_domain['news.site']['p99'] == pytest.approx(99, rel=0.02)
+
+    by_browser = sketches.get_percentiles(0, 86400 * 20, by='browser', quantiles=[0.9])
+    assert by_browser[GECKO] == {'count': 50, 'mean': 25.5, 'p90': pytest.approx(45, rel=0.02)}
+    assert sketches.get_percentiles(0, 86400 * 20, domain='www.video.site')['video.site']['count'] == 50
+
+def test_stretched_activity_replaces_duration(storage, make_activities):
+    """Tests that a resend with a later end time swaps the old duration out"""
+    sketches = DurationSketches(storage)
+    activity = make_activities(1)[0]
+    storage.save_activity(activity)
+    storage.save_activity(dict(activity, end_time=activity['end_time'] + 99, duration=100))
+    stats = sketches.get_percentiles(0, 86400 * 20)['news.site']
+    assert stats['count'] == 1 and stats['mean'] == 100
+
+def test_devices_merged_and_filtered(storage, make_activities):
+    sketches = DurationSketches(storage)
+    storage.save_activities(make_activities(40, device='laptop'))
+    storage.save_activities(make_activities(60, device='phone', offset=13))
+
+    assert sketches.get_percentiles(0, 86400 * 20)['news.site']['count'] == 100
+    assert sketches.get_percentiles(0, 86400 * 20, device_ids=['phone'])['news.site']['count'] == 60
+    # Outside the range, nothing
+    assert sketches.get_percentiles(0, 86400 * 5) == {}
+
+def test_rebuild_matches_incremental(storage, make_activities):
+    storage.save_activities(make_activities(30))
+    sketches = DurationSketches(storage)
+    assert sketches.get_percentiles(0, 86400 * 20) == {}
+
+    storage.save_activities(make_activities(30, offset=86400))
+    incremental = sketches.get_percentiles(86400 * 11, 86400 * 12)
+    assert sketches.rebuild() == 2
+    assert sketches.get_percentiles(86400 * 11, 86400 * 12) == incremental
+    assert sketches.get_percentiles(0, 86400 * 20)['news.site']['count'] == 60
@@ -0,0 +1,84 @@
+import pytest
+from datetime import datetime
+
+pytest.importorskip("cryptography")
+from backend.database.encryption import ActivityCipher
+
+@pytest.fixture
+def cipher():
+    """A cipher with a throwaway key"""
+    return ActivityCipher(ActivityCipher.generate_key())
+
+@pytest.fixture
+def storage(make_storage, cipher):
+    """Creates an encrypted test database"""
+    return make_storage("encrypted.db", cipher=cipher)
+
+def test_batch_roundtrip(cipher):
+    """Tests that a whole batch decrypts back to what went in"""
+    values = ['https://example.com', None, 'https://example.org/ünïcode']
+    encrypted = cipher.encrypt_batch(values, 'url')
+    assert encrypted[1] is None
+    assert all(isinstance(v, bytes) for v in (encrypted[0], encrypted[2]))
+    assert cipher.decrypt_batch(encrypted, 'url') == values
+
+def test_column_binding(cipher):
+    """Tests that a ciphertext can't be decrypted as another column"""
+    encrypted = cipher.encrypt_batch(['secret title'], 'title')
+    with pytest.raises(Exception):
+        cipher.decrypt_batch(encrypted, 'url')
+
+def test_passphrase_key_is_cached():
+    """Tests that deriving the same passphrase twice gives matching hashes"""
+    first = ActivityCipher.from_passphrase("hunter2", b"salt-1234")
+    second = ActivityCipher.from_passphrase("hunter2", b"salt-1234")
+    assert first.lookup_hash("https://example.com") == second.lookup_hash("https://example.com")
+
+def test_urls_not_stored_in_plaintext(storage, make_activity):
+    """Tests that the raw URL and title never hit the database file"""
+    assert storage.save_activity(make_activity(datetime.now().timestamp(), url='https://secret.example.com', title='Secret'))
+
+    row = storage.connection.execute("SELECT url, title FROM activities").fetchone()
+    assert isinstance(row[0], bytes)
+    assert b'secret.example.com' not in row[0]
+    assert b'Secret' not in row[1]
+
+    activities = storage.get_activities(0, datetime.now().timestamp() + 3600)
+    assert activities[0]['url'] == 'https://secret.example.com'
+    assert activities[0]['title'] == 'Secret'
+
+def test_lookup_by_url_and_domain(storage, make_activity):
+    """Tests equality lookups through the keyed hash columns"""
+    now = datetime.now().timestamp()
+    storage.save_activities([
+        make_activity(now, url='https://www.example.com/a'),
+        make_activity(now + 100, url='https://example.com/b'),
+        make_activity(now + 200, url='https://other.org/'),
+    ])
+
+    by_url = storage.get_activities_for_url('https://example.com/b')
+    assert [a['url'] for a in by_url] == ['https://example.com/b']
+
+    by_domain = storage.get_activities_for_domain('example.com', 0, datetime.now().timestamp() + 3600)
+    assert len(by_domain) == 2
+
+def test_domain_lookup_uses_index(storage):
+    """Tests that domain lookups are answered from the hash index"""
+    plan = storage.connection.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM activities WHERE domain_hash = ? AND start_time >= ?",
+        (b'x', 0)
+    ).fetchall()
+    assert any('idx_domain_hash' in str(step) for step in plan)
+
+def test_domain_totals_decrypt_one_url_per_domain(storage, cipher, make_activity, monkeypatch):
+    """Tests that totals are summed in SQL and rows still waiting for their hash are counted"""
+    storage.save_activities([make_activity(1000 + i * 100, url=f'https://a.com/{i}') for i in range(5)] +
+                            [make_activity(2000, url='https://b.com/')])
+    storage.connection.execute("UPDATE activities SET domain_hash = NULL WHERE start_time = 1400")
+    decrypted = []
+    decrypt_batch = cipher.decrypt_batch
+    monkeypatch.setattr(cipher, 'decrypt_batch',
+                        lambda values, column: decrypted.extend(values) or decrypt_batch(values, column))
+
+    assert storage.get_domain_totals(0, 5000) == {'a.com': 300, 'b.com': 60}
+    assert len(decrypted) == 3
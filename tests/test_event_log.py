@@ -0,0 +1,176 @@
+import pytest
+import time
+from backend.core.activity_tracker import PlatformType
+from backend.core import event_log
+from backend.core.browsers.chromium_tracker import ChromiumTracker
+from backend.core.event_log import (EVENT_TAB_ACTIVATED, EVENT_VISIBILITY, EventLogWriter,
+                                    read_events, read_header)
+from backend.core.replay import DAY, replay, split_days
+from backend.database.duration_sketches import DurationSketches
+from backend.database.sessions import SessionStitcher
+
+# Two days back, so the live tracker's idle timers never fire mid-test
+MIDNIGHT = time.time() // DAY * DAY - 2 * DAY
+
+@pytest.fixture
+def clock():
+    return [MIDNIGHT]
+
+@pytest.fixture
+def tracker(tmp_path, clock):
+    """A tracker writing an event log, on a clock the test controls"""
+    tracker = ChromiumTracker(platform_type=PlatformType.DESKTOP.value,
+                              db_path=str(tmp_path / "live.db"),
+                              event_log_path=str(tmp_path / "events.log"))
+    tracker._now = lambda: clock[0]
+    yield tracker
+    tracker.close()
+
+@pytest.fixture
+def storage(make_storage):
+    """An empty database to replay into"""
+    return make_storage("replayed.db")
+
+def tab(tab_id, url):
+    return {'url': url, 'tab_id': tab_id, 'window_id': 'w1'}
+
+def spans(rows, key='url'):
+    return sorted((row[key], row['start_time'], row['end_time']) for row in rows)
+
+def test_log_round_trip(tmp_path):
+    """Tests that events come back exactly as written"""
+    path = str(tmp_path / "events.log")
+    writer = EventLogWriter(path, 'ChromiumTracker', 'desktop')
+    writer.append(EVENT_TAB_ACTIVATED, 100.5, {'url': 'https://a.com/', 'tab_id': 't1', 'title': 'Ä'})
+    writer.append(EVENT_VISIBILITY, 200.0, {'url': '', 'tab_id': 't1'}, flag=False)
+    writer.close()
+
+    assert read_header(path) == {'tracker': 'ChromiumTracker', 'platform_type': 'desktop'}
+    events = list(read_events(path))
+    assert [(e.kind, e.flag, e.timestamp) for e in events] == [
+        (EVENT_TAB_ACTIVATED, False, 100.5), (EVENT_VISIBILITY, False, 200.0)]
+    assert events[0].tab_info == {'url': 'https://a.com/', 'tab_id': 't1', 'title': 'Ä'}
+
+def test_truncated_tail_ignored(tmp_path):
+    """Tests that a record cut short by a crash doesn't break reading"""
+    path = str(tmp_path / "events.log")
+    writer = EventLogWriter(path, 'ChromiumTracker', 'desktop')
+    for i in range(3):
+        writer.append(EVENT_TAB_ACTIVATED, float(i), tab(f't{i}', 'https://a.com/'))
+    writer.close()
+    with open(path, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 5)
+
+    assert len(list(read_events(path))) == 2
+
+def test_append_after_torn_record(tmp_path):
+    """Tests that reopening a log a crash cut mid-record drops the torn tail before appending"""
+    path = str(tmp_path / "events.log")
+    writer = EventLogWriter(path, 'ChromiumTracker', 'desktop')
+    for i in range(3):
+        writer.append(EVENT_TAB_ACTIVATED, float(i), tab(f't{i}', 'https://a.com/'))
+    writer.flush()
+    del writer  # never closed, like a crash
+    with open(path, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 5)
+
+    writer = EventLogWriter(path, 'ChromiumTracker', 'desktop')
+    writer.append(EVENT_TAB_ACTIVATED, 3.0, tab('t3', 'https://b.com/'))
+    writer.close()
+    assert [e.timestamp for e in read_events(path)] == [0.0, 1.0, 3.0]
+
+def test_reopen_closed_log_skips_scan(tmp_path, monkeypatch):
+    """Tests that a cleanly closed log is appended to without scanning its records"""
+    path = str(tmp_path / "events.log")
+    writer = EventLogWriter(path, 'ChromiumTracker', 'desktop')
+    writer.append(EVENT_TAB_ACTIVATED, 1.0, tab('t1', 'https://a.com/'))
+    writer.close()
+
+    def scan(f):
+        raise AssertionError("scanned a cleanly closed log")
+    monkeypatch.setattr(event_log, '_complete_length', scan)
+    writer = EventLogWriter(path, 'ChromiumTracker', 'desktop')
+    writer.append(EVENT_TAB_ACTIVATED, 2.0, tab('t1', 'https://b.com/'))
+    writer.close()
+    assert [e.timestamp for e in read_events(path)] == [1.0, 2.0]
+
+def test_large_event(tmp_path):
+    """Tests that tab_info over 64 KiB round-trips"""
+    path = str(tmp_path / "events.log")
+    big = dict(tab('t1', 'https://a.com/'), title='x' * 70000)
+    writer = EventLogWriter(path, 'ChromiumTracker', 'desktop')
+    writer.append(EVENT_TAB_ACTIVATED, 1.0, big)
+    writer.close()
+    assert [e.tab_info for e in read_events(path)] == [big]
+
+def test_nested_handlers_logged_once(tracker, clock):
+    """Tests that a visibility change that re-activates a tab is one event"""
+    tracker.handle_visibility_change(tab('t1', 'https://a.com/'), True)
+    tracker.close()
+
+    events = list(read_events(tracker.event_log_path))
+    assert [(e.kind, e.flag) for e in events] == [(EVENT_VISIBILITY, True)]
+
+def test_replay_matches_live_tracking(tracker, clock, storage):
+    """Tests that replaying the log re-derives what the tracker saved"""
+    steps = [
+        (60, 'handle_tab_activated', tab('t1', 'https://a.com/'), ()),
+        (300, 'handle_tab_activated', tab('t2', 'https://b.com/'), ()),
+        (420, 'handle_tab_updated', tab('t2', 'https://b.com/next'), ()),
+        (900, 'handle_window_focus', tab('t2', 'https://b.com/next'), (False,)),
+        (1500, 'handle_visibility_change', tab('t1', 'https://a.com/'), (True,)),
+        (2000, 'handle_visibility_change', tab('t1', 'https://a.com/'), (False,)),
+    ]
+    for offset, handler, tab_info, args in steps:
+        clock[0] = MIDNIGHT + offset
+        getattr(tracker, handler)(tab_info, *args)
+    live = tracker._get_storage().get_activities(MIDNIGHT, MIDNIGHT + DAY)
+    tracker.close()
+
+    assert replay(tracker.event_log_path, storage, workers=2) == len(live)
+    assert spans(storage.get_activities(MIDNIGHT, MIDNIGHT + DAY)) == spans(live)
+
+def test_replay_replaces_existing_day(tracker, clock, storage):
+    """Tests that replaying twice doesn't duplicate activities"""
+    for offset, tab_id in [(60, 't1'), (120, 't2'), (180, 't1')]:
+        clock[0] = MIDNIGHT + offset
+        tracker.handle_tab_activated(tab(tab_id, f'https://{tab_id}.com/'))
+    tracker.close()
+
+    first = replay(tracker.event_log_path, storage, workers=1)
+    second = replay(tracker.event_log_path, storage, workers=1)
+    assert first == second
+    assert len(storage.get_activities(MIDNIGHT, MIDNIGHT + DAY)) == first
+
+def test_replay_counts_derived_tables_once(tracker, clock, storage):
+    """Tests that replaying a day over itself leaves sessions and sketches counting it once"""
+    sessions = SessionStitcher(storage)
+    sketches = DurationSketches(storage)
+    for offset, tab_id in [(60, 't1'), (120, 't2'), (180, 't1')]:
+        clock[0] = MIDNIGHT + offset
+        tracker.handle_tab_activated(tab(tab_id, f'https://{tab_id}.com/'))
+    tracker.close()
+
+    saved = replay(tracker.event_log_path, storage, workers=1)
+    first = spans(sessions.get_sessions(MIDNIGHT, MIDNIGHT + DAY), 'domain')
+    replay(tracker.event_log_path, storage, workers=1)
+    assert spans(sessions.get_sessions(MIDNIGHT, MIDNIGHT + DAY), 'domain') == first
+    counts = sketches.get_percentiles(MIDNIGHT, MIDNIGHT + DAY)
+    assert sum(domain['count'] for domain in counts.values()) == saved
+
+def test_session_split_at_midnight(tracker, clock, storage):
+    """Tests that a tab in front over midnight gets its time on both days"""
+    clock[0] = MIDNIGHT + DAY - 600
+    tracker.handle_tab_activated(tab('t1', 'https://a.com/'))
+    clock[0] = MIDNIGHT + DAY + 600
+    tracker.handle_tab_activated(tab('t2', 'https://b.com/'))
+    tracker.close()
+
+    days = list(split_days(read_events(tracker.event_log_path)))
+    assert [carried for _, _, carried in days] == [[], [days[0][1][0].tab_info]]
+
+    replay(tracker.event_log_path, storage, workers=2)
+    a_spans = [s for s in spans(storage.get_activities(MIDNIGHT, MIDNIGHT + 3 * DAY))
+               if s[0] == 'https://a.com/']
+    assert a_spans == [('https://a.com/', MIDNIGHT + DAY - 600, MIDNIGHT + DAY),
+                       ('https://a.com/', MIDNIGHT + DAY, MIDNIGHT + DAY + 600)]
@@ -1,24 +1,17 @@
 import pytest
 from datetime import datetime
-import os
 from backend.core.browsers.gecko_tracker import GeckoTracker
 from backend.core.activity_tracker import BrowserType, PlatformType
 
 @pytest.fixture
-def desktop_tracker():
+def desktop_tracker(make_tracker):
     """Creates a desktop Firefox tracker"""
-    tracker = GeckoTracker(platform_type=PlatformType.DESKTOP.value, db_path="test_desktop.db")
-    yield tracker
-    if os.path.exists("test_desktop.db.state"):
-        os.remove("test_desktop.db.state")
+    return make_tracker(GeckoTracker, PlatformType.DESKTOP.value, BrowserType.GECKO_DESKTOP.value)
 
 @pytest.fixture
-def mobile_tracker():
+def mobile_tracker(make_tracker):
     """Creates a mobile Firefox tracker"""
-    tracker = GeckoTracker(platform_type=PlatformType.MOBILE.value, db_path="test_mobile.db")
-    yield tracker
-    if os.path.exists("test_mobile.db.state"):
-        os.remove("test_mobile.db.state")
+    return make_tracker(GeckoTracker, PlatformType.MOBILE.value, BrowserType.GECKO_MOBILE.value)
 
 @pytest.fixture
 def sample_tab():
@@ -0,0 +1,130 @@
+import pytest
+import sqlite3
+from backend.core.activity_tracker import BrowserType
+from backend.database.importers import (CHROMIUM_EPOCH_OFFSET, ChromiumHistoryImporter,
+                                        FirefoxHistoryImporter, import_history)
+
+BASE = 1_700_000_000
+
+@pytest.fixture
+def storage(make_storage):
+    return make_storage("imported.db")
+
+def chromium_time(seconds):
+    return int((seconds + CHROMIUM_EPOCH_OFFSET) * 1_000_000)
+
+@pytest.fixture
+def chromium_history(tmp_path):
+    """A cut-down Chromium History file"""
+    path = str(tmp_path / "History")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE urls (id INTEGER PRIMARY KEY, url LONGVARCHAR, title LONGVARCHAR);
+        CREATE TABLE visits (id INTEGER PRIMARY KEY, url INTEGER, visit_time INTEGER,
+                             transition INTEGER, visit_duration INTEGER);
+    """)
+    connection.executemany("INSERT INTO urls VALUES (?, ?, ?)", [
+        (1, 'https://www.example.com/a', 'A'),
+        (2, 'https://news.site/story', 'Story'),
+        (3, 'chrome://settings', 'Settings'),
+        (4, 'https://ads.example/frame', None),
+    ])
+    connection.executemany("INSERT INTO visits VALUES (?, ?, ?, ?, ?)", [
+        (1, 1, chromium_time(BASE), 1, 90_000_000),           # recorded 90s
+        (2, 2, chromium_time(BASE + 100), 0x30000001, 0),     # until the settings page
+        (3, 3, chromium_time(BASE + 400), 1, 0),              # not a web page
+        (4, 4, chromium_time(BASE + 150), 3, 0),              # subframe
+        (5, 1, chromium_time(BASE + 10_000), 1, 0),           # gap capped
+    ])
+    connection.commit()
+    connection.close()
+    return path
+
+@pytest.fixture
+def firefox_places(tmp_path):
+    """A cut-down Firefox places.sqlite"""
+    path = str(tmp_path / "places.sqlite")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE moz_places (id INTEGER PRIMARY KEY, url LONGVARCHAR, title LONGVARCHAR);
+        CREATE TABLE moz_historyvisits (id INTEGER PRIMARY KEY, place_id INTEGER,
+                                        visit_date INTEGER, visit_type INTEGER);
+    """)
+    connection.executemany("INSERT INTO moz_places VALUES (?, ?, ?)", [
+        (1, 'https://mozilla.org/', 'Mozilla'),
+        (2, 'https://example.com/file.zip', None),
+    ])
+    connection.executemany("INSERT INTO moz_historyvisits VALUES (?, ?, ?, ?)", [
+        (1, 1, BASE * 1_000_000, 1),
+        (2, 2, (BASE + 30) * 1_000_000, 7),       # download
+        (3, 1, (BASE + 60) * 1_000_000, 2),
+    ])
+    connection.commit()
+    connection.close()
+    return path
+
+def by_start(storage):
+    return sorted(storage.get_activities(0, BASE + 100_000), key=lambda a: a['start_time'])
+
+def test_chromium_import(storage, chromium_history):
+    """Tests that Chromium visits become activities with sensible durations"""
+    assert ChromiumHistoryImporter.matches(chromium_history)
+    assert import_history(storage, chromium_history) == 3
+
+    rows = by_start(storage)
+    assert [(r['url'], r['start_time'], r['duration']) for r in rows] == [
+        ('https://www.example.com/a', BASE, 90),
+        ('https://news.site/story', BASE + 100, 300),
+        ('https://www.example.com/a', BASE + 10_000, 0),
+    ]
+    assert all(r['engine_type'] == BrowserType.CHROMIUM_DESKTOP.value for r in rows)
+    # Lookups by domain work on imported rows too
+    assert len(storage.get_activities_for_domain('example.com', 0, BASE + 100_000)) == 2
+
+def test_gap_capped(storage, chromium_history):
+    """Tests that time until the next visit counts for at most max_gap"""
+    ChromiumHistoryImporter(storage, max_gap=30).import_file(chromium_history)
+    assert [r['duration'] for r in by_start(storage)] == [30, 30, 0]
+
+def test_firefox_import(storage, firefox_places):
+    assert FirefoxHistoryImporter.matches(firefox_places)
+    assert not ChromiumHistoryImporter.matches(firefox_places)
+    assert import_history(storage, firefox_places) == 2
+
+    rows = by_start(storage)
+    assert [(r['url'], r['start_time'], r['duration']) for r in rows] == [
+        ('https://mozilla.org/', BASE, 60), ('https://mozilla.org/', BASE + 60, 0)]
+    assert rows[0]['engine_type'] == BrowserType.GECKO_DESKTOP.value
+
+def test_reimport_adds_nothing(storage, firefox_places):
+    """Tests that importing the same file twice doesn't duplicate visits"""
+    import_history(storage, firefox_places)
+    assert import_history(storage, firefox_places) == 0
+    assert len(by_start(storage)) == 2
+
+def test_reimport_before_dedupe_migration(storage, firefox_places):
+    """Tests that a re-import doesn't duplicate visits while the natural-key index is missing"""
+    storage.connection.execute("DROP INDEX idx_natural_key")
+    storage._natural_key_ready = False
+    assert import_history(storage, firefox_places) == 2
+    assert import_history(storage, firefox_places) == 0
+    assert len(by_start(storage)) == 2
+
+def test_since(storage, chromium_history):
+    assert import_history(storage, chromium_history, since=BASE + 50) == 2
+
+def test_unknown_file(storage, tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("hello")
+    assert import_history(storage, str(path)) == 0
+
+def test_encrypted_import(make_storage, firefox_places):
+    """Tests that imported URLs are encrypted like tracked ones"""
+    pytest.importorskip("cryptography")
+    from backend.database.encryption import ActivityCipher
+    storage = make_storage("enc.db", engine_type=BrowserType.GECKO_DESKTOP.value,
+                           cipher=ActivityCipher(ActivityCipher.generate_key()))
+    import_history(storage, firefox_places)
+    raw = [row[0] for row in storage.connection.execute("SELECT url FROM activities")]
+    assert all(isinstance(value, bytes) for value in raw)
+    assert {r['url'] for r in by_start(storage)} == {'https://mozilla.org/'}
@@ -0,0 +1,188 @@
+import pytest
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from backend.core.activity_tracker import ActivityTracker, BrowserType, PlatformType
+from backend.database.ingestion_queue import BLOCK, COALESCE, DROP_OLDEST, IngestionQueue
+from backend.database.memory_backend import MemoryBackend
+
+PLATFORM = PlatformType.DESKTOP.value
+ENGINE = BrowserType.CHROMIUM_DESKTOP.value
+
+
+class StalledBackend(MemoryBackend):
+    """A memory backend whose writes wait until the test lets them through"""
+
+    def __init__(self):
+        super().__init__(PLATFORM, ENGINE)
+        self.gate = threading.Event()
+
+    @contextmanager
+    def transaction(self):
+        self.gate.wait()
+        with super().transaction():
+            yield self
+
+
+class BrokenBackend(MemoryBackend):
+    @contextmanager
+    def transaction(self):
+        raise RuntimeError("disk on fire")
+        yield
+
+
+class PoisonBackend(MemoryBackend):
+    """Refuses one tab's session, however often it's tried"""
+
+    def open_session(self, tab_id, session, tab_info, last_active=True):
+        if tab_id == 'bad':
+            raise ValueError("unstorable session")
+        super().open_session(tab_id, session, tab_info, last_active)
+
+
+@pytest.fixture
+def nth_activity(make_activity):
+    """The i-th of a run of half minute news visits, a minute apart, each on its own tab"""
+    def nth(i, tab_id=None):
+        return make_activity(1_700_000_000.0 + i * 60, duration=30, url='https://news.site/story',
+                             tab_id=tab_id or f'tab{i}')
+    return nth
+
+def reconciles(stats):
+    assert stats['enqueued'] == stats['written'] + stats['coalesced'] + stats['dropped'] + stats['pending']
+    assert stats['enqueued_seconds'] == pytest.approx(
+        stats['written_seconds'] + stats['dropped_seconds'] + stats['pending_seconds'])
+    return True
+
+def test_tracker_writes_through_queue(make_storage):
+    """Tests that a tracker on a queue ends up with the same data, once flushed"""
+    storage = make_storage("queued.db")
+    queue = IngestionQueue(storage)
+    tracker = ActivityTracker(storage=queue)
+    try:
+        for i in range(20):
+            assert tracker.track_tab_change({'url': f'https://site{i}.com/', 'tab_id': f'tab{i % 4}',
+                                             'browser_type': ENGINE, 'window_id': 'w1'})
+        assert queue.flush(5)
+        assert len(storage.get_activities(0, datetime.now().timestamp() + 60)) == 19
+        active_tabs, front_tabs = storage.load_open_sessions()
+        assert list(active_tabs) == ['tab3'] and front_tabs[0]['url'] == 'https://site19.com/'
+        assert reconciles(queue.stats())
+    finally:
+        queue.close()
+
+def test_drop_oldest_keeps_accounts(nth_activity):
+    """Tests that shed activities are counted and their time recorded, and sessions stay right"""
+    storage = StalledBackend()
+    queue = IngestionQueue(storage, max_items=10, policy=DROP_OLDEST)
+    try:
+        queue.open_session('tab0', {'start_time': 0}, {'tab_id': 'tab0'})
+        for i in range(30):
+            queue.save_activity(nth_activity(i))
+        queue.close_session('tab0', nth_activity(99, tab_id='tab0'))
+        stats = queue.stats()
+        assert stats['dropped'] > 0 and stats['depth'] <= 10
+        assert stats['high_water'] == 10
+        assert reconciles(stats)
+
+        storage.gate.set()
+        assert queue.flush(5)
+        stats = queue.stats()
+        assert reconciles(stats) and stats['pending'] == 0
+        assert len(storage) == stats['written']
+        # Dropped time is on the books, and tab0's session was still closed
+        assert sum(storage.get_dropped_totals(0, 2e9).values()) == stats['dropped_seconds']
+        assert storage.load_open_sessions() == ({}, [])
+    finally:
+        storage.gate.set()
+        queue.close()
+
+def test_coalesce_merges_per_tab(nth_activity):
+    """Tests that compaction merges back-to-back activities on a tab without losing time"""
+    storage = StalledBackend()
+    queue = IngestionQueue(storage, max_items=8, policy=COALESCE)
+    try:
+        for i in range(20):
+            with queue.transaction():
+                queue.close_session('tab1', nth_activity(i, tab_id='tab1'))
+                queue.open_session('tab1', {'start_time': i}, {'tab_id': 'tab1'})
+        stats = queue.stats()
+        assert stats['coalesced'] > 0 and stats['dropped'] == 0
+        assert reconciles(stats)
+
+        storage.gate.set()
+        assert queue.flush(5)
+        assert storage.get_domain_totals(0, 2e9) == {'news.site': 20 * 30}
+        active_tabs, _ = storage.load_open_sessions()
+        assert active_tabs == {'tab1': {'start_time': 19}}
+    finally:
+        storage.gate.set()
+        queue.close()
+
+def test_block_waits_then_sheds(nth_activity):
+    storage = StalledBackend()
+    queue = IngestionQueue(storage, max_items=5, policy=BLOCK, block_timeout=0.05)
+    try:
+        for i in range(8):
+            queue.save_activity(nth_activity(i))
+        stats = queue.stats()
+        assert stats['blocked'] >= 3 and stats['blocked_seconds'] >= 0.15
+        assert stats['dropped'] > 0
+        assert reconciles(stats)
+
+        storage.gate.set()
+        assert queue.flush(5)
+        stats = queue.stats()
+        assert stats['written'] + stats['dropped'] == 8
+    finally:
+        storage.gate.set()
+        queue.close()
+
+def test_block_resumes_when_writer_catches_up(nth_activity):
+    """Tests that a blocked producer carries on, losing nothing, once there's room"""
+    storage = StalledBackend()
+    queue = IngestionQueue(storage, max_items=5, batch_size=5)
+    threading.Timer(0.1, storage.gate.set).start()
+    try:
+        for i in range(20):
+            queue.save_activity(nth_activity(i))
+        assert queue.flush(5)
+        stats = queue.stats()
+        assert stats['blocked'] > 0 and stats['dropped'] == 0
+        assert stats['written'] == len(storage) == 20
+    finally:
+        queue.close()
+
+def test_failed_batches_are_accounted(nth_activity):
+    storage = BrokenBackend(PLATFORM, ENGINE)
+    queue = IngestionQueue(storage, max_retries=1, retry_delay=0)
+    queue.save_activity(nth_activity(1))
+    queue.close()
+    stats = queue.stats()
+    assert stats['write_errors'] >= 2 and stats['dropped'] == 1
+    assert reconciles(stats)
+    # Nothing gets queued after close
+    assert queue.save_activity(nth_activity(2)) is False
+
+def test_poison_session_change_dropped(nth_activity):
+    """Tests that a session change the storage always refuses is dropped, not retried ahead of every batch"""
+    storage = PoisonBackend(PLATFORM, ENGINE)
+    queue = IngestionQueue(storage, max_retries=1, retry_delay=0)
+    try:
+        queue.open_session('bad', {'start_time': 1.0}, {'tab_id': 'bad', 'window_id': 'w1'})
+        assert queue.flush(5)
+        queue.save_activity(nth_activity(1))
+        queue.open_session('good', {'start_time': 2.0}, {'tab_id': 'good', 'window_id': 'w1'})
+        assert queue.flush(5)
+        stats = queue.stats()
+        assert stats['poisoned'] == 1 and stats['written'] == len(storage) == 1
+        assert reconciles(stats)
+        assert list(storage.load_open_sessions()[0]) == ['good']
+    finally:
+        queue.close()
+
+def test_dropped_totals_in_sqlite(storage):
+    storage.record_dropped({(3600.0, 'news.site'): [30.0, 1], (7200.0, 'video.site'): [60.0, 2]})
+    storage.record_dropped({(3600.0, 'news.site'): [15.0, 1]})
+    assert storage.get_dropped_totals(0, 7200) == {'news.site': 45.0}
+    assert storage.get_dropped_totals(0, 10800) == {'news.site': 45.0, 'video.site': 60.0}
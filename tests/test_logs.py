@@ -0,0 +1,59 @@
+import io
+import logging
+import threading
+from backend.utils.logs import RepeatFilter, start_queue_logging, stop_queue_logging
+
+
+class ThreadRecordingHandler(logging.StreamHandler):
+    """Remembers which threads it wrote from"""
+
+    def __init__(self):
+        super().__init__(io.StringIO())
+        self.threads = set()
+
+    def emit(self, record):
+        self.threads.add(threading.current_thread().name)
+        super().emit(record)
+
+def test_repeats_suppressed_and_counted():
+    clock = [0.0]
+    logger = logging.getLogger('test_logs.repeats')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    repeat_filter = RepeatFilter(window=60, clock=lambda: clock[0])
+    handler = ThreadRecordingHandler()
+    handler.addFilter(repeat_filter)
+    logger.addHandler(handler)
+    try:
+        for _ in range(100):
+            logger.error("Couldn't save state: %s", OSError("read-only"))
+        logger.info("Info isn't filtered")
+        logger.info("Info isn't filtered")
+        clock[0] = 61
+        logger.error("Couldn't save state: %s", OSError("read-only"))
+        logger.error("Something else")
+        logger.error("Something else")
+        repeat_filter.flush()
+    finally:
+        logger.removeHandler(handler)
+
+    lines = handler.stream.getvalue().splitlines()
+    assert lines == ["Couldn't save state: read-only",
+                     "Info isn't filtered", "Info isn't filtered",
+                     "Couldn't save state: read-only (repeated 99 more times)",
+                     "Something else",
+                     "Something else (repeated 1 more times)"]
+    assert repeat_filter.suppressed == 100
+
+def test_writes_happen_on_listener_thread():
+    logger = logging.getLogger('test_logs.queue')
+    logger.propagate = False
+    target = ThreadRecordingHandler()
+    handler, listener = start_queue_logging(logger, [target])
+    for i in range(50):
+        logger.warning("event %s", i)
+    stop_queue_logging(logger, handler, listener)
+
+    assert threading.current_thread().name not in target.threads
+    assert target.stream.getvalue().splitlines() == [f"event {i}" for i in range(50)]
+    assert handler not in logger.handlers
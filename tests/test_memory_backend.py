@@ -0,0 +1,101 @@
+import pytest
+from datetime import datetime, timedelta
+from backend.core.activity_tracker import ActivityTracker, BrowserType, PlatformType
+from backend.database.memory_backend import MemoryBackend
+from backend.database.storage_backend import StorageBackend
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def backend(request, make_storage):
+    """Every backend should pass the same tests"""
+    if request.param == 'sqlite':
+        return make_storage("backend.db")
+    backend = MemoryBackend(PlatformType.DESKTOP.value, BrowserType.CHROMIUM_DESKTOP.value)
+    request.addfinalizer(backend.close)
+    return backend
+
+def test_range_scan(backend, make_activity):
+    """Tests that a range returns what's inside it, newest first"""
+    backend.save_activities([make_activity(t) for t in (3000, 1000, 2000, 5000)])
+    assert [a['start_time'] for a in backend.get_activities(900, 3100)] == [3000, 2000, 1000]
+    # Must have ended inside the range too
+    assert backend.get_activities(900, 1030) == []
+
+def test_rows_look_the_same(backend, make_activity):
+    """Tests that rows have the same shape whatever the backend"""
+    backend.save_activity(dict(make_activity(1000), title='Example'))
+    row = backend.get_activities(0, 5000)[0]
+    assert set(row) == {'id', 'url', 'title', 'start_time', 'end_time', 'duration',
+                        'platform_type', 'engine_type', 'is_active', 'created_at'}
+    assert row['title'] == 'Example' and row['engine_type'] == BrowserType.CHROMIUM_DESKTOP.value
+
+def test_upsert_on_natural_key(backend, make_activity):
+    """Tests that a resend only ever extends an activity"""
+    backend.save_activity(make_activity(1000))
+    backend.save_activity(make_activity(1000, end=1200))
+    backend.save_activity(make_activity(1000, end=1100))
+    rows = backend.get_activities(0, 5000)
+    assert len(rows) == 1 and rows[0]['end_time'] == 1200
+
+def test_domain_totals(backend, make_activity):
+    backend.save_activities([make_activity(1000, url='https://a.com/1'),
+                             make_activity(1100, url='https://www.a.com/2'),
+                             make_activity(1200, url='https://b.com/', end=1230)])
+    assert backend.get_domain_totals(0, 5000) == {'a.com': 120, 'b.com': 30}
+
+def test_retention(backend, make_activity):
+    """Tests that cleanup drops only what's past the retention window"""
+    now = datetime.now().timestamp()
+    old = (datetime.now() - timedelta(days=40)).timestamp()
+    backend.save_activities([make_activity(old), make_activity(now)])
+    backend.cleanup_old_data()
+    assert [a['start_time'] for a in backend.get_activities(0, now + 100)] == [now]
+
+def test_transaction_rolls_back(backend, make_activity):
+    """Tests that a failure undoes every write in the transaction"""
+    backend.save_activity(make_activity(1000))
+    with pytest.raises(RuntimeError):
+        with backend.transaction():
+            backend.save_activity(make_activity(2000))
+            backend.delete_activities(0, 1500)
+            backend.open_session('tab9', {'start_time': 3000}, {'tab_id': 'tab9'})
+            raise RuntimeError("boom")
+    assert [a['start_time'] for a in backend.get_activities(0, 5000)] == [1000]
+    assert backend.load_open_sessions() == ({}, [])
+
+def test_open_sessions(backend, make_activity):
+    """Tests the tracker's open session bookkeeping"""
+    backend.open_session('tab1', {'start_time': 1000}, {'tab_id': 'tab1'})
+    backend.open_session('tab2', {'start_time': 1100}, {'tab_id': 'tab2'})
+    active_tabs, front_tabs = backend.load_open_sessions()
+    assert set(active_tabs) == {'tab1', 'tab2'} and front_tabs == [{'tab_id': 'tab2'}]
+
+    # Each window keeps its own front tab
+    backend.open_session('tab3', {'start_time': 1200}, {'tab_id': 'tab3', 'window_id': 'w2'})
+    _, front_tabs = backend.load_open_sessions()
+    assert front_tabs == [{'tab_id': 'tab2'}, {'tab_id': 'tab3', 'window_id': 'w2'}]
+
+    backend.close_session('tab1', make_activity(1000))
+    active_tabs, _ = backend.load_open_sessions()
+    assert set(active_tabs) == {'tab2', 'tab3'}
+    assert len(backend.get_activities(0, 5000)) == 1
+
+def test_tracker_on_injected_backend(backend):
+    """Tests that a tracker works on whatever storage it's given"""
+    tracker = ActivityTracker(storage=backend)
+    for tab_id in ('tab1', 'tab2', 'tab1'):
+        assert tracker.track_tab_change({'url': f'https://{tab_id}.com/', 'tab_id': tab_id,
+                                         'browser_type': BrowserType.CHROMIUM_DESKTOP.value,
+                                         'window_id': 'w1'})
+    tracker.close()
+    assert len(backend.get_activities(0, datetime.now().timestamp() + 60)) == 2
+    # The caller still owns it
+    assert tracker.storage is backend
+
+def test_incomplete_backend_rejected():
+    """Tests that a backend missing part of the interface fails when it's created"""
+    class ReadOnlyBackend(StorageBackend):
+        def get_activities(self, start_time, end_time):
+            return []
+
+    with pytest.raises(TypeError):
+        ReadOnlyBackend(PlatformType.DESKTOP.value, BrowserType.CHROMIUM_DESKTOP.value)
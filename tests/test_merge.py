@@ -0,0 +1,71 @@
+import pytest
+from backend.core.activity_tracker import BrowserType, PlatformType
+from backend.database.encryption import ActivityCipher
+from backend.database.merge import ActivitySource, merge_activities, merge_databases
+
+@pytest.fixture
+def make_db(make_storage, tmp_path):
+    """Writes a device's database and gives its path"""
+    def make(name, activities, platform=PlatformType.DESKTOP, engine=BrowserType.CHROMIUM_DESKTOP,
+             cipher=None):
+        storage = make_storage(name, platform.value, engine.value, cipher=cipher)
+        storage.save_activities(activities)
+        storage.close()
+        return str(tmp_path / name)
+    return make
+
+def spans(activities):
+    return [(a['device_id'], a['start_time'], a['end_time']) for a in activities]
+
+def test_last_focus_wins(make_activity):
+    """Tests that a later start on another device takes the overlap, and the interrupted one resumes"""
+    laptop = [make_activity(0, 100, device_id='laptop'),
+              make_activity(100, 200, tab_id='t2', device_id='laptop')]
+    phone = [make_activity(50, 70, device_id='phone'), make_activity(190, 250, device_id='phone')]
+    stats = {}
+    merged = sorted(merge_activities([laptop, phone], stats), key=lambda a: a['start_time'])
+    assert spans(merged) == [('laptop', 0, 50), ('phone', 50, 70), ('laptop', 70, 100),
+                             ('laptop', 100, 190), ('phone', 190, 250)]
+    assert stats == {'trimmed': 2, 'resumed': 1}
+    assert sum(a['duration'] for a in merged) == 250
+
+    # The same device's overlapping windows are left alone
+    windows = [make_activity(0, 100, device_id='laptop'),
+               make_activity(10, 60, tab_id='t2', device_id='laptop')]
+    assert spans(merge_activities([windows])) == [('laptop', 0, 100), ('laptop', 10, 60)]
+
+def test_merge_databases(make_db, make_storage, make_activity):
+    laptop = make_db("laptop.db", [make_activity(i * 60, i * 60 + 50) for i in range(50)])
+    phone = make_db("phone.db",
+                    [make_activity(i * 600 + 10, i * 600 + 20, url='https://news.com/') for i in range(5)],
+                    platform=PlatformType.MOBILE, engine=BrowserType.WEBKIT_MOBILE)
+    storage = make_storage("all.db")
+    sources = [ActivitySource(laptop, batch_size=7), ActivitySource(phone, batch_size=7)]
+    stats = {}
+    assert merge_databases(sources, storage, batch_size=16, stats=stats) == 60
+    assert stats['read'] == 55 and stats['trimmed'] == 5 and stats['resumed'] == 5
+    rows = storage.get_activities(0, 1e6)
+    assert {row['engine_type'] for row in rows} == {BrowserType.CHROMIUM_DESKTOP.value,
+                                                    BrowserType.WEBKIT_MOBILE.value}
+    # Every phone visit was in the middle of a laptop one, so the total is the laptop's
+    assert sum(row['duration'] for row in rows) == 50 * 50
+
+    # Running it again doesn't add anything
+    merge_databases([ActivitySource(laptop), ActivitySource(phone)], storage)
+    assert len(storage.get_activities(0, 1e6)) == 60
+
+    with pytest.raises(ValueError):
+        merge_databases([ActivitySource(laptop), ActivitySource(laptop)], storage)
+
+def test_encrypted_source(make_db, make_activity):
+    cipher = ActivityCipher(ActivityCipher.generate_key())
+    path = make_db("secret.db", [make_activity(0, 10)], cipher=cipher)
+    with pytest.raises(ValueError):
+        list(ActivitySource(path))
+    assert [a['url'] for a in ActivitySource(path, cipher=cipher)] == ['https://example.com/']
+
+    # Encrypted rows after plain ones in the same batch are caught too
+    mixed = make_db("mixed.db", [make_activity(0, 10)])
+    make_db("mixed.db", [make_activity(20, 30)], cipher=cipher)
+    with pytest.raises(ValueError):
+        list(ActivitySource(mixed))
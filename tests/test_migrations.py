@@ -0,0 +1,104 @@
+import pytest
+import sqlite3
+from backend.database.migrations import MigrationRunner, column_names
+
+LEGACY_SCHEMA = """
+    CREATE TABLE activities (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        url TEXT NOT NULL,
+        start_time REAL NOT NULL,
+        end_time REAL NOT NULL,
+        duration REAL NOT NULL,
+        platform_type TEXT NOT NULL,
+        engine_type TEXT NOT NULL,
+        is_active BOOLEAN NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """A database written by the old schema, with no migration table"""
+    path = tmp_path / "legacy.db"
+    connection = sqlite3.connect(path)
+    connection.execute(LEGACY_SCHEMA)
+    connection.executemany(
+        "INSERT INTO activities (url, start_time, end_time, duration, platform_type, engine_type) "
+        "VALUES (?, ?, ?, 60, 'desktop', 'chromium_desktop')",
+        [(f'https://site{i % 7}.com/{i}', 1000.0 + i, 1060.0 + i) for i in range(95)]
+    )
+    connection.commit()
+    connection.close()
+    return str(path)
+
+def unhashed(storage):
+    return storage.connection.execute(
+        "SELECT COUNT(*) FROM activities WHERE url_hash IS NULL"
+    ).fetchone()[0]
+
+def test_fresh_database_is_fully_migrated(make_storage):
+    """Tests that a brand new database finishes every migration on open"""
+    storage = make_storage("fresh.db")
+    assert not storage.migrations.running
+    assert storage.migrations.pending(storage.connection) == []
+    assert 'url_hash' in column_names(storage.connection, 'activities')
+
+def test_background_backfill_completes(make_storage, legacy_db):
+    """Tests that a big legacy database gets backfilled in the background"""
+    storage = make_storage("legacy.db", migration_batch_size=10)
+    # Ingestion keeps working while the backfill runs
+    assert storage.save_activity({
+        'url': 'https://new.com', 'start_time': 5000.0, 'end_time': 5060.0,
+        'duration': 60, 'is_active': False
+    })
+    storage.migrations._thread.join(10)
+    assert unhashed(storage) == 0
+    assert storage.migrations.pending(storage.connection) == []
+    assert len(storage.get_activities_for_domain('site3.com', 0, 10000)) > 0
+
+def test_interrupted_backfill_resumes(storage, legacy_db):
+    """Tests that progress is recorded per batch and picked up again"""
+    connection = sqlite3.connect(legacy_db)
+    runner = MigrationRunner(storage, batch_size=10)
+    runner.apply_schema(connection)
+    assert runner.run_backfills(connection, max_batches=3) is False
+
+    (last_key,) = connection.execute(
+        "SELECT last_key FROM schema_migrations WHERE version = 1"
+    ).fetchone()
+    assert last_key == 30
+
+    # A fresh runner carries on from the recorded key
+    assert MigrationRunner(storage, batch_size=10).run_backfills(connection) is True
+    assert connection.execute(
+        "SELECT COUNT(*) FROM activities WHERE url_hash IS NULL"
+    ).fetchone()[0] == 0
+    connection.close()
+
+def test_indexes_created_after_backfill(make_storage, legacy_db):
+    """Tests that finalize steps only run once the data is in place"""
+    storage = make_storage("legacy.db", migration_batch_size=1000)
+    if storage.migrations.running:
+        storage.migrations._thread.join(10)
+    indexes = {
+        row[0] for row in storage.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )
+    }
+    assert {'idx_domain_hash', 'idx_url_hash'} <= indexes
+
+def test_duplicates_removed_before_unique_index(make_storage, legacy_db):
+    """Tests that existing duplicate rows are collapsed by the natural key migration"""
+    connection = sqlite3.connect(legacy_db)
+    connection.execute(
+        "INSERT INTO activities (url, start_time, end_time, duration, platform_type, engine_type) "
+        "SELECT url, start_time, end_time, duration, platform_type, engine_type FROM activities WHERE id <= 20"
+    )
+    connection.commit()
+    connection.close()
+
+    storage = make_storage("legacy.db", migration_batch_size=25)
+    if storage.migrations.running:
+        storage.migrations._thread.join(10)
+    assert storage.connection.execute("SELECT COUNT(*) FROM activities").fetchone()[0] == 95
+    assert storage._has_natural_key()
@@ -0,0 +1,87 @@
+import pytest
+import os
+import pstats
+import signal
+import threading
+import time
+from backend.core.activity_tracker import PlatformType
+from backend.core.browsers.chromium_tracker import ChromiumTracker
+from backend.utils import profiling
+
+@pytest.fixture
+def tracker(tmp_path):
+    tracker = ChromiumTracker(platform_type=PlatformType.DESKTOP.value,
+                              db_path=str(tmp_path / "profiled.db"))
+    yield tracker
+    tracker.close()
+
+@pytest.fixture(autouse=True)
+def profiling_off():
+    yield
+    profiling.disable_profiling()
+
+def switch_tabs(tracker, count=50):
+    for i in range(count):
+        tracker.handle_tab_activated({'url': f'https://site{i % 5}.com/', 'tab_id': f'tab{i % 7}',
+                                      'window_id': 'w1'})
+
+def test_off_by_default(tracker):
+    """Tests that the hooks don't record anything unless profiling is on"""
+    assert not profiling.profiling_enabled()
+    switch_tabs(tracker, 3)
+    assert profiling.disable_profiling() is None
+
+def test_profile_written(tracker, tmp_path):
+    """Tests that a profiling run writes stats, stacks and a summary"""
+    out = tmp_path / "profiles"
+    assert profiling.enable_profiling(str(out), sample_interval=0.0005)
+    switch_tabs(tracker, 200)
+    tracker._get_storage().get_activities(0, 1e12)
+    prefix = profiling.disable_profiling()
+
+    stats = pstats.Stats(f"{prefix}.pstats")
+    assert any(func[2] == 'track_tab_change' for func in stats.stats)
+
+    with open(f"{prefix}.summary.txt") as f:
+        summary = f.read()
+    assert "ActivityTracker.track_tab_change 200 " in summary
+    assert "ActivityTracker._save_state 200 " in summary
+    assert "StorageManager.get_activities 1 " in summary
+    assert "Top allocations" in summary
+
+    with open(f"{prefix}.collapsed") as f:
+        lines = f.read().splitlines()
+    # "frame;frame;frame count", rooted above the hook
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert any('track_tab_change' in line for line in lines)
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'), reason="no SIGUSR1 on this platform")
+def test_signal_toggles(tmp_path, monkeypatch):
+    """Tests that the signal turns profiling on and then off again, off the handler's thread"""
+    monkeypatch.setenv('TRACKER_PROFILE_DIR', str(tmp_path))
+    previous = signal.getsignal(signal.SIGUSR1)
+    toggled_on = []
+    real_toggle = profiling.toggle_profiling
+
+    def toggle(*args):
+        toggled_on.append(threading.current_thread())
+        real_toggle(*args)
+    monkeypatch.setattr(profiling, 'toggle_profiling', toggle)
+    try:
+        assert profiling.install_signal_handler()
+        os.kill(os.getpid(), signal.SIGUSR1)
+        assert wait_for(profiling.profiling_enabled)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        assert wait_for(lambda: not profiling.profiling_enabled())
+        assert wait_for(lambda: any(name.endswith('.summary.txt') for name in os.listdir(tmp_path)))
+        assert toggled_on and threading.main_thread() not in toggled_on
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
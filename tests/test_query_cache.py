@@ -0,0 +1,115 @@
+import pytest
+import threading
+from datetime import datetime, timedelta
+from backend.database.query_cache import QueryCache
+
+DAY = 86400
+
+@pytest.fixture
+def storage(make_storage):
+    """Creates a test database with a result cache"""
+    return make_storage("cached.db", cache_bytes=1024 * 1024)
+
+def test_repeated_query_served_from_cache(storage, make_activity):
+    """Tests that the second identical query doesn't hit the database"""
+    now = datetime.now().timestamp()
+    storage.save_activity(make_activity(now))
+
+    first = storage.get_activities(now - DAY, now + DAY)
+    second = storage.get_activities(now - DAY, now + DAY)
+    assert first == second
+    assert storage.cache.hits == 1 and storage.cache.misses == 1
+
+def test_write_invalidates_touched_range(storage, make_activity):
+    """Tests that saving into a cached range refreshes it"""
+    now = datetime.now().timestamp()
+    storage.get_activities(now - DAY, now + DAY)
+    storage.save_activity(make_activity(now))
+
+    assert len(storage.get_activities(now - DAY, now + DAY)) == 1
+
+def test_write_keeps_unrelated_ranges(storage, make_activity):
+    """Tests that writes only drop entries whose buckets they touch"""
+    now = datetime.now().timestamp()
+    last_week = now - 7 * DAY
+    storage.get_activities(last_week - 3600, last_week + 3600)
+    storage.save_activity(make_activity(now))
+
+    storage.get_activities(last_week - 3600, last_week + 3600)
+    assert storage.cache.hits == 1
+
+def test_cleanup_invalidates_old_ranges(storage, make_activity):
+    """Tests that retention deletes drop cached results that reached back that far"""
+    old = (datetime.now() - timedelta(days=40)).timestamp()
+    storage.save_activity(make_activity(old))
+    assert len(storage.get_activities(0, datetime.now().timestamp())) == 1
+
+    storage.cleanup_old_data()
+    assert storage.get_activities(0, datetime.now().timestamp()) == []
+
+def test_domain_totals_cached(storage, make_activity):
+    """Tests the cached domain aggregate"""
+    now = datetime.now().timestamp()
+    storage.save_activities([
+        make_activity(now, url='https://a.com/1'),
+        make_activity(now + 100, url='https://www.a.com/2'),
+        make_activity(now + 200, url='https://b.com/'),
+    ])
+    totals = storage.get_domain_totals(now - 10, now + 1000)
+    assert totals == {'a.com': 120, 'b.com': 60}
+    assert storage.get_domain_totals(now - 10, now + 1000) == totals
+    assert storage.cache.hits == 1
+
+def test_now_ended_queries_hit(storage, make_activity):
+    """Tests that "today so far", asked again as time moves on, is served from the cache"""
+    today = datetime.now().timestamp()
+    day_start = today - today % DAY
+    now = day_start + DAY / 2
+    storage.save_activities([make_activity(now - 500), make_activity(now - 50)])
+    assert len(storage.get_activities(day_start, now)) == 1
+    assert len(storage.get_activities(day_start, now + 15)) == 2
+    assert len(storage.get_activities(day_start + 1, now + 30)) == 2
+    assert storage.cache.hits == 2 and storage.cache.misses == 1
+
+def test_cached_results_are_copies(storage, make_activity):
+    """Tests that callers can't corrupt the cache by mutating results"""
+    now = datetime.now().timestamp()
+    storage.save_activity(make_activity(now))
+    storage.get_activities(now - 10, now + 100)[0]['url'] = 'changed'
+    assert storage.get_activities(now - 10, now + 100)[0]['url'] == 'https://example.com/'
+
+def test_invalidated_under_the_lock(storage, make_activity, monkeypatch):
+    """Tests that writes drop cached results before readers can get at the cache again"""
+    held = []
+
+    def try_lock():
+        if storage._lock.acquire(blocking=False):
+            storage._lock.release()
+            held.append(False)
+        else:
+            held.append(True)
+
+    def lock_held(*args):
+        # Another thread has to be kept out of the cache until the drop is done
+        checker = threading.Thread(target=try_lock)
+        checker.start()
+        checker.join()
+
+    now = datetime.now().timestamp()
+    monkeypatch.setattr(storage.cache, 'invalidate_spans', lock_held)
+    monkeypatch.setattr(storage.cache, 'invalidate_before', lock_held)
+    storage.save_activity(make_activity(now))
+    storage.delete_activities(now - 10, now + 10)
+    storage.cleanup_old_data()
+    assert held == [True, True, True]
+
+def test_lru_eviction_by_size():
+    """Tests that the memory bound evicts the least recently used entries"""
+    cache = QueryCache(max_bytes=4000)
+    rows = [{'url': 'x' * 200}] * 3
+    for i in range(5):
+        cache.get_or_compute('q', i * DAY, i * DAY + 10, lambda: rows)
+    assert cache.current_bytes <= 4000
+    assert cache.evictions > 0
+    # The newest entry survives
+    cache.get_or_compute('q', 4 * DAY, 4 * DAY + 10, lambda: pytest.fail("should be cached"))
@@ -0,0 +1,128 @@
+import pytest
+import time
+from datetime import date, datetime
+from backend.core.activity_tracker import BrowserType
+from backend.database.encryption import ActivityCipher
+from backend.database.reports import UsageRollups, build_report, period_bounds
+
+DAY = date(2024, 3, 13)  # a Wednesday
+START = datetime(2024, 3, 11).timestamp()
+
+@pytest.fixture
+def storage(make_storage):
+    """Keeps every row (no downsampling), all of it in the hot window"""
+    storage = make_storage(downsample=False)
+    storage._hot_window_start = lambda: 0
+    return storage
+
+@pytest.fixture
+def make_activities(make_activity):
+    """Half-hourly visits to five sites from START, alternating browsers"""
+    engines = [BrowserType.CHROMIUM_DESKTOP.value, BrowserType.GECKO_DESKTOP.value]
+
+    def make(first, count):
+        return [make_activity(START + i * 1800, START + i * 1800 + 60 + i % 7,
+                              url=f'https://site{i % 5}.com/page{i}', tab_id=f't{i % 3}',
+                              engine_type=engines[i % 2])
+                for i in range(first, first + count)]
+    return make
+
+def test_period_bounds():
+    assert period_bounds('week', DAY) == (START, datetime(2024, 3, 18).timestamp())
+    assert period_bounds('month', DAY) == (datetime(2024, 3, 1).timestamp(), datetime(2024, 4, 1).timestamp())
+    assert period_bounds('year', DAY)[1] == datetime(2025, 1, 1).timestamp()
+    with pytest.raises(ValueError):
+        period_bounds('fortnight', DAY)
+
+def test_rollups_match_streaming(storage, make_activities):
+    """Tests that the rollups give the same report as reading every activity, as data changes"""
+    storage.save_activities(make_activities(0, 300))
+    for period in ('day', 'week', 'month', 'year'):
+        assert build_report(storage, period, DAY) == build_report(storage, period, DAY, use_rollups=False)
+
+    # New activities are just folded in
+    storage.save_activities(make_activities(300, 20))
+    assert UsageRollups(storage).refresh() == {'activities': 20, 'days': 0}
+
+    # and a deleted day is re-derived
+    storage.save_activities(make_activities(320, 30))
+    day_start, _ = period_bounds('day', DAY)
+    storage.delete_activities(day_start, day_start + 86400)
+    refreshed = UsageRollups(storage).refresh()
+    assert refreshed['activities'] == 30 and refreshed['days'] >= 1
+    report = build_report(storage, 'month', DAY)
+    assert report == build_report(storage, 'month', DAY, use_rollups=False)
+    assert report['activities'] == len(storage.get_activities(0, 2e9))
+    assert DAY.isoformat() not in report['timeline']
+
+def test_rollups_follow_stretched_activities(storage, make_activities):
+    """Tests that a resend stretching an already folded activity is picked up"""
+    activities = make_activities(0, 10)
+    storage.save_activities(activities)
+    build_report(storage, 'week', DAY)
+    storage.save_activity(dict(activities[3], end_time=activities[3]['end_time'] + 600,
+                               duration=activities[3]['duration'] + 600))
+    assert UsageRollups(storage).refresh()['days'] == 1
+    report = build_report(storage, 'week', DAY)
+    assert report['total_seconds'] == sum(a['duration'] for a in activities) + 600
+    assert report == build_report(storage, 'week', DAY, use_rollups=False)
+
+@pytest.mark.parametrize('downsample', [False, True])
+def test_rollups_after_cleanup(make_storage, make_activities, downsample):
+    """Tests that days cleaned out of the activities table (or downsampled) leave the rollups too"""
+    storage = make_storage(downsample=downsample)
+    storage._hot_window_start = lambda: 0
+    storage.save_activities(make_activities(0, 300))
+    build_report(storage, 'month', DAY)
+    cutoff = START + 3 * 86400 + 600
+    storage._hot_window_start = lambda: cutoff
+    storage.cleanup_old_data()
+    assert build_report(storage, 'month', DAY) == build_report(storage, 'month', DAY, use_rollups=False)
+    assert storage.connection.execute(
+        "SELECT COUNT(*) FROM usage_rollups WHERE day_start < ?", (cutoff - 86400,)).fetchone()[0] == 0
+
+def test_rollups_with_local_days_off_utc(storage, make_activities, monkeypatch):
+    """Tests that periods starting mid UTC day read their part-days from the activities"""
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    try:
+        storage.save_activities(make_activities(0, 300))
+        for period in ('day', 'week', 'month', 'year'):
+            assert build_report(storage, period, DAY) == build_report(storage, period, DAY, use_rollups=False)
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+def test_report_contents(storage, make_activities):
+    activities = make_activities(0, 48)
+    storage.save_activities(activities)
+    report = build_report(storage, 'week', DAY, top=2)
+    assert report['activities'] == 48
+    assert report['total_seconds'] == sum(a['duration'] for a in activities)
+    totals = {}
+    for activity in activities:
+        domain = activity['url'].split('/')[2]
+        totals[domain] = totals.get(domain, 0) + activity['duration']
+    assert [(row['domain'], row['seconds']) for row in report['top_domains']] == \
+        sorted(totals.items(), key=lambda item: item[1], reverse=True)[:2]
+    assert {row['browser'] for row in report['browsers']} == {'chromium_desktop', 'gecko_desktop'}
+    assert sum(report['hours']) == report['total_seconds']
+    assert list(report['timeline']) == ['2024-03-11']
+
+def test_archived_activities_streamed(make_storage, make_activities, tmp_path):
+    """Tests that a report reaching into the archive, read in small batches, matches the hot one"""
+    storage = make_storage(downsample=False, archive_dir=str(tmp_path / "archive"))
+    storage.save_activities(make_activities(0, 300))
+    storage._hot_window_start = lambda: 0
+    expected = build_report(storage, 'month', DAY, use_rollups=False)
+    storage._hot_window_start = lambda: 2e9
+    storage.cleanup_old_data()
+    assert storage.connection.execute("SELECT COUNT(*) FROM activities").fetchone()[0] == 0
+    assert build_report(storage, 'month', DAY, use_rollups=False, batch_size=7) == expected
+
+def test_names_decrypted(make_storage, make_activities):
+    storage = make_storage(downsample=False, cipher=ActivityCipher(ActivityCipher.generate_key()))
+    storage._hot_window_start = lambda: 0
+    storage.save_activities(make_activities(0, 10))
+    report = build_report(storage, 'week', DAY)
+    assert {row['domain'] for row in report['top_domains']} == {f'site{i}.com' for i in range(5)}
@@ -0,0 +1,65 @@
+import pytest
+from backend.database.sessions import SessionStitcher
+
+@pytest.fixture
+def stitcher(storage):
+    return SessionStitcher(storage, gap_seconds=30)
+
+def test_short_switch_merged(storage, stitcher, make_activity):
+    """Tests that a quick switch away and back stays one session"""
+    storage.save_activities([
+        make_activity(1000, 1100),
+        make_activity(1100, 1102, url='https://chat.com/', tab_id='tab2'),
+        make_activity(1102, 1300),
+    ])
+    sessions = stitcher.get_sessions(0, 5000, domain='example.com')
+    assert len(sessions) == 1
+    assert sessions[0]['start_time'] == 1000 and sessions[0]['end_time'] == 1300
+    assert sessions[0]['duration'] == 298
+    assert sessions[0]['activity_count'] == 2
+
+def test_long_gap_splits(storage, stitcher, make_activity):
+    """Tests that a gap over the threshold starts a new session"""
+    storage.save_activity(make_activity(1000, 1100))
+    storage.save_activity(make_activity(1200, 1300))
+    assert len(stitcher.get_sessions(0, 5000)) == 2
+
+def test_retried_batch_not_double_counted(storage, stitcher, make_activity):
+    """Tests that duplicate inserts don't inflate session durations"""
+    batch = [make_activity(1000, 1100), make_activity(1110, 1200)]
+    storage.save_activities(batch)
+    storage.save_activities(batch)
+    sessions = stitcher.get_sessions(0, 5000)
+    assert len(sessions) == 1
+    assert sessions[0]['duration'] == 190
+
+def test_stretched_activity_extends_session(storage, stitcher, make_activity):
+    """Tests that a resend with a later end time adds just the extra time"""
+    storage.save_activity(make_activity(1000, 1100))
+    storage.save_activities([make_activity(1000, 1300), make_activity(1000, 1200)])
+    sessions = stitcher.get_sessions(0, 5000)
+    assert [(s['end_time'], s['duration'], s['activity_count']) for s in sessions] == [(1300, 300, 1)]
+    assert stitcher.rebuild() == 1
+    assert stitcher.get_sessions(0, 5000)[0]['duration'] == 300
+
+def test_rebuild_matches_incremental(storage, stitcher, make_activity):
+    """Tests that a full re-stitch gives the same sessions as incremental updates"""
+    storage.save_activities([
+        make_activity(1000, 1100),
+        make_activity(1120, 1200),
+        make_activity(1150, 1160, url='https://other.org/', tab_id='tab2'),
+        make_activity(5000, 5100),
+    ])
+    incremental = {(s['domain'], s['start_time'], s['end_time'], s['duration'])
+                   for s in stitcher.get_sessions(0, 10000)}
+
+    assert stitcher.rebuild() == 3
+    rebuilt = {(s['domain'], s['start_time'], s['end_time'], s['duration'])
+               for s in stitcher.get_sessions(0, 10000)}
+    assert rebuilt == incremental
+
+def test_min_duration_filter(storage, stitcher, make_activity):
+    """Tests filtering out short sessions"""
+    storage.save_activity(make_activity(1000, 1005))
+    storage.save_activity(make_activity(2000, 2600, url='https://long.com/'))
+    assert [s['domain'] for s in stitcher.get_sessions(0, 5000, min_duration=60)] == ['long.com']
@@ -0,0 +1,71 @@
+import math
+import random
+import pytest
+from backend.utils.sketches import HyperLogLog, LogHistogram
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+def test_quantiles_within_relative_error():
+    rng = random.Random(7)
+    values = [rng.lognormvariate(3, 1.5) for _ in range(20000)]
+    sketch = LogHistogram(relative_accuracy=0.01)
+    sketch.update(values)
+    for q in (0.01, 0.5, 0.9, 0.99, 0.999):
+        exact = exact_quantile(values, q)
+        assert abs(sketch.quantile(q) - exact) <= 0.0101 * exact
+    assert sketch.quantile(0) == min(values) and sketch.quantile(1) == max(values)
+    assert sketch.count == len(values) and sketch.mean() == pytest.approx(sum(values) / len(values))
+    # A handful of buckets, not 20000 values
+    assert len(sketch.buckets) < 700
+
+def test_merge_matches_one_sketch():
+    rng = random.Random(3)
+    days = [[rng.expovariate(1 / 60) for _ in range(500)] for _ in range(7)]
+    whole = LogHistogram()
+    whole.update(v for day in days for v in day)
+    merged = LogHistogram()
+    for day in days:
+        part = LogHistogram()
+        part.update(day)
+        merged.merge(LogHistogram.from_bytes(part.to_bytes()))
+    assert merged.buckets == whole.buckets and merged.zero_count == whole.zero_count
+    assert merged.quantile(0.9) == whole.quantile(0.9)
+    with pytest.raises(ValueError):
+        merged.merge(LogHistogram(relative_accuracy=0.02))
+
+def test_zeros_and_empty():
+    sketch = LogHistogram()
+    assert sketch.quantile(0.5) is None
+    restored = LogHistogram.from_bytes(sketch.to_bytes())
+    assert restored.count == 0 and restored.min == math.inf
+    sketch.update([0, 0, 0, 10])
+    assert sketch.quantile(0.5) == 0 and sketch.quantile(1) == 10
+
+def test_hyperloglog_within_error_bound():
+    for n in (100, 5000, 200000):
+        sketch = HyperLogLog()
+        for i in range(n):
+            sketch.add(f'https://site{i}.com/')
+        # Three standard errors
+        assert abs(sketch.count() - n) <= 3 * sketch.standard_error * n + 1
+    assert HyperLogLog().count() == 0
+
+def test_hyperloglog_union():
+    days = []
+    for day in range(10):
+        sketch = HyperLogLog()
+        # Overlapping sets: day d sees values d*500 .. d*500+999
+        for i in range(day * 500, day * 500 + 1000):
+            sketch.add(str(i))
+        days.append(sketch.to_bytes())
+    union = HyperLogLog()
+    for blob in days:
+        union.merge_bytes(blob)
+    assert abs(union.count() - 5500) <= 3 * union.standard_error * 5500
+    # Merging serialised or built sketches gives the same registers
+    rebuilt = HyperLogLog()
+    for blob in days:
+        rebuilt.merge(HyperLogLog.from_bytes(blob))
+    assert rebuilt.registers == union.registers
@@ -0,0 +1,86 @@
+import pytest
+import os
+import threading
+from backend.database.snapshot import create_snapshot, restore_snapshot
+
+@pytest.fixture
+def nth_activity(make_activity):
+    """The i-th of a run of five second visits, ten seconds apart"""
+    def nth(i):
+        return make_activity(1000 + i * 10, 1005 + i * 10, url=f'https://site{i % 50}.com/page/{i}',
+                             tab_id=f'tab{i % 9}')
+    return nth
+
+@pytest.fixture
+def storage(make_storage, nth_activity):
+    storage = make_storage("live.db")
+    storage.save_activities([nth_activity(i) for i in range(2000)])
+    return storage
+
+def count(storage):
+    return storage.connection.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+
+@pytest.mark.parametrize('compress', [None, 'gzip', 'lzma'])
+def test_snapshot_and_restore(storage, make_storage, tmp_path, compress):
+    """Tests that a snapshot restores to exactly what was there"""
+    dest = str(tmp_path / "backup.snap")
+    stats = storage.snapshot(dest, pages=8, compress=compress)
+    assert stats['pages'] > 8 and stats['written'] == os.path.getsize(dest)
+    if compress:
+        assert stats['written'] < stats['bytes']
+
+    # A single file, no -wal/-shm next to it
+    assert not os.path.exists(f"{dest}-wal")
+
+    restored = str(tmp_path / "restored.db")
+    restore_snapshot(dest, restored)
+    copy = make_storage("restored.db")
+    assert count(copy) == 2000
+    assert copy.get_activities(0, 1e9) == storage.get_activities(0, 1e9)
+
+def test_writes_during_snapshot(storage, make_storage, nth_activity, tmp_path):
+    """Tests that commits mid-backup neither block nor leak into the snapshot"""
+    written = []
+
+    def write_some():
+        writer = make_storage("live.db")
+        for i in range(2000, 2050):
+            written.append(writer.save_activity(nth_activity(i)))
+        writer.close()
+
+    # Sleep between steps, so the writer gets in while the copy is half done
+    thread = threading.Thread(target=write_some)
+    dest = str(tmp_path / "backup.db")
+    thread.start()
+    create_snapshot(str(storage.db_path), dest, pages=4, sleep=0.001)
+    thread.join()
+
+    assert all(written)
+    assert count(storage) == 2050
+    restored = str(tmp_path / "restored.db")
+    restore_snapshot(dest, restored)
+    # Some point-in-time between before and after the writes
+    assert 2000 <= count(make_storage("restored.db")) <= 2050
+
+def test_restore_replaces_live_data(storage, make_storage, nth_activity, tmp_path):
+    dest = str(tmp_path / "backup.db")
+    storage.snapshot(dest)
+    storage.save_activities([nth_activity(i) for i in range(2000, 2100)])
+    db_path = str(storage.db_path)
+    storage.close()
+
+    restore_snapshot(dest, db_path)
+    assert count(make_storage("live.db")) == 2000
+
+def test_damaged_snapshot_rejected(tmp_path):
+    """Tests that a damaged snapshot never touches the target"""
+    bad = tmp_path / "bad.db"
+    bad.write_bytes(b"SQLite format 3\x00" + b"\x00" * 200)
+    target = tmp_path / "target.db"
+    with pytest.raises(ValueError):
+        restore_snapshot(str(bad), str(target))
+
+def test_failed_snapshot_leaves_nothing(storage, tmp_path):
+    with pytest.raises(ValueError):
+        storage.snapshot(str(tmp_path / "backup.db"), compress='zip')
+    assert os.listdir(tmp_path) == [name for name in os.listdir(tmp_path) if name.startswith('live.db')]
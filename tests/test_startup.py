@@ -0,0 +1,57 @@
+import pytest
+import json
+import subprocess
+import sys
+import time
+from backend.core.browsers.chromium_tracker import ChromiumTracker
+from backend.core.activity_tracker import PlatformType
+
+# Modules that shouldn't be needed just to import a tracker
+HEAVY_MODULES = ['cryptography', 'json', 'lzma', 'sqlite3']
+
+@pytest.fixture
+def big_state(tmp_path):
+    """A saved state file with lots of open tabs"""
+    db_path = str(tmp_path / "startup.db")
+    with open(f"{db_path}.state", 'w') as f:
+        json.dump({
+            'active_tabs': {f'tab{i}': {'start_time': time.time(), 'url': 'https://example.com'}
+                            for i in range(500)},
+            'last_active': {'tab_id': 'tab1', 'url': 'https://example.com'}
+        }, f)
+    return db_path
+
+@pytest.fixture
+def tracker(big_state):
+    """A tracker on the saved state, closed after the test"""
+    tracker = ChromiumTracker(platform_type=PlatformType.DESKTOP.value, db_path=big_state)
+    yield tracker
+    tracker.close()
+
+def test_tracker_import_stays_light():
+    """Tests that importing the trackers doesn't drag in heavy modules"""
+    code = (
+        "import sys\n"
+        "import backend.core.browsers.chromium_tracker, backend.core.browsers.gecko_tracker, "
+        "backend.core.browsers.webkit_tracker\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ''
+
+def test_state_loaded_lazily(tracker):
+    """Tests that construction doesn't read the state file"""
+    assert tracker._state_loaded is False
+
+    # First look at the state loads it
+    assert len(tracker.active_tabs) == 500
+    assert tracker._state_loaded is True
+
+def test_first_event_loads_state(tracker):
+    """Tests that the first event still sees the previous state"""
+    tracker.handle_tab_activated({'url': 'https://new.com', 'tab_id': 'tab2', 'window_id': 'w1'})
+
+    # tab1 was last active, so it got closed; everything else is still open
+    assert 'tab1' not in tracker.active_tabs
+    assert 'tab2' in tracker.active_tabs
+    assert len(tracker.active_tabs) == 499
@@ -214,4 +214,35 @@ def test_connection_handling(storage, sample_activity):
     storage.close()
     # Create new connection attempt after close
     with pytest.raises(Exception):
-        storage.connection.execute("SELECT 1") 
\ No newline at end of file
+        storage.connection.execute("SELECT 1") 
+
+def test_retried_batch_is_noop(storage, sample_activity):
+    """Tests that re-sending the same batch doesn't duplicate rows"""
+    batch = [
+        dict(sample_activity, tab_id='tab1'),
+        dict(sample_activity, tab_id='tab2', url='https://example2.com'),
+    ]
+    assert storage.save_activities(batch) == True
+    assert storage.save_activities(batch) == True
+
+    cursor = storage.connection.execute("SELECT COUNT(*) FROM activities")
+    assert cursor.fetchone()[0] == 2
+
+def test_resend_extends_activity(storage, sample_activity):
+    """Tests that a resend with a later end time updates the existing row"""
+    storage.save_activity(dict(sample_activity, tab_id='tab1'))
+    longer = dict(sample_activity, tab_id='tab1',
+                  end_time=sample_activity['end_time'] + 30, duration=90)
+    storage.save_activity(longer)
+
+    activities = storage.get_activities(0, datetime.now().timestamp() + 3600)
+    assert len(activities) == 1
+    assert activities[0]['duration'] == 90
+
+def test_same_start_different_devices(storage, sample_activity):
+    """Tests that identical activities from two devices are both kept"""
+    storage.save_activity(dict(sample_activity, device_id='laptop'))
+    storage.save_activity(dict(sample_activity, device_id='phone'))
+
+    cursor = storage.connection.execute("SELECT COUNT(*) FROM activities")
+    assert cursor.fetchone()[0] == 2
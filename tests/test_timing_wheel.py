@@ -0,0 +1,79 @@
+import pytest
+from datetime import datetime
+import os
+from backend.core.timing_wheel import TimingWheel
+from backend.core.activity_tracker import ActivityTracker, BrowserType, PlatformType
+
+@pytest.fixture
+def tracker():
+    """Creates a tracker with a short idle timeout and a small tab cap"""
+    tracker = ActivityTracker("test_idle.db", idle_timeout=60, max_active_tabs=3)
+    yield tracker
+    tracker.close()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(f"test_idle.db{suffix}"):
+            os.remove(f"test_idle.db{suffix}")
+
+def make_tab(tab_id):
+    return {
+        'url': f'https://{tab_id}.example.com',
+        'browser_type': BrowserType.CHROMIUM_DESKTOP.value,
+        'platform_type': PlatformType.DESKTOP.value,
+        'tab_id': tab_id,
+        'window_id': 'window1'
+    }
+
+def test_wheel_fires_in_order():
+    """Tests that timers come out once due, earliest first"""
+    wheel = TimingWheel(tick_seconds=1, slots=8, now=0)
+    wheel.schedule('b', 5)
+    wheel.schedule('a', 3)
+    wheel.schedule('far', 30)  # More than one turn of the wheel away
+
+    assert wheel.advance(2) == []
+    assert wheel.advance(6) == [('a', 3), ('b', 5)]
+    assert 'far' in wheel and len(wheel) == 1
+    assert wheel.advance(100) == [('far', 30)]
+
+def test_wheel_reschedule_and_cancel():
+    """Tests that rescheduling moves a timer and cancel removes it"""
+    wheel = TimingWheel(tick_seconds=1, slots=8, now=0)
+    wheel.schedule('tab', 3)
+    wheel.schedule('tab', 10)
+    assert wheel.advance(5) == []
+    assert wheel.cancel('tab') is True
+    assert wheel.advance(20) == []
+    assert wheel.cancel('tab') is False
+
+def test_idle_session_expired(tracker):
+    """Tests that a tab nobody closed gets closed with an estimated end"""
+    tracker.track_tab_change(make_tab('tab1'))
+    start = tracker.active_tabs['tab1']['start_time']
+
+    assert tracker.expire_idle_sessions(start + 3600) == 1
+    assert tracker.active_tabs == {}
+    assert tracker.last_active is None
+
+    activities = tracker.storage.get_activities(0, start + 7200)
+    assert len(activities) == 1
+    assert activities[0]['duration'] == pytest.approx(60)
+
+def test_recent_session_kept(tracker):
+    """Tests that a tab still within the timeout stays open"""
+    tracker.track_tab_change(make_tab('tab1'))
+    start = tracker.active_tabs['tab1']['start_time']
+    assert tracker.expire_idle_sessions(start + 30) == 0
+    assert 'tab1' in tracker.active_tabs
+
+def test_active_tabs_capped(tracker):
+    """Tests that dangling sessions can't grow past max_active_tabs"""
+    # Tabs that went to the background without a deactivation event
+    for i in range(3):
+        tracker.active_tabs[f'ghost{i}'] = {'start_time': datetime.now().timestamp() - 10 + i,
+                                           'url': 'https://ghost.com', 'browser_type': 'x'}
+        tracker._idle_timers.schedule(f'ghost{i}', tracker.active_tabs[f'ghost{i}']['start_time'] + 60)
+
+    tracker.track_tab_change(make_tab('tab1'))
+    assert len(tracker.active_tabs) == 3
+    assert 'ghost0' not in tracker.active_tabs
+    assert 'tab1' in tracker.active_tabs
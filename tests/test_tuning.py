@@ -0,0 +1,58 @@
+import json
+import pytest
+from backend.core.activity_tracker import PlatformType
+from backend.database.tuning import (PROFILES, calibrate, calibrated_profile_path,
+                                     candidate_profiles, record_profile, resolve_profile)
+
+def test_platform_profile_applied(make_storage):
+    """Tests that a new database gets its platform's settings"""
+    storage = make_storage("mobile.db", PlatformType.MOBILE.value)
+    connection = storage.connection
+    assert connection.execute("PRAGMA cache_size").fetchone()[0] == PROFILES['mobile']['cache_size']
+    assert connection.execute("PRAGMA wal_autocheckpoint").fetchone()[0] == 250
+    assert connection.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+
+def test_page_size_only_on_new_database(make_storage):
+    storage = make_storage("server.db", tuning_profile='server')
+    assert storage.tuning['page_size'] == 8192
+    storage.close()
+
+    # Already in WAL with tables - the page size stays what it was
+    storage = make_storage("server.db", tuning_profile='desktop')
+    assert storage.tuning['page_size'] == 8192
+    assert storage.tuning['cache_size'] == PROFILES['desktop']['cache_size']
+
+def test_bad_settings_rejected():
+    """Tests that nothing unchecked reaches a PRAGMA"""
+    with pytest.raises(ValueError):
+        resolve_profile('laptop', 'desktop')
+    with pytest.raises(ValueError):
+        resolve_profile({'synchronous': 'NORMAL; DROP TABLE activities'}, 'desktop')
+    with pytest.raises(ValueError):
+        resolve_profile({'page_size': 5000}, 'desktop')
+    with pytest.raises(ValueError):
+        resolve_profile({'journal_mode': 'OFF'}, 'desktop')
+
+def test_calibration_recorded_and_used(make_storage, tmp_path):
+    """Tests that calibration ranks candidates and the winner gets picked up"""
+    db_path = tmp_path / "activity.db"
+    results = calibrate('desktop', directory=str(tmp_path), rows=500, switches=20, scans=10)
+    assert [r['name'] for r in results] != []
+    assert sorted(r['name'] for r in results) == sorted(candidate_profiles('desktop'))
+    assert results == sorted(results, key=lambda r: r['score'])
+
+    winner = dict(results[0], settings=dict(results[0]['settings'], cache_size=-4321))
+    path = record_profile(db_path, winner)
+    assert path == calibrated_profile_path(db_path)
+    assert json.load(open(path))['name'] == results[0]['name']
+
+    storage = make_storage("activity.db")
+    assert storage.tuning['cache_size'] == -4321
+    # An explicit profile still wins over the recorded one
+    storage = make_storage("activity.db", tuning_profile='mobile')
+    assert storage.tuning['cache_size'] == PROFILES['mobile']['cache_size']
+
+def test_mobile_candidates_stay_small():
+    for settings in candidate_profiles('mobile').values():
+        assert settings['mmap_size'] == 0
@@ -0,0 +1,27 @@
+from backend.core.validation import TAB_INFO, TAB_UPDATE, Schema
+
+def test_schema_checks_presence_and_types():
+    assert TAB_UPDATE.is_valid({'url': 'https://a.com/', 'tab_id': 7, 'window_id': None})
+    assert TAB_INFO.is_valid({'url': 'https://a.com/', 'tab_id': 't1', 'window_id': 'w1',
+                              'browser_type': 'chromium_desktop', 'title': None})
+    assert not TAB_UPDATE.is_valid({'url': 'https://a.com/', 'tab_id': 't1'})
+    assert not TAB_UPDATE.is_valid({'url': None, 'tab_id': 't1', 'window_id': 'w1'})
+    assert not TAB_UPDATE.is_valid({'url': 'https://a.com/', 'tab_id': True, 'window_id': 'w1'})
+    assert not TAB_UPDATE.is_valid({'url': 'https://a.com/', 'tab_id': 't1', 'window_id': 'w1',
+                                    'incognito': 'yes'})
+    assert not TAB_UPDATE.is_valid(['https://a.com/'])
+
+def test_batch_reports_every_reason():
+    schema = Schema('visit', {'url': (str,), 'tab_id': (str, int)}, {'title': (str,)})
+    batch = [
+        {'url': 'https://a.com/', 'tab_id': 1},
+        {'tab_id': 1.5, 'title': 3},
+        'not an event',
+        {'url': 'https://b.com/', 'tab_id': 't2', 'title': 'B'},
+    ]
+    valid, rejected = schema.validate_batch(batch)
+    assert valid == [batch[0], batch[3]]
+    assert rejected == {
+        1: ["url: missing", "tab_id: expected str or int, got float", "title: expected str, got int"],
+        2: ["expected an object, got str"],
+    }
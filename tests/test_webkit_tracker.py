@@ -1,24 +1,17 @@
 import pytest
 from datetime import datetime
-import os
 from backend.core.browsers.webkit_tracker import WebKitTracker
 from backend.core.activity_tracker import BrowserType, PlatformType
 
 @pytest.fixture
-def desktop_tracker():
+def desktop_tracker(make_tracker):
     """Creates a desktop Safari tracker"""
-    tracker = WebKitTracker(platform_type=PlatformType.DESKTOP.value, db_path="test_desktop.db")
-    yield tracker
-    if os.path.exists("test_desktop.db.state"):
-        os.remove("test_desktop.db.state")
+    return make_tracker(WebKitTracker, PlatformType.DESKTOP.value, BrowserType.WEBKIT_DESKTOP.value)
 
 @pytest.fixture
-def ios_tracker():
+def ios_tracker(make_tracker):
     """Creates an iOS Safari tracker"""
-    tracker = WebKitTracker(platform_type=PlatformType.MOBILE.value, db_path="test_mobile.db")
-    yield tracker
-    if os.path.exists("test_mobile.db.state"):
-        os.remove("test_mobile.db.state")
+    return make_tracker(WebKitTracker, PlatformType.MOBILE.value, BrowserType.WEBKIT_MOBILE.value)
 
 @pytest.fixture
 def sample_tab():